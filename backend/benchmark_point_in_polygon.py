@@ -0,0 +1,94 @@
+"""
+ポリゴン内判定のベンチマーク
+旧実装（1点ずつのRay casting）と polygon_filter の一括判定（contains_xy / NumPy偶奇規則）を比較する
+使い方: python benchmark_point_in_polygon.py [点数]
+"""
+import math
+import sys
+import time
+
+import numpy as np
+
+from services.polygon_filter import even_odd_contains, points_in_polygon, polygon_rings, to_geometry
+
+
+def legacy_point_in_polygon(point: tuple, polygon: list) -> bool:
+    """旧実装（AnalysisService._point_in_polygon のRay casting）"""
+    x, y = point
+    n = len(polygon)
+    inside = False
+
+    p1x, p1y = polygon[0]
+    for i in range(1, n + 1):
+        p2x, p2y = polygon[i % n]
+        if y > min(p1y, p2y):
+            if y <= max(p1y, p2y):
+                if x <= max(p1x, p2x):
+                    if p1y != p2y:
+                        xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+                    if p1x == p2x or x <= xinters:
+                        inside = not inside
+        p1x, p1y = p2x, p2y
+
+    return inside
+
+
+def _star_polygon(center_lon, center_lat, radius, vertices=64):
+    """ベンチマーク用の凹多角形（約1km四方）"""
+    coords = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        r = radius * (1.0 if i % 2 == 0 else 0.6)
+        coords.append({'lon': center_lon + r * math.cos(angle), 'lat': center_lat + r * math.sin(angle)})
+    return coords
+
+
+def _timeit(label, fn, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<28} {best * 1000:10.2f} ms")
+    return result, best
+
+
+def run_benchmark(n_points=40000):
+    rng = np.random.default_rng(0)
+    polygon_coords = _star_polygon(141.35, 43.06, 0.006)
+    ring = [(c['lon'], c['lat']) for c in polygon_coords]
+    xs = rng.uniform(141.343, 141.357, n_points)
+    ys = rng.uniform(43.053, 43.067, n_points)
+
+    print(f"点数: {n_points}, 頂点数: {len(ring)}")
+    legacy, t_legacy = _timeit(
+        "旧実装（1点ずつ）",
+        lambda: np.array([legacy_point_in_polygon((x, y), ring) for x, y in zip(xs, ys)]),
+        repeat=1
+    )
+    geom = to_geometry(polygon_coords)
+    shapely_result, t_shapely = _timeit("contains_xy（prepared）", lambda: points_in_polygon(xs, ys, geom))
+    rings = [r for part in polygon_rings(polygon_coords) for r in part]
+    numpy_result, t_numpy = _timeit("NumPy偶奇規則", lambda: even_odd_contains(xs, ys, rings))
+
+    # 境界上の点を除けば結果は一致する
+    print(f"  一致率: contains_xy {np.mean(legacy == shapely_result) * 100:.3f}%, "
+          f"NumPy {np.mean(legacy == numpy_result) * 100:.3f}%")
+    print(f"  高速化: contains_xy x{t_legacy / t_shapely:.0f}, NumPy x{t_legacy / t_numpy:.0f}")
+
+    # 穴あき・マルチポリゴン
+    outer = [(141.340, 43.050), (141.360, 43.050), (141.360, 43.070), (141.340, 43.070)]
+    hole = [(141.345, 43.055), (141.355, 43.055), (141.355, 43.065), (141.345, 43.065)]
+    other = [(141.361, 43.050), (141.365, 43.050), (141.365, 43.054)]
+    multipolygon = {'type': 'MultiPolygon', 'coordinates': [[outer, hole], [other]]}
+    xs2 = rng.uniform(141.338, 141.367, n_points)
+    ys2 = rng.uniform(43.048, 43.072, n_points)
+    a = points_in_polygon(xs2, ys2, multipolygon)
+    b = even_odd_contains(xs2, ys2, [r for part in polygon_rings(multipolygon) for r in part])
+    print(f"穴あきマルチポリゴン: 内側 {int(a.sum())} 点, contains_xy/NumPy一致率 {np.mean(a == b) * 100:.3f}%")
+
+
+if __name__ == "__main__":
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 40000)
@@ -0,0 +1,93 @@
+"""
+小班ポリゴン（shouhan_simple.geojson）からベクトルタイル（MVT）キャッシュを事前生成するスクリプト
+出力: data/administrative/rinsyousigen/tiles/{z}/{x}/{y}.pbf と metadata.json
+"""
+import json
+import os
+from pathlib import Path
+
+from shapely.geometry import shape, box
+from shapely.strtree import STRtree
+
+from services.geojson_stream import iter_features
+from services.tile_service import (
+    TileService, TILE_BUFFER, TILE_EXTENT, tile_bounds_lonlat, tiles_for_bounds
+)
+
+LAYER_NAME = "shouhan"
+
+
+def build_forest_tiles(input_file, output_dir, min_zoom=8, max_zoom=14):
+    """小班ポリゴンをズームごとにクリップ・簡略化してタイル化"""
+    print(f"小班GeoJSONを読み込みます: {input_file}")
+    geometries = []
+    properties = []
+    for feature in iter_features(input_file):
+        if not feature.get('geometry'):
+            continue
+        geometries.append(shape(feature['geometry']))
+        properties.append(feature.get('properties') or {})
+
+    print(f"フィーチャー数: {len(geometries)}")
+    tree = STRtree(geometries)
+
+    min_lon = min(g.bounds[0] for g in geometries)
+    min_lat = min(g.bounds[1] for g in geometries)
+    max_lon = max(g.bounds[2] for g in geometries)
+    max_lat = max(g.bounds[3] for g in geometries)
+    bounds = (min_lon, min_lat, max_lon, max_lat)
+    print(f"範囲: {bounds}")
+
+    tile_service = TileService(output_dir)
+    total_tiles = 0
+    total_bytes = 0
+
+    for z in range(min_zoom, max_zoom + 1):
+        zoom_tiles = 0
+        for x, y in tiles_for_bounds(bounds, z):
+            # バッファ分を含めた範囲で候補を検索
+            t_min_lon, t_min_lat, t_max_lon, t_max_lat = tile_bounds_lonlat(z, x, y)
+            pad_lon = (t_max_lon - t_min_lon) * TILE_BUFFER / TILE_EXTENT
+            pad_lat = (t_max_lat - t_min_lat) * TILE_BUFFER / TILE_EXTENT
+            query_box = box(t_min_lon - pad_lon, t_min_lat - pad_lat,
+                            t_max_lon + pad_lon, t_max_lat + pad_lat)
+
+            indices = tree.query(query_box, predicate='intersects')
+            if len(indices) == 0:
+                continue
+
+            tile = tile_service.render_tile(
+                [(geometries[i], properties[i]) for i in indices], z, x, y, LAYER_NAME
+            )
+            if tile is None:
+                continue
+
+            tile_path = tile_service.tile_path(z, x, y)
+            os.makedirs(tile_path.parent, exist_ok=True)
+            with open(tile_path, 'wb') as f:
+                f.write(tile)
+
+            zoom_tiles += 1
+            total_bytes += len(tile)
+
+        total_tiles += zoom_tiles
+        print(f"  z{z}: {zoom_tiles} タイル")
+
+    metadata = {
+        'name': LAYER_NAME,
+        'format': 'pbf',
+        'minzoom': min_zoom,
+        'maxzoom': max_zoom,
+        'bounds': list(bounds),
+        'feature_count': len(geometries)
+    }
+    with open(Path(output_dir) / 'metadata.json', 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+    print(f"\nタイル生成完了: {total_tiles} タイル, {total_bytes / (1024 * 1024):.2f} MB")
+    print(f"出力先: {output_dir}")
+
+
+if __name__ == "__main__":
+    base_dir = Path("data/administrative/rinsyousigen")
+    build_forest_tiles(base_dir / "shouhan_simple.geojson", base_dir / "tiles")
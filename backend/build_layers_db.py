@@ -0,0 +1,88 @@
+"""
+森林簿の層データ（KEYCODE -> 層行配列）をSQLiteのキー付きストアに変換するスクリプト
+/api/layers はこのDBから1件ずつ読み込む（JSON全体のパースが不要になる）
+出力: data/administrative/rinsyousigen/layers.sqlite3
+"""
+import json
+import os
+import sqlite3
+import zlib
+from pathlib import Path
+
+from services.geojson_stream import iter_object_items
+
+
+def _iter_layer_entries(source: Path):
+    """層データJSON（{keycode14: [層行]}）から (keycode14, layers) を1件ずつ列挙"""
+    print(f"読み込み中: {source}")
+    yield from iter_object_items(source)
+
+
+def _insert_entries(conn, entries, on_conflict: str) -> int:
+    """層行をコンパクトなJSONにしてzlib圧縮で保存"""
+    sql = f"INSERT OR {on_conflict} INTO layers VALUES (?, ?, ?, ?)"
+    count = 0
+    batch = []
+    for keycode14, layers in entries:
+        payload = zlib.compress(
+            json.dumps(layers, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        )
+        batch.append((keycode14, keycode14[:5], len(layers), payload))
+        if len(batch) >= 10000:
+            conn.executemany(sql, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+
+def build_layers_db(split_dir, layers_index_path, output_path):
+    """
+    層データをSQLite（keycode14を主キーとするWITHOUT ROWIDテーブル）に書き出す
+    split_dirがNoneの場合は元の層索引のみから作成
+    """
+    split_dir = Path(split_dir) if split_dir else None
+    layers_index_path = Path(layers_index_path)
+    output_path = Path(output_path)
+
+    # 作り直し中に読み込まれないよう一時ファイルに書いてから置き換える
+    tmp_path = output_path.with_suffix(output_path.suffix + ".tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("""
+        CREATE TABLE layers (
+            keycode14 TEXT PRIMARY KEY,
+            muni_code TEXT NOT NULL,
+            layer_count INTEGER NOT NULL,
+            data BLOB NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+    # 分割ファイルを優先し、分割ファイルにないKEYCODEだけ元の層索引から補う
+    if split_dir is not None and split_dir.exists():
+        for part_file in sorted(split_dir.glob("layers_*.json")):
+            _insert_entries(conn, _iter_layer_entries(part_file), "REPLACE")
+    if layers_index_path.exists():
+        _insert_entries(conn, _iter_layer_entries(layers_index_path), "IGNORE")
+
+    count = conn.execute("SELECT COUNT(*) FROM layers").fetchone()[0]
+    conn.execute("CREATE INDEX idx_layers_muni_code ON layers (muni_code)")
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+    os.replace(tmp_path, output_path)
+
+    file_size = output_path.stat().st_size / (1024 * 1024)
+    print(f"\n層データDB作成完了: {count} 件, {file_size:.2f} MB")
+    print(f"出力先: {output_path}")
+    return output_path
+
+
+if __name__ == "__main__":
+    base_dir = Path("data/administrative/rinsyousigen")
+    build_layers_db(base_dir / "split", base_dir / "layers_index.json", base_dir / "layers.sqlite3")
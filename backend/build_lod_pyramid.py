@@ -0,0 +1,47 @@
+"""
+変換済みの行政区域・河川GeoJSONからLODピラミッド（ズーム帯ごとの簡略化版）を作成するスクリプト
+元データを再変換せずにLODファイルだけ作り直したい場合に使う
+傾斜（slope_lod{n}.geojson / .topojson）は simplify_slope.py が作成する
+（TopoJSONとフィーチャーの並びをそろえるため、空のジオメトリも null として残す）
+"""
+import os
+
+import geopandas as gpd
+
+from services.lod_service import write_lod_pyramid
+
+# (レイヤー名, 入力候補（精度の高い順）, 出力ディレクトリ)
+LOD_SOURCES = [
+    ("admin", ["data/administrative/N03-20250101_01.geojson",
+               "data/administrative/admin_simple.geojson"], "data/administrative"),
+    ("rivers", ["data/administrative/kasen/rivers.geojson",
+                "data/administrative/kasen/rivers_simple.geojson"], "data/administrative/kasen"),
+]
+
+
+def build_lod_pyramid(name, candidates, output_dir):
+    """1レイヤー分のLODピラミッドを作成"""
+    input_file = next((p for p in candidates if os.path.exists(p)), None)
+    if input_file is None:
+        print(f"{name}: 入力ファイルが見つかりません: {candidates}")
+        return
+
+    print(f"\n{name}: {input_file}")
+    try:
+        gdf = gpd.read_file(input_file)
+    except Exception as e:
+        print(f"  エラー: {e}")
+        return
+
+    if gdf.crs and gdf.crs.to_epsg() != 4326:
+        print(f"  座標系を変換: {gdf.crs} -> EPSG:4326")
+        gdf = gdf.to_crs(epsg=4326)
+
+    print(f"  レコード数: {len(gdf)}")
+    write_lod_pyramid(gdf, output_dir, name)
+
+
+if __name__ == "__main__":
+    for name, candidates, output_dir in LOD_SOURCES:
+        build_lod_pyramid(name, candidates, output_dir)
+    print("\n✅ LODピラミッド作成完了（傾斜は simplify_slope.py で作成してください）")
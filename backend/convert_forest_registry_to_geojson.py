@@ -9,6 +9,8 @@ import json
 import os
 from pathlib import Path
 
+from build_layers_db import build_layers_db
+
 def normalize_keycode(val):
     """
     KEYCODEを14桁文字列に正規化
@@ -169,6 +171,7 @@ def convert_forest_registry():
     出力:
       - shouhan.geojson: 小班ポリゴン（KEYCODE含む）
       - layers_index.json: {keycode14: [層行配列]}
+      - layers.sqlite3: 層索引のキー付きストア（/api/layers用）
     """
     base_dir = Path("data/administrative/rinsyousigen")
     
@@ -180,6 +183,7 @@ def convert_forest_registry():
     # 出力ファイル
     output_geojson = base_dir / "shouhan.geojson"
     output_layers_json = base_dir / "layers_index.json"
+    output_layers_db = base_dir / "layers.sqlite3"
     
     # ===== 0. コードマスタ読み込み =====
     code_masters = {}
@@ -193,7 +197,7 @@ def convert_forest_registry():
         print(f"エラー: {shp_path} が見つかりません")
         return
     
-    print(f"[1/5] Shapefile読み込み: {shp_path}")
+    print(f"[1/6] Shapefile読み込み: {shp_path}")
     gdf = gpd.read_file(shp_path, encoding='shift-jis')
     print(f"  ポリゴン数: {len(gdf)}")
     print(f"  元の座標系: {gdf.crs}")
@@ -218,7 +222,7 @@ def convert_forest_registry():
         print(f"エラー: {excel_path} が見つかりません")
         return
     
-    print(f"[2/5] Excel読み込み: {excel_path}")
+    print(f"[2/6] Excel読み込み: {excel_path}")
     # 最初のシートを読み込み（シート名が不明な場合）
     df_excel = pd.read_excel(excel_path, sheet_name=0, dtype=str)
     print(f"  行数: {len(df_excel)}")
@@ -240,7 +244,7 @@ def convert_forest_registry():
         df_excel['複層区分コード_sort'] = 0
     
     # ===== 3. 層索引を作成 =====
-    print("[3/5] 層索引を作成中...")
+    print("[3/6] 層索引を作成中...")
     layers_index = {}
     
     for keycode14, group in df_excel.groupby('keycode14'):
@@ -275,23 +279,28 @@ def convert_forest_registry():
     print(f"  例: {list(layers_index.keys())[0]} → {len(layers_index[list(layers_index.keys())[0]])} 層")
     
     # ===== 4. GeoJSON出力 =====
-    print(f"[4/5] GeoJSON出力: {output_geojson}")
+    print(f"[4/6] GeoJSON出力: {output_geojson}")
     gdf.to_file(output_geojson, driver='GeoJSON', encoding='utf-8')
     
     file_size = output_geojson.stat().st_size / (1024 * 1024)
     print(f"  ✓ GeoJSON出力完了: {file_size:.2f} MB")
     
     # ===== 5. 層索引JSON出力 =====
-    print(f"[5/5] 層索引JSON出力: {output_layers_json}")
+    print(f"[5/6] 層索引JSON出力: {output_layers_json}")
     with open(output_layers_json, 'w', encoding='utf-8') as f:
         json.dump(layers_index, f, ensure_ascii=False, indent=2)
     
     file_size = output_layers_json.stat().st_size / (1024 * 1024)
     print(f"  ✓ 層索引JSON出力完了: {file_size:.2f} MB")
     
+    # ===== 6. 層索引DB出力 =====
+    print(f"[6/6] 層索引DB出力: {output_layers_db}")
+    build_layers_db(None, output_layers_json, output_layers_db)
+    
     print("\n✅ 変換完了")
     print(f"  - 小班GeoJSON: {output_geojson}")
     print(f"  - 層索引JSON: {output_layers_json}")
+    print(f"  - 層索引DB: {output_layers_db}")
 
 if __name__ == "__main__":
     convert_forest_registry()
@@ -5,6 +5,8 @@ import geopandas as gpd
 import os
 import zipfile
 
+from services.lod_service import write_lod_pyramid
+
 # ZIPファイルのパス
 zip_path = "data/administrative/N03-20250101_01_GML.zip"
 output_dir = "data/administrative"
@@ -54,11 +56,13 @@ for gml_file in gml_files:
             print(f"  座標系を変換: {gdf.crs} -> EPSG:4326")
             gdf = gdf.to_crs('EPSG:4326')
         
-        # ファイル名から判定
+        # ファイル名から判定（lod_nameはAPIが参照するLODファイル名）
         if 'subprefecture' in gml_file:
             base_name = "hokkaido_admin_subprefecture"
+            lod_name = "admin_subprefecture"
         else:
             base_name = "hokkaido_admin"
+            lod_name = "admin"
         
         # GeoJSONとして保存
         output_file = os.path.join(output_dir, f"{base_name}.geojson")
@@ -74,6 +78,10 @@ for gml_file in gml_files:
         print(f"  簡略化版保存完了: {output_file_simple}")
         print(f"  ファイルサイズ: {os.path.getsize(output_file_simple) / 1024 / 1024:.2f} MB")
         
+        # ズーム帯ごとの簡略化版（LODピラミッド）を作成
+        print(f"  LODピラミッドを作成中...")
+        write_lod_pyramid(gdf, output_dir, lod_name)
+        
     except Exception as e:
         print(f"  エラー: {e}")
         import traceback
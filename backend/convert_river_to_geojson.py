@@ -6,6 +6,8 @@ import os
 import zipfile
 import glob
 
+from services.lod_service import write_lod_pyramid
+
 # 河川データのディレクトリ
 river_dir = "data/administrative/kasen"
 
@@ -61,6 +63,10 @@ for shp_file in shp_files:
         print(f"  簡略化版保存完了: {output_file_simple}")
         print(f"  ファイルサイズ: {os.path.getsize(output_file_simple) / 1024 / 1024:.2f} MB")
         
+        # ズーム帯ごとの簡略化版（LODピラミッド）を作成
+        print(f"  LODピラミッドを作成中...")
+        write_lod_pyramid(gdf, river_dir, "rivers")
+        
     except Exception as e:
         print(f"  エラー: {e}")
         import traceback
@@ -1,11 +1,31 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 import tempfile
+import json
 import os
+from pathlib import Path
 from services.image_service import ImageService
-from services.analysis_service import AnalysisService
+from services.analysis_service import ANALYSIS_VERSION, AnalysisService
+from services.tree_points_format import (
+    NDJSON_MEDIA_TYPE, encode_result, iter_ndjson, negotiate_format
+)
+from services.executor_service import AnalysisExecutor, ExecutorBusyError
+import services.executor_service as analysis_tasks
+from services.job_service import JobStore
+from services.result_store import ResultStore
+from services.cluster_service import ClusterService
+from services.result_cache import ResultCache, analysis_cache_key
+from services.density_service import DensityService, encode_geotiff, encode_result_geotiff, render_heatmap_tile
+from services.tile_service import TileService, is_valid_tile
+from services.layer_index_service import LayerIndexService
+from services.layer_store import LayerStore
+from services.response_service import static_file_response
+from services.lod_service import finest_lod_path, select_lod_path
+from services.preview_service import PreviewService
+from services.upload_service import UploadService, UploadTooLargeError, UploadOffsetError
 
 app = FastAPI(title="材積予測API")
 
@@ -18,8 +38,122 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-image_service = ImageService()
-analysis_service = AnalysisService()
+# 一定サイズ以上の動的レスポンス（/analyze, /api/layers など）をgzip圧縮
+# 事前圧縮済みの静的ファイル（Content-Encoding設定済み）はそのまま配信される
+app.add_middleware(GZipMiddleware, minimum_size=int(os.environ.get("GZIP_MIN_SIZE", "1024")))
+
+# アップロード画像の保存先（複数ワーカーで共有するディレクトリを指定する）
+image_service = ImageService(os.environ.get("UPLOAD_DIR", tempfile.gettempdir()))
+# 地図モードの樹木位置グリッドの間隔（m、ワーカーの解析とヘルスチェックの設定表示で共通）
+TREE_MESH_SIZE_M = float(os.environ.get("TREE_MESH_SIZE_M", "5"))
+analysis_service = AnalysisService(mesh_size_m=TREE_MESH_SIZE_M)
+
+# 非同期解析ジョブ（進捗・結果はワーカーと共有するSQLiteに保存、終了後JOB_TTL秒で削除）
+job_store = JobStore(
+    os.path.join(image_service.upload_dir, "jobs.sqlite3"),
+    ttl=int(os.environ.get("JOB_TTL", "3600")),
+)
+
+# 解析結果の樹木位置（ワーカーが保存し、/results/{result_id}/clusters でズーム別に集計して返す）
+result_store = ResultStore(
+    os.path.join(image_service.upload_dir, "results"),
+    ttl=int(os.environ.get("RESULT_TTL", "3600")),
+)
+cluster_service = ClusterService(
+    result_store,
+    max_bytes=int(os.environ.get("CLUSTER_CACHE_MAX_MB", "256")) * 1024 * 1024,
+)
+# 解析結果の密度ラスター（result_id・セルサイズごとに合計サイズ上限つきのLRUで保持）
+density_service = DensityService(
+    result_store,
+    max_bytes=int(os.environ.get("DENSITY_CACHE_MAX_MB", "256")) * 1024 * 1024,
+)
+DENSITY_DEFAULT_CELL_SIZE_M = 25.0
+
+# 解析（検出・材積計算）はプロセスプールで実行する
+# ANALYSIS_WORKERS=0 の場合はプロセスを使わずスレッドで実行
+# 樹木検出エンジンは各ワーカーで読み込む（TREE_DETECTOR=deepforest でDeepForestを使用）
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", str(min(4, os.cpu_count() or 1))))
+analysis_executor = AnalysisExecutor(
+    max_workers=ANALYSIS_WORKERS,
+    max_pending=int(os.environ.get("ANALYSIS_QUEUE_SIZE", str(max(1, ANALYSIS_WORKERS) * 4))),
+    config={
+        "upload_dir": image_service.upload_dir,
+        "job_db": str(job_store.db_path),
+        "result_dir": str(result_store.result_dir),
+        "result_ttl": result_store.ttl,
+        "detector": os.environ.get("TREE_DETECTOR", "simulated"),
+        "mesh_size_m": TREE_MESH_SIZE_M,
+        "detection": {
+            "patch_size": int(os.environ.get("DETECTION_PATCH_SIZE", "400")),
+            "overlap": int(os.environ.get("DETECTION_PATCH_OVERLAP", "100")),
+            "batch_size": int(os.environ.get("DETECTION_BATCH_SIZE", "8")),
+        },
+    },
+)
+
+# /analyze の結果キャッシュ（同じ入力の再解析を省く）
+# メモリはLRU、ディスクは保存済みの解析結果への索引（ANALYSIS_CACHE_DISK=0 で無効）
+# 期限はクラスター・密度表示で参照する結果の保存期間（RESULT_TTL）を超えないようにする
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get("ANALYSIS_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    ttl=min(int(os.environ.get("ANALYSIS_CACHE_TTL", "3600")), result_store.ttl),
+    result_store=result_store if os.environ.get("ANALYSIS_CACHE_DISK", "1") != "0" else None,
+    index_dir=os.path.join(image_service.upload_dir, "analysis_cache"),
+)
+# 解析方法・検出エンジンの設定が変わったら別のキーになるようバージョンに含める
+ANALYSIS_CACHE_VERSION = json.dumps([
+    ANALYSIS_VERSION,
+    analysis_executor.config["detector"],
+    analysis_executor.config["mesh_size_m"],
+    analysis_executor.config["detection"],
+], sort_keys=True)
+
+# アップロード（チャンク書き込み・サイズ上限・分割アップロード）
+UPLOAD_EXTENSIONS = ('.tif', '.tiff', '.geotiff', '.jpg', '.jpeg', '.png')
+upload_service = UploadService(
+    image_service.upload_dir,
+    max_bytes=int(os.environ.get("MAX_UPLOAD_MB", "10240")) * 1024 * 1024,
+    chunk_size=int(os.environ.get("UPLOAD_CHUNK_MB", "8")) * 1024 * 1024,
+)
+# /image/{file_id} のプレビューPNGキャッシュ（合計サイズで古いものから削除）
+PREVIEW_MAX_SIZE_LIMIT = 8192
+preview_service = PreviewService(
+    os.environ.get("PREVIEW_CACHE_DIR", os.path.join(image_service.upload_dir, "preview_cache")),
+    max_bytes=int(os.environ.get("PREVIEW_CACHE_MAX_MB", "512")) * 1024 * 1024,
+)
+forest_tile_service = TileService(
+    Path(__file__).parent / "data" / "administrative" / "rinsyousigen" / "tiles"
+)
+
+# bbox検索用の参照レイヤー（候補パスは優先順）
+ADMIN_DATA_DIR = Path(__file__).parent / "data" / "administrative"
+LAYER_SOURCES = {
+    "admin": [
+        ADMIN_DATA_DIR / "admin_simple.geojson",
+        ADMIN_DATA_DIR / "N03-20250101_01.geojson",
+    ],
+    "rivers": [
+        ADMIN_DATA_DIR / "kasen" / "rivers_simple.geojson",
+        ADMIN_DATA_DIR / "kasen" / "W05-09_01_6441-jgd_GML.geojson",
+    ],
+    "forest": [
+        ADMIN_DATA_DIR / "rinsyousigen" / "shouhan_simple.geojson",
+    ],
+    "slope": [
+        ADMIN_DATA_DIR / "keisya" / "slope_simple.geojson",
+    ],
+}
+layer_index_service = LayerIndexService(LAYER_SOURCES)
+
+# 森林簿の層データ（KEYCODE -> 層行）
+# layers.sqlite3があればそこから、なければ分割JSONをLRUキャッシュして読み込む
+layer_store = LayerStore(
+    ADMIN_DATA_DIR / "rinsyousigen" / "split",
+    fallback_path=ADMIN_DATA_DIR / "rinsyousigen" / "layers_index.json",
+    max_bytes=int(os.environ.get("LAYER_STORE_MAX_MB", "256")) * 1024 * 1024,
+    db_path=ADMIN_DATA_DIR / "rinsyousigen" / "layers.sqlite3",
+)
 
 
 class BoundingBox(BaseModel):
@@ -42,6 +176,10 @@ class AnalysisRequest(BaseModel):
     forest_registry_id: Optional[str] = None  # 森林簿ID（林班・小班、オプション）
 
 
+class LayersBatchRequest(BaseModel):
+    keycodes: List[str]  # KEYCODE（14桁）のリスト
+
+
 class TreePoint(BaseModel):
     lat: float
     lon: float
@@ -58,15 +196,48 @@ class AnalysisResult(BaseModel):
     tree_points: List[TreePoint] = []  # 樹木位置データ
 
 
+@app.on_event("startup")
+async def load_layer_indexes():
+    """起動時に参照レイヤーの空間インデックスを構築"""
+    # LAYER_INDEX_PRELOAD=admin,rivers のように読み込むレイヤーを限定できる
+    names = os.environ.get("LAYER_INDEX_PRELOAD")
+    layer_index_service.load(names.split(",") if names else None)
+
+
+@app.on_event("startup")
+async def warm_up_layer_store():
+    """起動時に指定した市町村の層データを読み込む"""
+    # LAYER_STORE_WARMUP=01010,01020 または all
+    warmup = os.environ.get("LAYER_STORE_WARMUP")
+    if warmup:
+        layer_store.warm_up(None if warmup == "all" else warmup.split(","))
+
+
+@app.on_event("startup")
+async def start_analysis_executor():
+    """解析ワーカーを起動して検出モデルを読み込んでおく"""
+    analysis_executor.start()
+
+
+@app.on_event("startup")
+async def fail_orphaned_jobs():
+    """前回のプロセスで待機中・実行中のまま中断されたジョブを失敗にする"""
+    job_store.fail_orphaned()
+
+
+@app.on_event("shutdown")
+async def stop_analysis_executor():
+    analysis_executor.shutdown()
+
+
 @app.get("/")
 async def root():
     return {"message": "材積予測API", "version": "0.1.0-MVP"}
 
 
 @app.get("/administrative/boundaries")
-async def get_administrative_boundaries():
-    """行政区域データを取得"""
-    from fastapi.responses import FileResponse
+async def get_administrative_boundaries(request: Request, zoom: Optional[int] = None):
+    """行政区域データを取得（zoom指定時はズームに応じた簡略化レベルを返す）"""
     import os
     from pathlib import Path
     
@@ -83,21 +254,19 @@ async def get_administrative_boundaries():
     if not geojson_path.exists():
         raise HTTPException(status_code=404, detail="行政区域データが見つかりません")
     
-    print(f"行政区域データを配信: {geojson_path}")
-    return FileResponse(
-        str(geojson_path),
-        media_type="application/json",
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Cache-Control": "public, max-age=86400"  # 24時間キャッシュ
-        }
+    admin_dir = base_dir / "data" / "administrative"
+    geojson_path = select_lod_path(
+        zoom, admin_dir, "admin", geojson_path,
+        full_path=admin_dir / "N03-20250101_01.geojson"
     )
+    
+    print(f"行政区域データを配信: {geojson_path}")
+    return static_file_response(request, geojson_path, max_age=86400)  # 24時間キャッシュ
 
 
 @app.get("/rivers/boundaries")
-async def get_river_boundaries():
-    """河川データを取得"""
-    from fastapi.responses import FileResponse
+async def get_river_boundaries(request: Request, zoom: Optional[int] = None):
+    """河川データを取得（zoom指定時はズームに応じた簡略化レベルを返す）"""
     import os
     from pathlib import Path
     
@@ -116,21 +285,52 @@ async def get_river_boundaries():
         print(f"河川データが見つかりません: {geojson_path}")
         raise HTTPException(status_code=404, detail="河川データが見つかりません")
     
+    kasen_dir = base_dir / "data" / "administrative" / "kasen"
+    geojson_path = select_lod_path(
+        zoom, kasen_dir, "rivers", geojson_path,
+        full_path=kasen_dir / "rivers.geojson"
+    )
+    
     print(f"河川データを配信: {geojson_path}")
-    return FileResponse(
-        str(geojson_path),
-        media_type="application/json",
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Cache-Control": "public, max-age=86400"  # 24時間キャッシュ
-        }
+    return static_file_response(request, geojson_path, max_age=86400)  # 24時間キャッシュ
+
+
+@app.get("/slope/boundaries")
+async def get_slope_boundaries(request: Request, zoom: Optional[int] = None, format: str = "geojson"):
+    """
+    傾斜区分データを取得（zoom指定時はズームに応じた簡略化レベルを返す）
+    format=topojson の場合は共有アークのTopoJSON（simplify_slope.pyで生成）を返す
+    （元データのTopoJSONは生成しないため、高ズームでは最も詳細なLODのTopoJSONを返す）
+    """
+    keisya_dir = Path(__file__).parent / "data" / "administrative" / "keisya"
+    geojson_path = keisya_dir / "slope_simple.geojson"
+    
+    if not geojson_path.exists():
+        raise HTTPException(status_code=404, detail="傾斜データが見つかりません")
+    
+    geojson_path = select_lod_path(
+        zoom, keisya_dir, "slope", geojson_path,
+        full_path=keisya_dir / "slope.geojson"
     )
+    
+    if format == "topojson":
+        topojson_path = geojson_path.with_suffix(".topojson")
+        if not topojson_path.exists():
+            topojson_path = (finest_lod_path(keisya_dir, "slope", ".topojson")
+                             or keisya_dir / "slope_simple.topojson")
+        if not topojson_path.exists():
+            raise HTTPException(status_code=404, detail="傾斜データのTopoJSONが見つかりません")
+        geojson_path = topojson_path
+    elif format != "geojson":
+        raise HTTPException(status_code=400, detail="formatは geojson または topojson を指定してください")
+    
+    print(f"傾斜データを配信: {geojson_path}")
+    return static_file_response(request, geojson_path, max_age=86400)
 
 
 @app.get("/forest-registry/boundaries")
-async def get_forest_registry():
+async def get_forest_registry(request: Request):
     """小班ポリゴンデータを取得"""
-    from fastapi.responses import FileResponse
     from pathlib import Path
     
     base_dir = Path(__file__).parent  # backendディレクトリ
@@ -140,83 +340,142 @@ async def get_forest_registry():
     
     if geojson_path.exists():
         print(f"小班GeoJSONを配信: {geojson_path}")
-        return FileResponse(
-            str(geojson_path),
-            media_type="application/json",
-            headers={
-                "Access-Control-Allow-Origin": "*",
-                "Cache-Control": "public, max-age=86400"
-            }
-        )
+        return static_file_response(request, geojson_path, max_age=86400)
     
     raise HTTPException(status_code=404, detail="小班GeoJSONが見つかりません。")
 
 
+@app.get("/forest-registry/tiles/metadata.json")
+async def get_forest_registry_tiles_metadata():
+    """小班ベクトルタイルのメタデータ（ズーム範囲・範囲）を取得"""
+    metadata = forest_tile_service.get_metadata()
+    if not metadata:
+        raise HTTPException(
+            status_code=404,
+            detail="小班タイルが生成されていません（build_forest_tiles.pyを実行してください）"
+        )
+    return metadata
+
+
+@app.get("/forest-registry/tiles/{z}/{x}/{y}.pbf")
+async def get_forest_registry_tile(z: int, x: int, y: int):
+    """小班ポリゴンのベクトルタイル（MVT）を取得（事前生成キャッシュから配信）"""
+    from fastapi.responses import FileResponse, Response
+    
+    if not is_valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="無効なタイル番号です")
+    
+    tile_path = forest_tile_service.get_tile(z, x, y)
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Cache-Control": "public, max-age=86400"
+    }
+    
+    if tile_path is None:
+        # データのない範囲は空タイルとして扱う
+        return Response(status_code=204, headers=headers)
+    
+    return FileResponse(
+        str(tile_path),
+        media_type="application/x-protobuf",
+        headers=headers
+    )
+
+
+@app.get("/layers")
+async def list_query_layers():
+    """bbox検索が可能なレイヤー一覧を取得"""
+    return {"layers": layer_index_service.available_layers()}
+
+
+@app.get("/layers/{name}/query")
+async def query_layer(name: str, bbox: str, limit: int = 1000, clip: bool = False):
+    """
+    指定範囲（bbox=min_lon,min_lat,max_lon,max_lat）と交差するフィーチャーを取得
+    clip=trueの場合はbboxでジオメトリを切り抜く
+    """
+    from fastapi.responses import JSONResponse
+    
+    layer = layer_index_service.get_layer(name)
+    if layer is None:
+        raise HTTPException(status_code=404, detail=f"レイヤー {name} が見つかりません")
+    
+    try:
+        min_lon, min_lat, max_lon, max_lat = [float(v) for v in bbox.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bboxは min_lon,min_lat,max_lon,max_lat の形式で指定してください")
+    
+    if min_lon >= max_lon or min_lat >= max_lat:
+        raise HTTPException(status_code=400, detail="bboxの範囲が不正です")
+    
+    limit = max(1, min(limit, 10000))
+    result = layer.query((min_lon, min_lat, max_lon, max_lat), limit=limit, clip=clip)
+    
+    return JSONResponse(
+        content=result,
+        headers={"Access-Control-Allow-Origin": "*"}
+    )
+
+
+@app.get("/api/layers/stats")
+async def get_layer_store_stats():
+    """層データキャッシュのヒット率・使用量を取得"""
+    return layer_store.stats()
+
+
+@app.post("/api/layers:batch")
+async def get_layers_batch(request: LayersBatchRequest):
+    """
+    複数KEYCODEの層データをまとめて取得（複数小班の選択用）
+    見つからなかったKEYCODEはmissingに入れて返す
+    """
+    from fastapi.responses import JSONResponse
+    from starlette.concurrency import run_in_threadpool
+    
+    if len(request.keycodes) > 1000:
+        raise HTTPException(status_code=400, detail="一度に取得できるKEYCODEは1000件までです")
+    
+    # 複数の市町村ファイル・SQLiteを読むことがあるためスレッドで実行
+    found = await run_in_threadpool(layer_store.get_many, request.keycodes)
+    results = {
+        keycode: {"layer_count": len(layers), "layers": layers}
+        for keycode, layers in found.items()
+    }
+    missing = [k for k in dict.fromkeys(request.keycodes) if k not in found]
+    print(f"層データ一括取得: 要求={len(request.keycodes)}, 取得={len(results)}, 未取得={len(missing)}")
+    
+    return JSONResponse(
+        content={
+            "count": len(results),
+            "results": results,
+            "missing": missing
+        },
+        headers={"Access-Control-Allow-Origin": "*"}
+    )
+
+
 @app.get("/api/layers/{keycode14}")
 async def get_layers(keycode14: str):
     """
     指定KEYCODEの層データ（複層区分）を取得
     1対多の層行を全件返す
     """
-    from pathlib import Path
-    import json
     from fastapi.responses import JSONResponse
+    from starlette.concurrency import run_in_threadpool
     
-    base_dir = Path(__file__).parent
-    
-    # 分割ファイルから読み込み
-    split_dir = base_dir / "data" / "administrative" / "rinsyousigen" / "split"
-    if split_dir.exists():
-        # KEYCODEの最初の5桁（市町村コード）を取得
-        muni_code = keycode14[:5] if len(keycode14) >= 5 else keycode14
-        part_file = split_dir / f"layers_{muni_code}.json"
-        
-        if part_file.exists():
-            print(f"分割ファイルから層データを読み込み: {part_file}")
-            try:
-                with open(part_file, 'r', encoding='utf-8') as f:
-                    layers_index = json.load(f)
-                
-                # KEYCODEで検索
-                if keycode14 in layers_index:
-                    layers = layers_index[keycode14]
-                    print(f"層データ取得: KEYCODE={keycode14}, 層数={len(layers)}")
-                    
-                    return JSONResponse(
-                        content={
-                            "keycode": keycode14,
-                            "layer_count": len(layers),
-                            "layers": layers
-                        },
-                        headers={"Access-Control-Allow-Origin": "*"}
-                    )
-            except Exception as e:
-                print(f"分割ファイル読み込みエラー: {e}")
-    
-    # フォールバック: 元のファイルを使用
-    layers_json_path = base_dir / "data" / "administrative" / "rinsyousigen" / "layers_index.json"
+    # キャッシュミス時はファイル・SQLiteを読むためスレッドで実行
+    layers = await run_in_threadpool(layer_store.get, keycode14)
     
-    if layers_json_path.exists():
-        print(f"元のファイルから層データを読み込み: {layers_json_path}")
-        try:
-            with open(layers_json_path, 'r', encoding='utf-8') as f:
-                layers_index = json.load(f)
-            
-            # KEYCODEで検索
-            if keycode14 in layers_index:
-                layers = layers_index[keycode14]
-                print(f"層データ取得: KEYCODE={keycode14}, 層数={len(layers)}")
-                
-                return JSONResponse(
-                    content={
-                        "keycode": keycode14,
-                        "layer_count": len(layers),
-                        "layers": layers
-                    },
-                    headers={"Access-Control-Allow-Origin": "*"}
-                )
-        except Exception as e:
-            print(f"元のファイル読み込みエラー: {e}")
+    if layers is not None:
+        print(f"層データ取得: KEYCODE={keycode14}, 層数={len(layers)}")
+        return JSONResponse(
+            content={
+                "keycode": keycode14,
+                "layer_count": len(layers),
+                "layers": layers
+            },
+            headers={"Access-Control-Allow-Origin": "*"}
+        )
     
     raise HTTPException(
         status_code=404, 
@@ -274,13 +533,14 @@ async def get_municipality_codes():
 
 
 @app.get("/image/{file_id}")
-async def get_image(file_id: str):
-    """アップロードされた画像を取得（ブラウザ表示用にPNGに変換）"""
-    from fastapi.responses import Response
-    from PIL import Image
-    import io
+async def get_image(request: Request, file_id: str, max_size: int = 2048):
+    """
+    アップロードされた画像を取得（ブラウザ表示用にPNGに変換）
+    長辺max_size以下に縮小したプレビューを1回だけ作成し、以降はディスクキャッシュから返す
+    """
+    from starlette.concurrency import run_in_threadpool
     
-    print(f"画像リクエスト: file_id={file_id}")
+    print(f"画像リクエスト: file_id={file_id}, max_size={max_size}")
     image_path = image_service.get_file_path(file_id)
     print(f"画像パス: {image_path}")
     
@@ -288,65 +548,56 @@ async def get_image(file_id: str):
         print(f"画像が見つかりません: {image_path}")
         raise HTTPException(status_code=404, detail="画像が見つかりません")
     
+    if not 64 <= max_size <= PREVIEW_MAX_SIZE_LIMIT:
+        raise HTTPException(status_code=400, detail=f"max_sizeは64〜{PREVIEW_MAX_SIZE_LIMIT}で指定してください")
+    
     try:
-        # GeoTIFFをPNGに変換
-        print("画像を読み込んでPNGに変換します")
-        
-        # rasterioで読み込み
-        try:
-            import rasterio
-            import numpy as np
-            
-            with rasterio.open(image_path) as src:
-                # 最初の3バンドを読み込み（RGB）
-                bands = min(3, src.count)
-                data = src.read([i+1 for i in range(bands)])
-                
-                # (C, H, W) -> (H, W, C)
-                if bands == 3:
-                    rgb = np.transpose(data, (1, 2, 0))
-                elif bands == 1:
-                    # グレースケールの場合は3チャンネルに複製
-                    rgb = np.stack([data[0]] * 3, axis=-1)
-                else:
-                    rgb = np.transpose(data[:3], (1, 2, 0))
-                
-                # 正規化（0-255）
-                rgb_min = rgb.min()
-                rgb_max = rgb.max()
-                if rgb_max > rgb_min:
-                    rgb = ((rgb - rgb_min) / (rgb_max - rgb_min) * 255).astype(np.uint8)
-                else:
-                    rgb = np.zeros_like(rgb, dtype=np.uint8)
-                
-                # PIL Imageに変換
-                img = Image.fromarray(rgb)
-        except:
-            # rasterioが使えない場合はPILで直接読み込み
-            print("PILで画像を読み込みます")
-            img = Image.open(image_path)
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-        
-        # PNGとしてメモリに保存
-        img_io = io.BytesIO()
-        img.save(img_io, 'PNG', optimize=True)
-        img_io.seek(0)
-        
-        print("PNG変換完了")
-        return Response(
-            content=img_io.getvalue(),
-            media_type="image/png",
-            headers={
-                "Access-Control-Allow-Origin": "*",
-                "Cache-Control": "public, max-age=3600"
-            }
+        preview_path = await run_in_threadpool(
+            preview_service.get_or_create, image_path, max_size, image_service.render_preview
         )
     except Exception as e:
         print(f"画像変換エラー: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"画像変換エラー: {str(e)}")
+    
+    response = static_file_response(request, preview_path, media_type="image/png", max_age=3600)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+@app.get("/image/{file_id}/tiles/{z}/{x}/{y}.png")
+async def get_image_tile(file_id: str, z: int, x: int, y: int):
+    """アップロードされた画像のXYZタイル（Webメルカトル、PNG）を取得"""
+    from fastapi.responses import Response
+    from starlette.concurrency import run_in_threadpool
+    
+    if not is_valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="無効なタイル番号です")
+    
+    image_path = image_service.get_file_path(file_id)
+    if not image_path or not os.path.exists(image_path):
+        raise HTTPException(status_code=404, detail="画像が見つかりません")
+    
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Cache-Control": "public, max-age=3600"
+    }
+    
+    try:
+        # ワープ・PNG変換はCPU処理のためスレッドプールで実行
+        tile = await run_in_threadpool(image_service.render_tile, image_path, z, x, y)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"タイル生成エラー: {e}")
+        raise HTTPException(status_code=500, detail=f"タイル生成エラー: {str(e)}")
+    
+    if tile is None:
+        # 画像範囲外のタイル
+        return Response(status_code=204, headers=headers)
+    
+    return Response(content=tile, media_type="image/png", headers=headers)
 
 
 @app.get("/preset-images")
@@ -397,7 +648,11 @@ async def upload_preset_image(image_id: str):
             raise HTTPException(status_code=400, detail=validation['message'])
         
         # ファイルIDを生成して登録（コピーせずに元のパスを使用）
-        file_id = image_service.register_preset_file(str(image_path), validation['info'])
+        # 初回はCOG変換を行うためスレッドプールで実行
+        from starlette.concurrency import run_in_threadpool
+        file_id = await run_in_threadpool(
+            image_service.register_preset_file, str(image_path), validation['info']
+        )
         
         return {
             "file_id": file_id,
@@ -409,89 +664,480 @@ async def upload_preset_image(image_id: str):
         raise HTTPException(status_code=500, detail=f"プリセット画像読み込みエラー: {str(e)}")
 
 
+def _upload_error(e: Exception) -> HTTPException:
+    """アップロード処理の例外をHTTPエラーに変換"""
+    if isinstance(e, UploadTooLargeError):
+        return HTTPException(status_code=413, detail=str(e))
+    if isinstance(e, UploadOffsetError):
+        return HTTPException(status_code=409, detail={"message": str(e), "offset": e.offset})
+    return HTTPException(status_code=400, detail=str(e))
+
+
+async def _register_upload(tmp_path: str, filename: str, sha256: Optional[str] = None) -> dict:
+    """ディスクに保存済みのアップロードを検証してCOG変換・登録"""
+    from starlette.concurrency import run_in_threadpool
+    
+    # 画像の検証
+    validation = await run_in_threadpool(image_service.validate_geotiff, tmp_path)
+    
+    if not validation['valid']:
+        os.unlink(tmp_path)
+        raise HTTPException(status_code=400, detail=validation['message'])
+    
+    # ファイルIDを生成して保存（COG変換はスレッドプールで実行、メタデータも保存）
+    # 内容のハッシュは解析結果キャッシュのキーに使うためメタデータにも保存
+    metadata = dict(validation['info'], sha256=sha256) if sha256 else validation['info']
+    file_id = await run_in_threadpool(
+        image_service.save_uploaded_file, tmp_path, metadata
+    )
+    
+    response = {
+        "file_id": file_id,
+        "filename": filename,
+        "info": validation['info']
+    }
+    if sha256:
+        response["sha256"] = sha256
+    return response
+
+
 @app.post("/upload")
-async def upload_geotiff(file: UploadFile = File(...)):
-    """GeoTIFFファイルをアップロード"""
-    if not file.filename.lower().endswith(('.tif', '.tiff', '.geotiff', '.jpg', '.jpeg', '.png')):
+async def upload_geotiff(file: UploadFile = File(...), sha256: Optional[str] = None):
+    """
+    GeoTIFFファイルをアップロード（小さなファイル向け）
+    multipartのボディはStarletteが受信時にいったん一時ファイルへ全量を書き出すため、
+    サイズ上限の判定は受信完了後になり、ディスクへの書き込みも2回になる
+    大きなファイルは再開可能な分割アップロード（POST /uploads）を使う
+    sha256を指定するとハッシュを計算して照合する
+    """
+    if not file.filename.lower().endswith(UPLOAD_EXTENSIONS):
         raise HTTPException(status_code=400, detail="画像ファイル（.tif, .jpg, .png）のみ対応しています")
     
     try:
         # 一時ファイルに保存
         suffix = os.path.splitext(file.filename)[1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
-        
-        # 画像の検証
-        validation = image_service.validate_geotiff(tmp_path)
-        
-        if not validation['valid']:
-            os.unlink(tmp_path)
-            raise HTTPException(status_code=400, detail=validation['message'])
+        try:
+            saved = await upload_service.save_stream(file, suffix, compute_hash=bool(sha256))
+        except ValueError as e:
+            raise _upload_error(e)
         
-        # ファイルIDを生成して保存（メタデータも保存）
-        file_id = image_service.save_uploaded_file(tmp_path, validation['info'])
+        if sha256 and saved['sha256'] != sha256.lower():
+            os.unlink(saved['path'])
+            raise HTTPException(status_code=400, detail="sha256が一致しません")
         
-        return {
-            "file_id": file_id,
-            "filename": file.filename,
-            "info": validation['info']
-        }
+        return await _register_upload(saved['path'], file.filename, saved['sha256'])
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"アップロードエラー: {str(e)}")
 
 
-@app.post("/analyze", response_model=AnalysisResult)
-async def analyze_area(request: AnalysisRequest):
-    """指定範囲の樹木解析を実行"""
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None
+
+
+@app.post("/uploads")
+async def create_upload_session(request: UploadSessionRequest):
+    """
+    再開可能な分割アップロードを開始
+    PUT /uploads/{upload_id}?offset= でチャンクを順に送り、POST /uploads/{upload_id}/complete で完了する
+    """
+    if not request.filename.lower().endswith(UPLOAD_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="画像ファイル（.tif, .jpg, .png）のみ対応しています")
+    
+    try:
+        return upload_service.create_session(request.filename, request.size, request.sha256)
+    except ValueError as e:
+        raise _upload_error(e)
+
+
+@app.get("/uploads/{upload_id}")
+async def get_upload_session(upload_id: str):
+    """分割アップロードの状態（受信済みサイズoffset）を取得。中断後はoffsetから再送する"""
+    session = upload_service.get_session(upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="アップロードが見つかりません")
+    return session
+
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    """チャンクを受信してoffsetの位置に追記（リクエストボディをそのまま書き込む）"""
+    try:
+        session = await upload_service.append_chunk(upload_id, offset, request.stream())
+    except ValueError as e:
+        raise _upload_error(e)
+    if session is None:
+        raise HTTPException(status_code=404, detail="アップロードが見つかりません")
+    return session
+
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str):
+    """分割アップロードを完了して画像を登録（/upload と同じレスポンス）"""
+    from starlette.concurrency import run_in_threadpool
+    
     try:
-        # 範囲情報
-        bbox = (request.bbox.min_lon, request.bbox.min_lat, 
-                request.bbox.max_lon, request.bbox.max_lat)
+        # 全体のsha256計算があるためスレッドで実行
+        saved = await run_in_threadpool(upload_service.complete, upload_id)
+    except ValueError as e:
+        raise _upload_error(e)
+    if saved is None:
+        raise HTTPException(status_code=404, detail="アップロードが見つかりません")
+    
+    try:
+        return await _register_upload(saved['path'], saved['filename'], saved['sha256'])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"アップロードエラー: {str(e)}")
+
+
+@app.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    """分割アップロードを中止"""
+    try:
+        aborted = upload_service.abort(upload_id)
+    except ValueError as e:
+        raise _upload_error(e)
+    if not aborted:
+        raise HTTPException(status_code=404, detail="アップロードが見つかりません")
+    return {"upload_id": upload_id, "aborted": True}
+
+
+def _analysis_args(request: AnalysisRequest) -> tuple:
+    """解析リクエストを検証し、ワーカーに渡す (mode, 引数) に変換"""
+    # 範囲情報
+    bbox = (request.bbox.min_lon, request.bbox.min_lat, 
+            request.bbox.max_lon, request.bbox.max_lat)
+    
+    # ポリゴン座標（フロントエンドから送信される場合、ワーカーに渡すため辞書に変換）
+    polygon_coords = None
+    if request.polygon_coords:
+        polygon_coords = [{'lat': c.lat, 'lon': c.lon} for c in request.polygon_coords]
+    
+    # モードA（地図）の場合：範囲サイズから推定（森林簿IDがある場合は森林簿ベース解析）
+    if request.mode == 'map':
+        area_km2 = analysis_service.calculate_area(bbox)
+        return 'map', (area_km2, bbox, polygon_coords, request.forest_registry_id)
+    
+    # モードB（画像アップロード）の場合：指定範囲だけをメモリ上にクロップして解析
+    elif request.mode == 'upload':
+        if not request.file_id:
+            raise HTTPException(status_code=400, detail="ファイルIDが必要です")
         
-        # ポリゴン座標（フロントエンドから送信される場合）
-        polygon_coords = request.polygon_coords if hasattr(request, 'polygon_coords') else None
+        image_path = image_service.get_file_path(request.file_id)
+        if not image_path or not os.path.exists(image_path):
+            raise HTTPException(status_code=404, detail="画像ファイルが見つかりません")
         
-        # モードA（地図）の場合
-        if request.mode == 'map':
-            # 範囲サイズから推定
-            area_km2 = analysis_service.calculate_area(bbox)
-            # 森林簿IDがある場合は森林簿ベース解析
-            if request.forest_registry_id:
-                result = analysis_service.analyze_from_forest_registry(
-                    area_km2, bbox, polygon_coords, request.forest_registry_id
-                )
-            else:
-                result = analysis_service.analyze_from_map(area_km2, bbox, polygon_coords)
-            return result
+        return 'upload', (image_path, bbox, polygon_coords)
+    
+    else:
+        raise HTTPException(status_code=400, detail="無効なモードです")
+
+
+def _analysis_cache_key(request: AnalysisRequest, mode: str, args: tuple) -> str:
+    """解析入力のキャッシュキー（画像は内容のハッシュ、なければパス・サイズ・更新時刻で識別）"""
+    file_fingerprint = None
+    if mode == 'upload':
+        metadata = image_service.get_file_metadata(request.file_id) or {}
+        file_fingerprint = metadata.get('sha256')
+        if not file_fingerprint:
+            stat = os.stat(args[0])
+            file_fingerprint = f"{os.path.realpath(args[0])}:{stat.st_size}:{stat.st_mtime_ns}"
+    
+    polygon_coords = args[2]
+    forest_registry_id = args[3] if mode == 'map' else None
+    return analysis_cache_key(mode, args[1], polygon_coords, forest_registry_id,
+                              file_fingerprint, ANALYSIS_CACHE_VERSION)
+
+
+@app.post("/analyze", response_model=AnalysisResult)
+async def analyze_area(request: AnalysisRequest, raw_request: Request, format: Optional[str] = None,
+                       cell_size: float = DENSITY_DEFAULT_CELL_SIZE_M):
+    """
+    指定範囲の樹木解析を実行
+    検出・材積計算はワーカープロセスで実行するため、解析中も他のリクエストは処理される
+    時間のかかる範囲は POST /jobs/analyze を使う
+    
+    レスポンス形式（?format= またはAcceptヘッダー）:
+    - json（既定）: tree_points は辞書のリスト
+    - columnar: tree_points を列ごとの配列で返すJSON
+    - binary（Accept: application/vnd.tree-points）: bbox原点からのfloat32オフセットを詰めたバイナリ
+    - arrow（Accept: application/vnd.apache.arrow.stream）: Arrow IPCストリーム
+    - ndjson（Accept: application/x-ndjson）: サマリー行のあと樹木位置を1行1本で順に送るストリーム（gzip圧縮しない）
+    - summary: tree_points を含めない（result_id を使い /results/{result_id}/clusters で表示分だけ取得）
+    - geotiff（Accept: image/tiff）: cell_size（m）四方のセルごとの本数・材積を集計した2バンドのGeoTIFF
+    
+    同じ入力（モード・画像・範囲・ポリゴン・森林簿ID）の結果はキャッシュから返す
+    （X-Analysis-Cache: memory / disk / miss、Cache-Control: no-cache で再解析）
+    """
+    from fastapi.responses import Response
+    from starlette.concurrency import run_in_threadpool
+    
+    try:
+        output_format = negotiate_format(format, raw_request.headers.get('accept'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        mode, args = _analysis_args(request)
+        cache_key = await run_in_threadpool(_analysis_cache_key, request, mode, args)
+        result, cache_status = None, 'miss'
+        if 'no-cache' not in raw_request.headers.get('cache-control', ''):
+            # ディスクからの読み込みがあるためスレッドで実行
+            result, cache_status = await run_in_threadpool(result_cache.get, cache_key)
+        
+        if result is None:
+            cache_status = 'miss'
+            task = analysis_tasks.analyze_map if mode == 'map' else analysis_tasks.analyze_upload
+            try:
+                result = await analysis_executor.run(task, *args)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            await run_in_threadpool(result_cache.put, cache_key, result)
         
-        # モードB（画像アップロード）の場合
-        elif request.mode == 'upload':
-            if not request.file_id:
-                raise HTTPException(status_code=400, detail="ファイルIDが必要です")
-            
-            image_path = image_service.get_file_path(request.file_id)
-            if not image_path or not os.path.exists(image_path):
-                raise HTTPException(status_code=404, detail="画像ファイルが見つかりません")
-            
-            cropped_path = image_service.crop_to_bbox(image_path, bbox)
-            detections = analysis_service.detect_trees(cropped_path)
-            result = analysis_service.calculate_volume(detections, bbox, polygon_coords)
-            
-            if os.path.exists(cropped_path) and cropped_path != image_path:
-                os.unlink(cropped_path)
-            
-            return result
+        if output_format == 'ndjson':
+            return _stream_analysis(result, cache_status)
         
-        else:
-            raise HTTPException(status_code=400, detail="無効なモードです")
+        # 点ごとのモデル検証を通さず、ワーカーから返った列をそのままエンコード
+        origin = (request.bbox.min_lon, request.bbox.min_lat)
+        try:
+            if output_format == 'geotiff':
+                bbox = (request.bbox.min_lon, request.bbox.min_lat, request.bbox.max_lon, request.bbox.max_lat)
+                content = await run_in_threadpool(encode_result_geotiff, result, bbox, cell_size)
+                media_type = 'image/tiff'
+            else:
+                content, media_type = await run_in_threadpool(encode_result, result, output_format, origin)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except ImportError:
+            raise HTTPException(status_code=406, detail="arrow形式にはpyarrowが必要です")
+        return Response(content=content, media_type=media_type, headers={"X-Analysis-Cache": cache_status})
     
+    except HTTPException:
+        raise
+    except ExecutorBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"解析エラー: {str(e)}")
 
 
+def _stream_analysis(result: dict, cache_status: str):
+    """
+    解析結果をNDJSONで順に送る（ワーカーから返った列をチャンクごとに行にする。全件のリストは作らない）
+    GZipMiddleware はレスポンス全体をバッファするため、Content-Encoding: identity で圧縮の対象外にする
+    """
+    from fastapi.responses import StreamingResponse
+    
+    # 同期ジェネレーターはStreamingResponseがスレッドプールで順に読み出す
+    return StreamingResponse(
+        iter_ndjson(result, [result['tree_points']]),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers={"X-Analysis-Cache": cache_status, "Content-Encoding": "identity"}
+    )
+
+
+# 実行中のジョブ（タスクがGCされないよう参照を保持）
+_running_jobs = set()
+
+
+async def _run_job(job_id: str, mode: str, args: tuple):
+    """ジョブをワーカーで実行（進捗・結果はワーカーがジョブストアに書き込む）"""
+    import asyncio
+    
+    try:
+        await analysis_executor.run(analysis_tasks.run_analysis_job, job_id, mode, *args, key=job_id)
+    except asyncio.CancelledError:
+        # 待機中のジョブを cancel_analysis_job が取り消した場合（状態は更新済み）
+        job = job_store.get(job_id, include_result=False)
+        if job is None or job['status'] != 'cancelled':
+            raise
+    except Exception as e:
+        print(f"ジョブ実行エラー ({job_id}): {e}")
+        job_store.fail(job_id, str(e))
+
+
+@app.post("/jobs/analyze", status_code=202)
+async def create_analysis_job(request: AnalysisRequest):
+    """
+    解析をジョブとして開始してIDを返す（接続を保持せずに GET /jobs/{job_id} で進捗・結果を取得）
+    """
+    import asyncio
+    
+    mode, args = _analysis_args(request)
+    if analysis_executor.is_busy():
+        raise HTTPException(status_code=503, detail="解析の実行待ちが上限に達しています",
+                            headers={"Retry-After": "5"})
+    
+    job_id = job_store.create()
+    task = asyncio.create_task(_run_job(job_id, mode, args))
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+    
+    return job_store.get(job_id)
+
+
+@app.get("/jobs/{job_id}")
+async def get_analysis_job(job_id: str):
+    """
+    ジョブの状態を取得
+    status: queued / running / succeeded / failed / cancelled
+    stage: crop / detect / volume、progress: 0〜1、成功時は result に解析結果
+    result の樹木位置は結果ストア（result_id）から読み込む（結果の保存期限を過ぎた場合は含めない）
+    """
+    from starlette.concurrency import run_in_threadpool
+    from services.analysis_service import tree_points_to_list
+    
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    result = job.get('result')
+    if result and result.get('result_id') and 'tree_points' not in result:
+        stored = await run_in_threadpool(result_store.load, result['result_id'])
+        if stored is not None:
+            result['tree_points'] = await run_in_threadpool(tree_points_to_list, stored['tree_points'])
+    return job
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_analysis_job(job_id: str):
+    """実行中・待機中のジョブをキャンセル（終了済みのジョブは削除）"""
+    job = job_store.get(job_id, include_result=False)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    
+    if job['status'] in job_store.FINISHED:
+        job_store.delete(job_id)
+        return {"job_id": job_id, "deleted": True}
+    
+    job_store.request_cancel(job_id)
+    if job['status'] == 'queued' and analysis_executor.cancel(job_id):
+        # ワーカーが取り出す前のジョブはプールから取り除いてすぐにキャンセル済みにする
+        job_store.mark_cancelled(job_id)
+    return job_store.get(job_id, include_result=False)
+
+
+@app.get("/results/{result_id}/clusters")
+async def get_result_clusters(result_id: str, z: int, bbox: Optional[str] = None, limit: int = 5000):
+    """
+    解析結果（result_id）の樹木位置をズーム z・表示範囲 bbox（min_lon,min_lat,max_lon,max_lat）で集計して返す
+    クラスターは本数・合計材積・針葉樹/広葉樹の本数を持ち、高ズーム（1本だけのセル）では個々の樹木を返す
+    件数が limit を超える場合はズームを下げて集計する（実際のズームは zoom）
+    """
+    from starlette.concurrency import run_in_threadpool
+    
+    if bbox:
+        try:
+            min_lon, min_lat, max_lon, max_lat = [float(v) for v in bbox.split(",")]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="bboxは min_lon,min_lat,max_lon,max_lat の形式で指定してください")
+        if min_lon >= max_lon or min_lat >= max_lat:
+            raise HTTPException(status_code=400, detail="bboxの範囲が不正です")
+    else:
+        min_lon, min_lat, max_lon, max_lat = -180.0, -90.0, 180.0, 90.0
+    
+    limit = max(1, min(limit, 10000))
+    # 初回はインデックス作成（結果の読み込み・集計）があるためスレッドで実行
+    clusters = await run_in_threadpool(
+        cluster_service.get_clusters, result_id, z, (min_lon, min_lat, max_lon, max_lat), limit
+    )
+    if clusters is None:
+        raise HTTPException(status_code=404, detail="解析結果が見つかりません（期限切れの可能性があります）")
+    return clusters
+
+
+async def _density_grid(result_id: str, cell_size: float):
+    """密度ラスターを取得（初回は結果の読み込み・集計があるためスレッドで実行）"""
+    from starlette.concurrency import run_in_threadpool
+    
+    try:
+        entry = await run_in_threadpool(density_service.get_grid, result_id, cell_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if entry is None:
+        raise HTTPException(status_code=404, detail="解析結果が見つかりません（期限切れの可能性があります）")
+    return entry
+
+
+@app.get("/results/{result_id}/density.tif")
+async def get_result_density_geotiff(result_id: str, cell_size: float = DENSITY_DEFAULT_CELL_SIZE_M):
+    """
+    解析結果を cell_size（m）四方のセルごとの本数・材積に集計したGeoTIFF（EPSG:4326）を取得
+    バンド1: tree_count（本/セル）、バンド2: volume_m3（m³/セル）
+    """
+    from fastapi.responses import Response
+    from starlette.concurrency import run_in_threadpool
+    
+    grid, summary = await _density_grid(result_id, cell_size)
+    content = await run_in_threadpool(encode_geotiff, grid, dict(summary, result_id=result_id))
+    return Response(
+        content=content,
+        media_type="image/tiff",
+        headers={
+            "Access-Control-Allow-Origin": "*",
+            "Content-Disposition": f'attachment; filename="density_{result_id}_{cell_size:g}m.tif"'
+        }
+    )
+
+
+@app.get("/results/{result_id}/density/metadata.json")
+async def get_result_density_metadata(result_id: str, cell_size: float = DENSITY_DEFAULT_CELL_SIZE_M):
+    """密度ラスターのメタデータ（範囲・セル数・バンドごとの単位・最大値・合計）を取得"""
+    from starlette.concurrency import run_in_threadpool
+    
+    await _density_grid(result_id, cell_size)
+    return await run_in_threadpool(density_service.get_metadata, result_id, cell_size)
+
+
+@app.get("/results/{result_id}/density/{z}/{x}/{y}.png")
+async def get_result_density_tile(result_id: str, z: int, x: int, y: int, band: str = "tree_count",
+                                  cell_size: float = DENSITY_DEFAULT_CELL_SIZE_M):
+    """密度ラスターのヒートマップタイル（XYZ、PNG、band: tree_count / volume_m3）を取得"""
+    from fastapi.responses import Response
+    from starlette.concurrency import run_in_threadpool
+    
+    if not is_valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="無効なタイル番号です")
+    
+    grid, _ = await _density_grid(result_id, cell_size)
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Cache-Control": "public, max-age=3600"
+    }
+    try:
+        tile = await run_in_threadpool(render_heatmap_tile, grid, band, z, x, y)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if tile is None:
+        # ラスター範囲外のタイル
+        return Response(status_code=204, headers=headers)
+    
+    return Response(content=tile, media_type="image/png", headers=headers)
+
+
+@app.get("/api/results/stats")
+async def get_result_cluster_stats():
+    """クラスターインデックスのキャッシュのヒット率・使用量を取得"""
+    return cluster_service.stats()
+
+
+@app.get("/api/analysis/cache/stats")
+async def get_analysis_cache_stats():
+    """解析結果キャッシュのヒット率（メモリ・ディスク）・使用量を取得"""
+    return result_cache.stats()
+
+
+@app.get("/api/analysis/stats")
+async def get_analysis_stats():
+    """解析ワーカーの状態（実行中・待機中の件数、上限超過で断った件数）"""
+    return analysis_executor.stats()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
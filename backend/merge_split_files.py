@@ -2,6 +2,8 @@ import json
 import os
 from pathlib import Path
 
+from services.geojson_stream import iter_features, FeatureCollectionWriter
+
 def merge_forest_registry():
     """分割されたforest_registry.geojsonを結合"""
     split_dir = Path('frontend/public/data/administrative/kitamirinsyou/split')
@@ -22,28 +24,18 @@ def merge_forest_registry():
     
     print(f"分割ファイル数: {index['num_parts']}")
     
-    # 全フィーチャーを結合
-    all_features = []
-    for part_info in index['parts']:
-        part_file = split_dir / part_info['file']
-        print(f"読み込み中: {part_file} ({part_info['features']} features)")
-        
-        with open(part_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            all_features.extend(data['features'])
-    
-    # 結合したGeoJSONを作成
-    merged = {
-        'type': 'FeatureCollection',
-        'features': all_features
-    }
+    # 全フィーチャーを1件ずつ書き出して結合（ファイル全体をメモリに載せない）
+    with FeatureCollectionWriter(output_file) as writer:
+        for part_info in index['parts']:
+            part_file = split_dir / part_info['file']
+            print(f"読み込み中: {part_file} ({part_info['features']} features)")
+            
+            for feature in iter_features(part_file):
+                writer.write(feature)
     
-    print(f"\n結合完了: {len(all_features)} features")
+    print(f"\n結合完了: {writer.count} features")
     print(f"出力先: {output_file}")
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(merged, f, ensure_ascii=False)
-    
     file_size = os.path.getsize(output_file) / (1024 * 1024)
     print(f"ファイルサイズ: {file_size:.2f} MB")
 
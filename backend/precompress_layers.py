@@ -0,0 +1,64 @@
+"""
+配信用GeoJSONの事前圧縮ファイル（.gz / .br）を作成するスクリプト
+APIはAccept-Encodingに応じてこれらを直接配信する（リクエストごとの圧縮が不要になる）
+brotliパッケージがない場合は .gz のみ作成
+"""
+import gzip
+import os
+import shutil
+from pathlib import Path
+
+
+def _is_lfs_pointer(path: Path) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(64).startswith(b'version https://git-lfs')
+
+
+def precompress_file(path: Path):
+    """1ファイル分の .gz / .br を作成（元ファイルより新しければスキップ）"""
+    mtime = path.stat().st_mtime
+    original_size = path.stat().st_size
+
+    gz_path = path.with_name(path.name + '.gz')
+    if not gz_path.exists() or gz_path.stat().st_mtime < mtime:
+        with open(path, 'rb') as src, gzip.open(gz_path, 'wb', compresslevel=9) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        print(f"  {gz_path.name}: {original_size / 1024 / 1024:.2f} MB -> "
+              f"{gz_path.stat().st_size / 1024 / 1024:.2f} MB")
+
+    try:
+        import brotli
+    except ImportError:
+        return
+
+    br_path = path.with_name(path.name + '.br')
+    if not br_path.exists() or br_path.stat().st_mtime < mtime:
+        compressor = brotli.Compressor(quality=11, mode=brotli.MODE_TEXT)
+        with open(path, 'rb') as src, open(br_path, 'wb') as dst:
+            while True:
+                chunk = src.read(1024 * 1024)
+                if not chunk:
+                    break
+                dst.write(compressor.process(chunk))
+            dst.write(compressor.finish())
+        print(f"  {br_path.name}: {original_size / 1024 / 1024:.2f} MB -> "
+              f"{br_path.stat().st_size / 1024 / 1024:.2f} MB")
+
+
+def precompress_layers(data_dir):
+    """data_dir以下のGeoJSONをすべて事前圧縮"""
+    data_dir = Path(data_dir)
+    print(f"事前圧縮ファイルを作成します: {data_dir}")
+
+    for path in sorted(data_dir.rglob('*.geojson')):
+        if _is_lfs_pointer(path):
+            print(f"スキップ（Git LFSポインタ）: {path}")
+            continue
+        print(f"処理中: {path}")
+        precompress_file(path)
+
+    print("✅ 事前圧縮完了")
+
+
+if __name__ == "__main__":
+    precompress_layers(os.path.join("data", "administrative"))
@@ -1,12 +1,56 @@
-from PIL import Image
 import random
 import math
 
+import numpy as np
+
+from services.polygon_filter import points_in_polygon, prepare_polygon, random_points_in_polygon
+
+
+# 解析方法（樹木位置・材積の計算）のバージョン。変えた場合は上げる（解析結果キャッシュのキーに含める）
+ANALYSIS_VERSION = '1'
+
+# 樹木位置の列（tree_type は TREE_TYPES のインデックス）
+TREE_TYPES = ('coniferous', 'broadleaf')
+TREE_COLUMNS = ('lat', 'lon', 'tree_type', 'dbh', 'volume')
+
+
+def empty_tree_columns() -> dict:
+    return {
+        'lat': np.empty(0, dtype=np.float64),
+        'lon': np.empty(0, dtype=np.float64),
+        'tree_type': np.empty(0, dtype=np.uint8),
+        'dbh': np.empty(0, dtype=np.float32),
+        'volume': np.empty(0, dtype=np.float32)
+    }
+
+
+def tree_points_to_list(tree_points) -> list:
+    """
+    樹木位置の列（{'lat': ndarray, ...}）をレスポンス用の辞書のリストに変換
+    すでにリストの場合はそのまま返す
+    """
+    if isinstance(tree_points, list):
+        return tree_points
+    lats = tree_points['lat'].tolist()
+    lons = tree_points['lon'].tolist()
+    types = [TREE_TYPES[t] for t in tree_points['tree_type'].tolist()]
+    dbhs = np.round(tree_points['dbh'].astype(np.float64), 1).tolist()
+    volumes = np.round(tree_points['volume'].astype(np.float64), 3).tolist()
+    return [
+        {'lat': lat, 'lon': lon, 'tree_type': t, 'dbh': dbh, 'volume': volume}
+        for lat, lon, t, dbh, volume in zip(lats, lons, types, dbhs, volumes)
+    ]
+
 
 class AnalysisService:
-    def __init__(self):
-        # MVP版：簡易的な検出シミュレーション
-        pass
+    def __init__(self, detection_service=None, mesh_size_m: float = 5.0):
+        from services.detection_service import DetectionService
+        
+        # 検出エンジン（既定はMVP版の簡易シミュレーション）
+        self.detection_service = detection_service or DetectionService()
+        # 地図モードの樹木位置グリッドの間隔（m）
+        self.mesh_size_m = mesh_size_m
+        self._rng = np.random.default_rng()
     
     def calculate_area(self, bbox: tuple) -> float:
         """緯度経度から面積を計算（km²）"""
@@ -24,88 +68,81 @@ class AnalysisService:
         area_km2 = lat_km * lon_km
         return area_km2
     
-    def _point_in_polygon(self, point: tuple, polygon: list) -> bool:
-        """点がポリゴン内にあるかチェック（Ray casting algorithm）"""
-        x, y = point
-        n = len(polygon)
-        inside = False
+    def _generate_tree_points(self, tree_count: int, bbox: tuple, polygon_coords: list = None,
+                              mesh_size_m: float = None, progress=None) -> dict:
+        """
+        樹木位置を生成する共通メソッド（グリッドベース）
+        iter_tree_points の各チャンクを連結して返す
+        戻り値は列ごとの配列 {'lat', 'lon', 'tree_type', 'dbh', 'volume'}（tree_points_to_list で辞書に変換）
+        """
+        chunks = list(self.iter_tree_points(bbox, polygon_coords, mesh_size_m, progress=progress))
+        if not chunks:
+            return empty_tree_columns()
+        if len(chunks) == 1:
+            return chunks[0]
+        return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in TREE_COLUMNS}
+    
+    def iter_tree_points(self, bbox: tuple, polygon_coords: list = None, mesh_size_m: float = None,
+                         chunk_size: int = 50000, progress=None):
+        """
+        樹木位置をグリッドの行単位のチャンク（約 chunk_size マス分の列）で順に生成する
+        mesh_size_m 間隔のグリッド中心を meshgrid で作り、ポリゴン内判定・属性の乱数もチャンクごとに一括で行う
+        全体を保持しないため、広い範囲でもメモリはチャンクの大きさで頭打ちになる
+        progress: チャンクごとに処理済みの行の割合（0〜1）を受け取るコールバック
+        """
+        if not bbox:
+            return
         
-        p1x, p1y = polygon[0]
-        for i in range(1, n + 1):
-            p2x, p2y = polygon[i % n]
-            if y > min(p1y, p2y):
-                if y <= max(p1y, p2y):
-                    if x <= max(p1x, p2x):
-                        if p1y != p2y:
-                            xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
-                        if p1x == p2x or x <= xinters:
-                            inside = not inside
-            p1x, p1y = p2x, p2y
+        min_lon, min_lat, max_lon, max_lat = bbox
         
-        return inside
-    
-    def _generate_tree_points(self, tree_count: int, bbox: tuple, polygon_coords: list = None) -> list:
-        """樹木位置を生成する共通メソッド（グリッドベース）"""
-        tree_points = []
+        # グリッドサイズを計算（既定 5m x 5m）
+        mesh_size_m = mesh_size_m or self.mesh_size_m
+        avg_lat = (min_lat + max_lat) / 2
+        lat_step = mesh_size_m / 111000  # 緯度1度 ≈ 111km
+        lon_step = mesh_size_m / (111000 * math.cos(math.radians(avg_lat)))
         
-        if bbox:
-            min_lon, min_lat, max_lon, max_lat = bbox
-            
-            # ポリゴン座標を変換
-            polygon = None
-            if polygon_coords:
-                # Pydanticモデルの場合は属性アクセス、辞書の場合は[]アクセス
-                if hasattr(polygon_coords[0], 'lon'):
-                    polygon = [(coord.lon, coord.lat) for coord in polygon_coords]
-                else:
-                    polygon = [(coord['lon'], coord['lat']) for coord in polygon_coords]
-            
-            # グリッドサイズを計算（5m x 5m）
-            mesh_size_m = 5
-            avg_lat = (min_lat + max_lat) / 2
-            lat_step = mesh_size_m / 111000  # 緯度1度 ≈ 111km
-            lon_step = mesh_size_m / (111000 * math.cos(math.radians(avg_lat)))
+        # グリッドの中心点（境界に合わせて開始）
+        center_lats = np.arange(min_lat, max_lat, lat_step) + lat_step / 2
+        center_lons = np.arange(min_lon, max_lon, lon_step) + lon_step / 2
+        if len(center_lats) == 0 or len(center_lons) == 0:
+            return
+        rows_per_chunk = max(1, chunk_size // len(center_lons))
+        # ポリゴンの変換・prepareはチャンクごとではなく1回だけ行う
+        polygon = prepare_polygon(polygon_coords) if polygon_coords else None
+        
+        for row in range(0, len(center_lats), rows_per_chunk):
+            if progress is not None:
+                progress(row / len(center_lats))
+            lon_grid, lat_grid = np.meshgrid(center_lons, center_lats[row:row + rows_per_chunk])
+            lats = lat_grid.ravel()
+            lons = lon_grid.ravel()
             
-            # グリッドの開始位置を計算（境界に合わせる）
-            grid_min_lat = min_lat
-            grid_min_lon = min_lon
+            # ポリゴンが指定されている場合はまとめて範囲内判定
+            if polygon is not None:
+                inside = points_in_polygon(lons, lats, polygon)
+                lats = lats[inside]
+                lons = lons[inside]
             
-            # グリッドを生成
-            current_lat = grid_min_lat
-            while current_lat < max_lat:
-                current_lon = grid_min_lon
-                while current_lon < max_lon:
-                    # グリッドの中心点
-                    center_lat = current_lat + lat_step / 2
-                    center_lon = current_lon + lon_step / 2
-                    
-                    # ポリゴンが指定されている場合は範囲内チェック
-                    if polygon and not self._point_in_polygon((center_lon, center_lat), polygon):
-                        current_lon += lon_step
-                        continue
-                    
-                    # ランダムに針葉樹/広葉樹を割り当て
-                    tree_type = 'coniferous' if random.random() < 0.6 else 'broadleaf'
-                    
-                    # ランダムなDBHと材積
-                    dbh = random.uniform(15, 45)
-                    volume = random.uniform(0.2, 1.2)
-                    
-                    tree_points.append({
-                        'lat': center_lat,
-                        'lon': center_lon,
-                        'tree_type': tree_type,
-                        'dbh': round(dbh, 1),
-                        'volume': round(volume, 3)
-                    })
-                    
-                    current_lon += lon_step
-                current_lat += lat_step
-        
-        return tree_points
+            n = len(lats)
+            if n == 0:
+                continue
+            yield {
+                'lat': lats,
+                'lon': lons,
+                # ランダムに針葉樹/広葉樹を割り当て（針葉樹60%, 広葉樹40%）
+                'tree_type': (self._rng.random(n) >= 0.6).astype(np.uint8),
+                # ランダムなDBHと材積
+                'dbh': self._rng.uniform(15, 45, n).astype(np.float32),
+                'volume': self._rng.uniform(0.2, 1.2, n).astype(np.float32)
+            }
     
-    def analyze_from_map(self, area_km2: float, bbox: tuple = None, polygon_coords: list = None) -> dict:
-        """地図モード：面積から樹木本数と材積を推定（ランダム）"""
+    def analyze_from_map(self, area_km2: float, bbox: tuple = None, polygon_coords: list = None,
+                         include_points: bool = True, progress=None) -> dict:
+        """
+        地図モード：面積から樹木本数と材積を推定（ランダム）
+        include_points=False の場合は tree_points を含めない（iter_tree_points で別途生成する）
+        progress: 樹木位置の生成の割合（0〜1）を受け取るコールバック
+        """
         # 面積に応じた基準値（1km²あたり）
         trees_per_km2 = random.randint(800, 1500)
         volume_per_tree = random.uniform(0.3, 0.8)
@@ -115,7 +152,8 @@ class AnalysisService:
         total_volume = tree_count * volume_per_tree
         
         # 樹木位置の生成
-        tree_points = self._generate_tree_points(tree_count, bbox, polygon_coords)
+        tree_points = (self._generate_tree_points(tree_count, bbox, polygon_coords, progress=progress)
+                       if include_points else None)
         
         warnings = []
         confidence = 'medium'
@@ -132,17 +170,24 @@ class AnalysisService:
             warnings.append(f'※ 検出本数: {tree_count}本（地図上には100本まで表示）')
         warnings.append('※MVP版：ランダムシミュレーションによる推定値です')
         
-        return {
+        result = {
             'tree_count': tree_count,
             'volume_m3': round(total_volume, 2),
             'confidence': confidence,
-            'warnings': warnings,
-            'tree_points': tree_points
+            'warnings': warnings
         }
+        if include_points:
+            result['tree_points'] = tree_points
+        return result
     
     def analyze_from_forest_registry(self, area_km2: float, bbox: tuple = None, 
-                                     polygon_coords: list = None, registry_id: str = None) -> dict:
-        """森林簿ベースモード：林班・小班から樹木本数と材積を推定"""
+                                     polygon_coords: list = None, registry_id: str = None,
+                                     include_points: bool = True, progress=None) -> dict:
+        """
+        森林簿ベースモード：林班・小班から樹木本数と材積を推定
+        include_points=False の場合は tree_points を含めない（iter_tree_points で別途生成する）
+        progress: 樹木位置の生成の割合（0〜1）を受け取るコールバック
+        """
         # 面積に応じた基準値（1km²あたり）
         trees_per_km2 = random.randint(800, 1500)
         volume_per_tree = random.uniform(0.3, 0.8)
@@ -152,7 +197,8 @@ class AnalysisService:
         total_volume = tree_count * volume_per_tree
         
         # 樹木位置の生成
-        tree_points = self._generate_tree_points(tree_count, bbox, polygon_coords)
+        tree_points = (self._generate_tree_points(tree_count, bbox, polygon_coords, progress=progress)
+                       if include_points else None)
         
         warnings = []
         confidence = 'medium'
@@ -172,41 +218,28 @@ class AnalysisService:
             warnings.append(f'※ 検出本数: {tree_count}本（地図上には100本まで表示）')
         warnings.append('※MVP版：ランダムシミュレーションによる推定値です')
         
-        return {
+        result = {
             'tree_count': tree_count,
             'volume_m3': round(total_volume, 2),
             'confidence': confidence,
-            'warnings': warnings,
-            'tree_points': tree_points
+            'warnings': warnings
         }
+        if include_points:
+            result['tree_points'] = tree_points
+        return result
     
-    def detect_trees(self, image_path: str) -> dict:
-        """樹木検出を実行（MVP版：簡易シミュレーション）"""
+    def detect_trees(self, image_path: str, progress=None) -> dict:
+        """
+        樹木検出を実行（重なりつきパッチに分割して検出し、境界の重複はNMSでまとめる）
+        progress: 処理済みの割合（0〜1）を受け取るコールバック
+        """
+        from services.job_service import JobCancelledError
+        
         try:
-            # 画像サイズを取得
-            img = Image.open(image_path)
-            width, height = img.size
-            
-            # 画像サイズに応じて検出本数をシミュレート
-            # 実際のDeepForest実装時に置き換え
-            area_pixels = width * height
-            estimated_trees = int(area_pixels / 50000)  # 仮の密度
-            
-            # ランダムに検出位置を生成
-            detections = []
-            for _ in range(estimated_trees):
-                x = random.randint(0, width)
-                y = random.randint(0, height)
-                size = random.randint(20, 80)
-                detections.append({
-                    'xmin': x,
-                    'ymin': y,
-                    'xmax': x + size,
-                    'ymax': y + size
-                })
-            
-            return {'detections': detections, 'count': len(detections)}
+            return self.detection_service.detect(image_path, progress)
         
+        except JobCancelledError:
+            raise
         except Exception as e:
             print(f"検出エラー: {str(e)}")
             return {'detections': [], 'count': 0}
@@ -222,62 +255,43 @@ class AnalysisService:
                 'volume_m3': 0.0,
                 'confidence': 'low',
                 'warnings': ['樹木が検出されませんでした'],
-                'tree_points': []
+                'tree_points': empty_tree_columns()
             }
         
-        # 簡易的な材積計算と樹木位置の生成
-        total_volume = 0.0
-        tree_points = []
-        
         # 範囲の緯度経度（bboxがある場合）
         if bbox:
             min_lon, min_lat, max_lon, max_lat = bbox
         else:
             min_lon, min_lat, max_lon, max_lat = 140.0, 40.0, 141.0, 41.0
         
-        # ポリゴン座標を変換
-        polygon = None
-        if polygon_coords:
-            # Pydanticモデルの場合は属性アクセス、辞書の場合は[]アクセス
-            if hasattr(polygon_coords[0], 'lon'):
-                polygon = [(coord.lon, coord.lat) for coord in polygon_coords]
-            else:
-                polygon = [(coord['lon'], coord['lat']) for coord in polygon_coords]
+        # 冠径→DBH→材積の簡易式（全検出をまとめて計算）
+        xmin = np.array([det['xmin'] for det in detections], dtype=np.float64)
+        ymin = np.array([det['ymin'] for det in detections], dtype=np.float64)
+        xmax = np.array([det['xmax'] for det in detections], dtype=np.float64)
+        ymax = np.array([det['ymax'] for det in detections], dtype=np.float64)
+        crown_diameter = ((xmax - xmin) + (ymax - ymin)) / 2
+        dbh_cm = crown_diameter * 0.3 * 30
+        height_m = dbh_cm * 0.8
+        volumes = 0.00005 * (dbh_cm ** 2) * height_m
+        total_volume = float(volumes.sum())
         
-        for i, det in enumerate(detections):
-            crown_width = det['xmax'] - det['xmin']
-            crown_height = det['ymax'] - det['ymin']
-            crown_diameter = (crown_width + crown_height) / 2
-            
-            # 冠径→DBH→材積の簡易式
-            dbh_cm = crown_diameter * 0.3 * 30
-            height_m = dbh_cm * 0.8
-            volume = 0.00005 * (dbh_cm ** 2) * height_m
-            total_volume += volume
-            
-            # ランダムな位置を生成（範囲内）
-            attempts = 0
-            while attempts < 100:
-                lat = random.uniform(min_lat, max_lat)
-                lon = random.uniform(min_lon, max_lon)
-                
-                # ポリゴンが指定されている場合は範囲内チェック
-                if polygon and not self._point_in_polygon((lon, lat), polygon):
-                    attempts += 1
-                    continue
-                
-                break
-            
+        # 検出位置（ボックス中心の緯度経度）を使用し、ない場合はランダムな位置（範囲内、ポリゴン指定時はポリゴン内）
+        lons = np.array([np.nan if det.get('lon') is None else det['lon'] for det in detections], dtype=np.float64)
+        lats = np.array([np.nan if det.get('lat') is None else det['lat'] for det in detections], dtype=np.float64)
+        missing = np.flatnonzero(np.isnan(lons) | np.isnan(lats))
+        if len(missing):
+            lons[missing], lats[missing] = random_points_in_polygon(
+                len(missing), (min_lon, min_lat, max_lon, max_lat), polygon_coords or None, rng=self._rng
+            )
+        
+        tree_points = {
+            'lat': lats,
+            'lon': lons,
             # ランダムに針葉樹/広葉樹を割り当て（針葉樹60%, 広葉樹40%）
-            tree_type = 'coniferous' if random.random() < 0.6 else 'broadleaf'
-            
-            tree_points.append({
-                'lat': lat,
-                'lon': lon,
-                'tree_type': tree_type,
-                'dbh': round(dbh_cm, 1),
-                'volume': round(volume, 3)
-            })
+            'tree_type': (self._rng.random(len(detections)) >= 0.6).astype(np.uint8),
+            'dbh': dbh_cm.astype(np.float32),
+            'volume': volumes.astype(np.float32)
+        }
         
         warnings = []
         confidence = 'medium'
@@ -290,7 +304,7 @@ class AnalysisService:
         
         return {
             'tree_count': int(tree_count),
-            'volume_m3': float(round(total_volume, 2)),
+            'volume_m3': round(total_volume, 2),
             'confidence': confidence,
             'warnings': warnings,
             'tree_points': tree_points
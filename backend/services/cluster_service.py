@@ -0,0 +1,248 @@
+"""
+解析結果の樹木位置をズームレベルごとにまとめるクラスタリング（supercluster と同じ考え方のグリッド版）
+- Webメルカトルの正規化座標で、ズーム z のタイル 256px を radius_px ごとのセルに分けて集計
+- max_zoom のセルを点から作り、それより低いズームは1つ上のズームのセルを2x2ずつまとめる
+- max_zoom より大きいズームでは個々の樹木を返す
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from services.analysis_service import TREE_TYPES
+
+
+def lonlat_to_world(lons, lats):
+    """緯度経度をWebメルカトルの正規化座標（0〜1、yは北が0）に変換"""
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -85.05112878, 85.05112878)
+    x = (np.asarray(lons, dtype=np.float64) + 180.0) / 360.0
+    sin = np.sin(np.radians(lats))
+    y = 0.5 - np.log((1 + sin) / (1 - sin)) / (4 * math.pi)
+    return x, y
+
+
+def world_to_lonlat(x, y):
+    lons = x * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * y))))
+    return lons, lats
+
+
+class ClusterIndex:
+    """1件の解析結果の樹木位置から作るズーム別のクラスター"""
+
+    def __init__(self, tree_points: dict, max_zoom: int = 20, radius_px: int = 64):
+        self.max_zoom = max_zoom
+        self.radius_px = radius_px
+        self.points = tree_points
+        self.count = int(len(tree_points['lat']))
+        self._levels = {}
+        self._build()
+
+    def _build(self):
+        """max_zoom のセルを点から集計し、下のズームは上のズームのセルをまとめて作る"""
+        points = self.points
+        x, y = lonlat_to_world(points['lon'], points['lat'])
+        coniferous = (points['tree_type'] == 0).astype(np.int64)
+        volume = points['volume'].astype(np.float64)
+        representative = np.arange(self.count, dtype=np.int64)
+
+        cells = 256 * 2 ** self.max_zoom / self.radius_px
+        cx = np.floor(x * cells).astype(np.int64)
+        cy = np.floor(y * cells).astype(np.int64)
+        counts = np.ones(self.count, dtype=np.int64)
+
+        for zoom in range(self.max_zoom, -1, -1):
+            # 同じセルの点（または1つ上のズームのセル）を集計
+            keys = (cx << 32) | cy
+            _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            size = len(first)
+            level = {
+                'cx': cx[first],
+                'cy': cy[first],
+                'count': np.bincount(inverse, weights=counts, minlength=size).astype(np.int64),
+                'sum_x': np.bincount(inverse, weights=x * counts, minlength=size),
+                'sum_y': np.bincount(inverse, weights=y * counts, minlength=size),
+                'volume': np.bincount(inverse, weights=volume, minlength=size),
+                'coniferous': np.bincount(inverse, weights=coniferous, minlength=size).astype(np.int64),
+                'representative': representative[first]
+            }
+            mean_x = level['sum_x'] / level['count']
+            mean_y = level['sum_y'] / level['count']
+            level['lon'], level['lat'] = world_to_lonlat(mean_x, mean_y)
+            self._levels[zoom] = level
+
+            # 1つ下のズームではセルの一辺が2倍になる
+            cx, cy = level['cx'] >> 1, level['cy'] >> 1
+            x, y = mean_x, mean_y
+            counts = level['count']
+            volume = level['volume']
+            coniferous = level['coniferous']
+            representative = level['representative']
+
+    def _select(self, zoom: int, bbox: tuple) -> tuple:
+        """ズーム z の bbox 内の (レベル, インデックス) を返す（点のレベルは None）"""
+        min_lon, min_lat, max_lon, max_lat = bbox
+        if zoom > self.max_zoom:
+            lons, lats = self.points['lon'], self.points['lat']
+            level = None
+        else:
+            level = self._levels[zoom]
+            lons, lats = level['lon'], level['lat']
+        inside = (lons >= min_lon) & (lons <= max_lon) & (lats >= min_lat) & (lats <= max_lat)
+        return level, np.flatnonzero(inside)
+
+    def get_clusters(self, zoom: int, bbox: tuple, limit: int = 5000) -> dict:
+        """
+        ズーム z・bbox 内のクラスターと樹木をGeoJSONのFeatureCollectionで返す
+        件数が limit を超える場合は超えなくなるまでズームを下げて集計する（実際のズームは 'zoom'）
+        """
+        zoom = max(0, min(int(zoom), self.max_zoom + 1))
+        level, indices = self._select(zoom, bbox)
+        while len(indices) > limit and zoom > 0:
+            zoom -= 1
+            level, indices = self._select(zoom, bbox)
+
+        features = []
+        clusters = 0
+        if level is None:
+            point_indices = indices
+        else:
+            single = level['count'][indices] == 1
+            point_indices = level['representative'][indices[single]]
+            cluster_indices = indices[~single]
+            clusters = len(cluster_indices)
+            lons = level['lon'][cluster_indices].tolist()
+            lats = level['lat'][cluster_indices].tolist()
+            counts = level['count'][cluster_indices].tolist()
+            volumes = np.round(level['volume'][cluster_indices], 3).tolist()
+            coniferous = level['coniferous'][cluster_indices].tolist()
+            for lon, lat, count, volume_m3, conifer in zip(lons, lats, counts, volumes, coniferous):
+                features.append({
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                    'properties': {
+                        'cluster': True,
+                        'point_count': count,
+                        'volume_m3': volume_m3,
+                        'coniferous': conifer,
+                        'broadleaf': count - conifer
+                    }
+                })
+
+        points = self.points
+        lons = points['lon'][point_indices].tolist()
+        lats = points['lat'][point_indices].tolist()
+        types = points['tree_type'][point_indices].tolist()
+        dbhs = np.round(points['dbh'][point_indices].astype(np.float64), 1).tolist()
+        volumes = np.round(points['volume'][point_indices].astype(np.float64), 3).tolist()
+        for lon, lat, tree_type, dbh, volume in zip(lons, lats, types, dbhs, volumes):
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                'properties': {
+                    'cluster': False,
+                    'tree_type': TREE_TYPES[tree_type],
+                    'dbh': dbh,
+                    'volume': volume
+                }
+            })
+
+        return {
+            'type': 'FeatureCollection',
+            'zoom': zoom,
+            'clusters': clusters,
+            'points': len(point_indices),
+            'features': features
+        }
+
+    def nbytes(self) -> int:
+        """インデックスの概算メモリ使用量"""
+        total = sum(values.nbytes for values in self.points.values())
+        for level in self._levels.values():
+            total += sum(values.nbytes for values in level.values())
+        return total
+
+
+class ClusterService:
+    """
+    result_id ごとのクラスターインデックスを作成・保持する（合計サイズ上限つきのLRU）
+    樹木位置は ResultStore から読み込み、最初の要求時にインデックスを作る
+    元の結果が削除・期限切れになったインデックスは返さない
+    """
+
+    def __init__(self, result_store, max_bytes: int = 256 * 1024 * 1024,
+                 max_zoom: int = 20, radius_px: int = 64):
+        self.result_store = result_store
+        self.max_bytes = max_bytes
+        self.max_zoom = max_zoom
+        self.radius_px = radius_px
+        self._cache = OrderedDict()  # result_id -> (ClusterIndex, size, saved_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get_index(self, result_id: str):
+        """クラスターインデックスを取得（結果が存在しない・期限切れはNone）"""
+        with self._lock:
+            entry = self._cache.get(result_id)
+            if entry is not None:
+                index, size, saved_at = entry
+                # ResultStore.load と同じく、結果の保存から ttl 秒を過ぎたものは使わない
+                if (time.time() - saved_at <= self.result_store.ttl and
+                        self.result_store.saved_at(result_id) == saved_at):
+                    self._cache.move_to_end(result_id)
+                    self.hits += 1
+                    return index
+                del self._cache[result_id]
+                self._bytes -= size
+                self.expired += 1
+            self.misses += 1
+
+        saved_at = self.result_store.saved_at(result_id)
+        result = self.result_store.load(result_id)
+        if result is None or saved_at is None:
+            return None
+        index = ClusterIndex(result['tree_points'], max_zoom=self.max_zoom, radius_px=self.radius_px)
+        self._insert(result_id, index, index.nbytes(), saved_at)
+        return index
+
+    def get_clusters(self, result_id: str, zoom: int, bbox: tuple, limit: int = 5000) -> dict:
+        index = self.get_index(result_id)
+        if index is None:
+            return None
+        clusters = index.get_clusters(zoom, bbox, limit)
+        clusters['result_id'] = result_id
+        return clusters
+
+    def _insert(self, result_id: str, index: ClusterIndex, size: int, saved_at: float):
+        with self._lock:
+            if size > self.max_bytes:
+                # 上限を超えるものはキャッシュしない
+                return
+            if result_id in self._cache:
+                self._bytes -= self._cache.pop(result_id)[1]
+            self._cache[result_id] = (index, size, saved_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._cache:
+                _, (_, evicted_size, _) = self._cache.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'results': len(self._cache),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
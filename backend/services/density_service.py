@@ -0,0 +1,273 @@
+"""
+解析結果の樹木位置をセルごとの本数・材積に集計した密度ラスター
+- GeoTIFF（EPSG:4326、バンド1: tree_count、バンド2: volume_m3）
+- ヒートマップのPNGタイル（XYZ、Webメルカトル）
+"""
+import io
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+# バンド名 -> (バンド番号, 単位, 説明)
+DENSITY_BANDS = {
+    'tree_count': (1, 'trees/cell', 'セル内の樹木本数'),
+    'volume_m3': (2, 'm3/cell', 'セル内の材積合計'),
+}
+
+# セルの一辺（m）の範囲と、1枚のラスターの最大セル数
+MIN_CELL_SIZE_M = 1.0
+MAX_CELL_SIZE_M = 10000.0
+MAX_CELLS = 4096 * 4096
+
+# ヒートマップの色（値の割合 0〜1 -> RGBA）。0本のセルは透明
+HEATMAP_STOPS = (
+    (0.0, (255, 255, 178, 160)),
+    (0.25, (254, 204, 92, 190)),
+    (0.5, (253, 141, 60, 210)),
+    (0.75, (240, 59, 32, 230)),
+    (1.0, (189, 0, 38, 255)),
+)
+
+
+def density_grid(tree_points: dict, bbox: tuple, cell_size_m: float) -> dict:
+    """
+    樹木位置を cell_size_m 四方のセル（緯度経度の格子、北が上）に集計
+    戻り値: {'tree_count': (H, W), 'volume_m3': (H, W), 'transform', 'bounds', 'width', 'height', ...}
+    """
+    from rasterio.transform import from_origin
+
+    if not MIN_CELL_SIZE_M <= cell_size_m <= MAX_CELL_SIZE_M:
+        raise ValueError(f"cell_sizeは{MIN_CELL_SIZE_M:g}〜{MAX_CELL_SIZE_M:g}mで指定してください")
+
+    lons = tree_points['lon']
+    lats = tree_points['lat']
+    if not bbox and len(lons) == 0:
+        raise ValueError("範囲も樹木もない結果からは密度ラスターを作れません")
+    if len(lons):
+        # グリッド端の樹木（セル中心が範囲から半セルはみ出す）も数えるよう範囲を広げる
+        extent = (float(lons.min()), float(lats.min()), float(lons.max()), float(lats.max()))
+        if bbox:
+            extent = (min(bbox[0], extent[0]), min(bbox[1], extent[1]),
+                      max(bbox[2], extent[2]), max(bbox[3], extent[3]))
+        bbox = extent
+    min_lon, min_lat, max_lon, max_lat = bbox
+
+    # _generate_tree_points と同じ近似（緯度1度 ≈ 111km）
+    avg_lat = (min_lat + max_lat) / 2
+    lat_step = cell_size_m / 111000
+    lon_step = cell_size_m / (111000 * math.cos(math.radians(avg_lat)))
+    width = max(1, math.ceil((max_lon - min_lon) / lon_step))
+    height = max(1, math.ceil((max_lat - min_lat) / lat_step))
+    if width * height > MAX_CELLS:
+        raise ValueError(
+            f"セル数が多すぎます（{width}x{height}）。cell_sizeを大きくしてください"
+        )
+
+    cols = np.floor((lons - min_lon) / lon_step).astype(np.int64)
+    rows = np.floor((max_lat - lats) / lat_step).astype(np.int64)
+    inside = (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height)
+    cells = rows[inside] * width + cols[inside]
+
+    counts = np.bincount(cells, minlength=width * height).astype(np.float32)
+    volumes = np.bincount(
+        cells, weights=tree_points['volume'][inside].astype(np.float64), minlength=width * height
+    ).astype(np.float32)
+
+    return {
+        'tree_count': counts.reshape(height, width),
+        'volume_m3': volumes.reshape(height, width),
+        'transform': from_origin(min_lon, max_lat, lon_step, lat_step),
+        'bounds': (min_lon, max_lat - height * lat_step, min_lon + width * lon_step, max_lat),
+        'width': width,
+        'height': height,
+        'cell_size_m': cell_size_m
+    }
+
+
+def band_metadata(grid: dict) -> list:
+    """各バンドの名前・単位・最大値・合計"""
+    return [
+        {
+            'band': index,
+            'name': name,
+            'unit': unit,
+            'description': description,
+            'max': round(float(grid[name].max()), 3),
+            'total': round(float(grid[name].sum(dtype=np.float64)), 3)
+        }
+        for name, (index, unit, description) in DENSITY_BANDS.items()
+    ]
+
+
+def encode_geotiff(grid: dict, summary: dict = None) -> bytes:
+    """
+    密度ラスターをGeoTIFF（float32 2バンド、DEFLATE圧縮）に変換
+    バンドの説明・単位とセルサイズ・解析サマリーをタグに入れる
+    """
+    from rasterio.io import MemoryFile
+
+    profile = {
+        'driver': 'GTiff',
+        'dtype': 'float32',
+        'count': len(DENSITY_BANDS),
+        'width': grid['width'],
+        'height': grid['height'],
+        'crs': 'EPSG:4326',
+        'transform': grid['transform'],
+        'compress': 'DEFLATE',
+        'predictor': 3
+    }
+    if grid['width'] >= 256 and grid['height'] >= 256:
+        profile.update(tiled=True, blockxsize=256, blockysize=256)
+
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dst:
+            for name, (index, unit, description) in DENSITY_BANDS.items():
+                dst.write(grid[name], index)
+                dst.set_band_description(index, name)
+                dst.update_tags(index, unit=unit, description=description)
+            tags = {'cell_size_m': grid['cell_size_m']}
+            for key, value in (summary or {}).items():
+                if key in ('tree_count', 'volume_m3', 'confidence', 'result_id'):
+                    tags[f'analysis_{key}'] = value
+            dst.update_tags(**tags)
+        return memfile.read()
+
+
+def encode_result_geotiff(result: dict, bbox: tuple, cell_size_m: float) -> bytes:
+    """解析結果（列形式の tree_points）を密度ラスターのGeoTIFFに変換"""
+    from services.tree_points_format import _columns
+
+    grid = density_grid(_columns(result['tree_points']), bbox, cell_size_m)
+    return encode_geotiff(grid, result)
+
+
+def colorize(values, vmax: float):
+    """値をヒートマップのRGBA (H, W, 4) uint8 に変換（0・NaNのセルは透明）"""
+    positions = np.array([stop[0] for stop in HEATMAP_STOPS])
+    colors = np.array([stop[1] for stop in HEATMAP_STOPS], dtype=np.float32)
+    valid = np.isfinite(values) & (values > 0)
+    ratio = np.zeros(values.shape, dtype=np.float32)
+    if vmax > 0:
+        ratio[valid] = np.clip(values[valid] / vmax, 0, 1)
+
+    rgba = np.zeros(values.shape + (4,), dtype=np.uint8)
+    for channel in range(4):
+        rgba[..., channel][valid] = np.interp(ratio[valid], positions, colors[:, channel]).astype(np.uint8)
+    return rgba
+
+
+def render_heatmap_tile(grid: dict, band: str, z: int, x: int, y: int, tile_size: int = 256):
+    """
+    密度ラスターのヒートマップタイル（PNG）を返す
+    色はラスター全体の最大値で正規化するため、タイルの境目で色が変わらない
+    ラスターと重ならないタイルはNone
+    """
+    from PIL import Image
+    from rasterio.enums import Resampling
+    from rasterio.transform import from_bounds
+    from rasterio.warp import reproject
+    from services.tile_service import tile_bounds_lonlat, tile_bounds_mercator
+
+    if band not in DENSITY_BANDS:
+        raise ValueError(f"bandは {', '.join(DENSITY_BANDS)} のいずれかを指定してください")
+
+    min_lon, min_lat, max_lon, max_lat = grid['bounds']
+    tile_lonlat = tile_bounds_lonlat(z, x, y)
+    if (tile_lonlat[0] >= max_lon or tile_lonlat[2] <= min_lon or
+            tile_lonlat[1] >= max_lat or tile_lonlat[3] <= min_lat):
+        return None
+
+    values = np.full((tile_size, tile_size), np.nan, dtype=np.float32)
+    reproject(
+        source=grid[band],
+        destination=values,
+        src_transform=grid['transform'],
+        src_crs='EPSG:4326',
+        dst_transform=from_bounds(*tile_bounds_mercator(z, x, y), tile_size, tile_size),
+        dst_crs='EPSG:3857',
+        dst_nodata=np.nan,
+        resampling=Resampling.nearest
+    )
+
+    img = Image.fromarray(colorize(values, float(grid[band].max())), 'RGBA')
+    img_io = io.BytesIO()
+    img.save(img_io, 'PNG')
+    return img_io.getvalue()
+
+
+def _grid_size(grid: dict) -> int:
+    """密度ラスターの概算メモリ使用量"""
+    return sum(grid[name].nbytes for name in DENSITY_BANDS) + 1024
+
+
+class DensityService:
+    """
+    result_id・セルサイズごとの密度ラスターを作成・保持する（合計サイズ上限つきのLRU）
+    樹木位置は ResultStore から読み込み、元の結果が削除・期限切れになったラスターは返さない
+    """
+
+    def __init__(self, result_store, max_bytes: int = 256 * 1024 * 1024):
+        self.result_store = result_store
+        self.max_bytes = max_bytes
+        self._cache = OrderedDict()  # (result_id, cell_size_m) -> ((grid, summary), size, saved_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_grid(self, result_id: str, cell_size_m: float) -> tuple:
+        """(密度ラスター, 解析サマリー) を返す（結果が存在しない・期限切れはNone）"""
+        key = (result_id, float(cell_size_m))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                entry, size, saved_at = cached
+                # ResultStore.load と同じく、結果の保存から ttl 秒を過ぎたものは使わない
+                if (time.time() - saved_at <= self.result_store.ttl and
+                        self.result_store.saved_at(result_id) == saved_at):
+                    self._cache.move_to_end(key)
+                    return entry
+                del self._cache[key]
+                self._bytes -= size
+
+        saved_at = self.result_store.saved_at(result_id)
+        result = self.result_store.load(result_id)
+        if result is None or saved_at is None:
+            return None
+        grid = density_grid(result['tree_points'], result['bbox'], cell_size_m)
+        entry = (grid, result['summary'])
+        self._insert(key, entry, _grid_size(grid), saved_at)
+        return entry
+
+    def _insert(self, key: tuple, entry: tuple, size: int, saved_at: float):
+        with self._lock:
+            if size > self.max_bytes:
+                # 上限を超えるものはキャッシュしない
+                return
+            if key in self._cache:
+                self._bytes -= self._cache.pop(key)[1]
+            self._cache[key] = (entry, size, saved_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._cache:
+                _, (_, evicted_size, _) = self._cache.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def get_metadata(self, result_id: str, cell_size_m: float) -> dict:
+        """タイル表示用のメタデータ（範囲・セル数・各バンドの最大値と合計）"""
+        entry = self.get_grid(result_id, cell_size_m)
+        if entry is None:
+            return None
+        grid, _ = entry
+        min_lon, min_lat, max_lon, max_lat = grid['bounds']
+        return {
+            'result_id': result_id,
+            'cell_size_m': grid['cell_size_m'],
+            'width': grid['width'],
+            'height': grid['height'],
+            'bounds': [min_lon, min_lat, max_lon, max_lat],
+            'crs': 'EPSG:4326',
+            'bands': band_metadata(grid)
+        }
@@ -0,0 +1,290 @@
+import numpy as np
+
+
+# 仮の樹木密度（有効画素 50,000 px あたり1本）に相当するセルの一辺（px）
+SIMULATED_TREE_CELL_PX = int(50000 ** 0.5)
+
+# 値域（検出器に渡す0〜1の正規化用）を求める際の縮小読み込みサイズ
+VALUE_RANGE_SAMPLE_SIZE = 1024
+
+
+def value_range(src) -> tuple:
+    """
+    検出器の入力を0〜1に正規化するための値域（最小, 最大）
+    uint8 は 0〜255、それ以外（uint16・float など）は縮小読み込みした有効画素の最小・最大
+    """
+    if src.dtypes[0] == 'uint8':
+        return 0.0, 255.0
+    bands = min(3, src.count)
+    scale = max(1.0, max(src.width, src.height) / VALUE_RANGE_SAMPLE_SIZE)
+    out_shape = (bands, max(1, int(src.height / scale)), max(1, int(src.width / scale)))
+    data = src.read(list(range(1, bands + 1)), out_shape=out_shape, masked=True)
+    values = data.compressed()
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return 0.0, 1.0
+    return float(values.min()), float(values.max())
+
+
+def iter_windows(width: int, height: int, patch_size: int, overlap: int):
+    """
+    画像を重なりつきのパッチに分割して (col_off, row_off, width, height) を返す
+    端のパッチは画像内に収まるよう内側にずらす（画像がパッチより小さい場合は画像全体）
+    """
+    step = max(1, patch_size - overlap)
+
+    def _offsets(size):
+        if size <= patch_size:
+            return [0]
+        offsets = list(range(0, size - patch_size, step))
+        offsets.append(size - patch_size)
+        return offsets
+
+    for row_off in _offsets(height):
+        for col_off in _offsets(width):
+            yield col_off, row_off, min(patch_size, width - col_off), min(patch_size, height - row_off)
+
+
+def non_max_suppression(boxes, scores, iou_threshold: float):
+    """
+    IoUがしきい値を超えて重なるボックスのうちスコアが最大のものだけを残す
+    boxes: (N, 4) [xmin, ymin, xmax, ymax]、戻り値: 残すボックスのインデックス
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(-scores, kind='stable')
+
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        # 残り全件とのIoUをまとめて計算
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+
+    return np.array(keep, dtype=np.int64)
+
+
+def _cell_noise(cx, cy, salt: float):
+    """セル番号から決まる [0, 1) の擬似乱数（同じセルはどのパッチからでも同じ値）"""
+    v = np.sin(cx * 12.9898 + cy * 78.233 + salt * 37.719) * 43758.5453
+    return v - np.floor(v)
+
+
+class SimulatedDetector:
+    """
+    MVP版の検出器（DeepForest導入までの簡易シミュレーション）
+    画像全体の格子セルごとに1本の樹木を置くため、重なったパッチからは同じボックスが返る
+    """
+
+    def __init__(self, cell_px: int = SIMULATED_TREE_CELL_PX):
+        self.cell_px = cell_px
+
+    def predict_batch(self, patches: list) -> list:
+        results = []
+        for patch in patches:
+            col_off, row_off = patch['col_off'], patch['row_off']
+            height, width = patch['mask'].shape
+
+            cx, cy = np.meshgrid(
+                np.arange(col_off // self.cell_px, (col_off + width) // self.cell_px + 1),
+                np.arange(row_off // self.cell_px, (row_off + height) // self.cell_px + 1)
+            )
+            cx, cy = cx.ravel(), cy.ravel()
+
+            # 樹冠の中心（画像全体のピクセル座標）とサイズ（20〜80px）
+            center_x = (cx + _cell_noise(cx, cy, 1)) * self.cell_px
+            center_y = (cy + _cell_noise(cx, cy, 2)) * self.cell_px
+            size = 20 + np.floor(_cell_noise(cx, cy, 3) * 61)
+            scores = 0.3 + _cell_noise(cx, cy, 4) * 0.7
+
+            # パッチ座標に変換し、中心がパッチ内のものだけ残す（マスク外は DetectionService が除く）
+            px = np.floor(center_x - col_off).astype(np.int64)
+            py = np.floor(center_y - row_off).astype(np.int64)
+            inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+            px, py, size, scores = px[inside], py[inside], size[inside], scores[inside]
+
+            boxes = np.stack([px - size / 2, py - size / 2, px + size / 2, py + size / 2], axis=1)
+            boxes = np.clip(boxes, 0, [width, height, width, height])
+            results.append((boxes.astype(np.float64), scores.astype(np.float64)))
+        return results
+
+
+class DeepForestDetector:
+    """
+    DeepForestの学習済みモデルによる検出（deepforestがインストールされている場合）
+    バッチのパッチをまとめて1回の推論で検出する（predict_image をパッチごとに呼ばない）
+    """
+
+    def __init__(self):
+        from deepforest import main as deepforest_main
+
+        self.model = deepforest_main.deepforest()
+        self.model.use_release()
+        self.model.model.eval()
+
+    def predict_batch(self, patches: list) -> list:
+        import torch
+
+        # predict_image と同じ前処理（RGBの3チャンネル、0〜1に正規化したCHW）
+        # uint8 以外の画像は画像全体の値域で正規化する
+        images = []
+        for patch in patches:
+            data = patch['data']
+            vmin, vmax = patch.get('value_range', (0.0, 255.0))
+            rgb = np.stack([data[min(i, data.shape[0] - 1)] for i in range(3)]).astype(np.float32)
+            rgb = np.clip((rgb - vmin) / ((vmax - vmin) or 1.0), 0.0, 1.0)
+            images.append(torch.from_numpy(rgb).to(self.model.device))
+
+        # 画像端のパッチは小さいため、サイズの異なるテンソルのリストで渡す
+        # （RetinaNet側でパディングして1つのバッチにまとめて推論する）
+        with torch.no_grad():
+            predictions = self.model.model(images)
+
+        return [
+            (prediction['boxes'].cpu().numpy().astype(np.float64),
+             prediction['scores'].cpu().numpy().astype(np.float64))
+            for prediction in predictions
+        ]
+
+
+class DetectionService:
+    """
+    大きな画像を重なりつきパッチに分割して樹木検出を行うエンジン
+    - パッチはウィンドウ単位で読み込み、batch_size件ずつ検出器に渡す（メモリはパッチ数に比例しない）
+    - 中心がマスク外（ポリゴン外・nodata）のボックスは検出器によらず捨てる
+    - パッチの内側の境界で切れたボックスは隣のパッチで完全に見えるため捨てる
+    - 重なり部分の重複はNMSでまとめ、ボックスを画像座標・緯度経度に変換する
+    """
+
+    def __init__(self, detector=None, patch_size: int = 400, overlap: int = 100,
+                 batch_size: int = 8, iou_threshold: float = 0.4):
+        self.detector = detector or SimulatedDetector()
+        self.patch_size = patch_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.iou_threshold = iou_threshold
+
+    @classmethod
+    def from_name(cls, name: str = None, **kwargs):
+        """検出器名（'simulated' / 'deepforest'）から作成（deepforestが使えない場合は簡易版）"""
+        detector = None
+        if name == 'deepforest':
+            try:
+                detector = DeepForestDetector()
+            except Exception as e:
+                print(f"DeepForestを読み込めません（簡易シミュレーションを使用します）: {e}")
+        return cls(detector, **kwargs)
+
+    def detect(self, image_path: str, progress=None) -> dict:
+        """
+        画像全体を検出して {'detections': [...], 'count': n} を返す
+        各検出は画像座標のボックス（xmin, ymin, xmax, ymax）、score、中心の緯度経度（lon, lat）
+        progress を指定するとバッチごとに処理済みの割合（0〜1）で呼び出す
+        """
+        import rasterio
+        from rasterio.windows import Window
+
+        all_boxes = []
+        all_scores = []
+
+        with rasterio.open(image_path) as src:
+            width, height = src.width, src.height
+            windows = list(iter_windows(width, height, self.patch_size, self.overlap))
+            patch_range = value_range(src)
+
+            for start in range(0, len(windows), self.batch_size):
+                patches = []
+                for col_off, row_off, w, h in windows[start:start + self.batch_size]:
+                    window = Window(col_off, row_off, w, h)
+                    patches.append({
+                        'data': src.read(window=window),
+                        'mask': src.dataset_mask(window=window),
+                        'col_off': col_off,
+                        'row_off': row_off,
+                        'value_range': patch_range
+                    })
+
+                for patch, (boxes, scores) in zip(patches, self.detector.predict_batch(patches)):
+                    boxes, scores = self._drop_masked_boxes(np.asarray(boxes), np.asarray(scores), patch)
+                    if len(boxes) == 0:
+                        continue
+                    boxes, scores = self._drop_cut_boxes(boxes, scores, patch, width, height)
+                    boxes = boxes + [patch['col_off'], patch['row_off'], patch['col_off'], patch['row_off']]
+                    all_boxes.append(boxes)
+                    all_scores.append(scores)
+
+                if progress is not None:
+                    progress(min(1.0, (start + self.batch_size) / len(windows)))
+
+            if not all_boxes:
+                return {'detections': [], 'count': 0}
+
+            boxes = np.concatenate(all_boxes)
+            scores = np.concatenate(all_scores)
+            keep = non_max_suppression(boxes, scores, self.iou_threshold)
+            boxes, scores = boxes[keep], scores[keep]
+
+            lons, lats = self._box_centers_lonlat(src, boxes)
+
+        detections = [
+            {
+                'xmin': float(b[0]), 'ymin': float(b[1]), 'xmax': float(b[2]), 'ymax': float(b[3]),
+                'score': float(s),
+                'lon': lon, 'lat': lat
+            }
+            for b, s, lon, lat in zip(boxes, scores, lons, lats)
+        ]
+        print(f"検出: {len(windows)} パッチ, {len(detections)} 本（NMS前 {sum(len(b) for b in all_boxes)}）")
+        return {'detections': detections, 'count': len(detections)}
+
+    @staticmethod
+    def _drop_masked_boxes(boxes, scores, patch: dict):
+        """中心の画素がマスク外（ポリゴン外・nodata）のボックスを除外"""
+        if len(boxes) == 0:
+            return boxes.reshape(0, 4), scores
+        mask_h, mask_w = patch['mask'].shape
+        cols = np.clip(np.floor((boxes[:, 0] + boxes[:, 2]) / 2).astype(np.int64), 0, mask_w - 1)
+        rows = np.clip(np.floor((boxes[:, 1] + boxes[:, 3]) / 2).astype(np.int64), 0, mask_h - 1)
+        valid = patch['mask'][rows, cols] > 0
+        return boxes[valid], scores[valid]
+
+    def _drop_cut_boxes(self, boxes, scores, patch: dict, width: int, height: int):
+        """画像の端ではないパッチ境界に接するボックス（隣のパッチで完全に見える）を除外"""
+        mask_h, mask_w = patch['mask'].shape
+        col_off, row_off = patch['col_off'], patch['row_off']
+        cut = np.zeros(len(boxes), dtype=bool)
+        if col_off > 0:
+            cut |= boxes[:, 0] <= 0
+        if row_off > 0:
+            cut |= boxes[:, 1] <= 0
+        if col_off + mask_w < width:
+            cut |= boxes[:, 2] >= mask_w
+        if row_off + mask_h < height:
+            cut |= boxes[:, 3] >= mask_h
+        return boxes[~cut], scores[~cut]
+
+    @staticmethod
+    def _box_centers_lonlat(src, boxes):
+        """ボックス中心を緯度経度に変換（座標系のない画像はNone）"""
+        if src.crs is None:
+            return [None] * len(boxes), [None] * len(boxes)
+
+        from rasterio.warp import transform
+
+        cols = (boxes[:, 0] + boxes[:, 2]) / 2
+        rows = (boxes[:, 1] + boxes[:, 3]) / 2
+        t = src.transform
+        xs = t.c + cols * t.a + rows * t.b
+        ys = t.f + cols * t.d + rows * t.e
+        if src.crs.to_epsg() == 4326:
+            return xs.tolist(), ys.tolist()
+        lons, lats = transform(src.crs, 'EPSG:4326', xs.tolist(), ys.tolist())
+        return list(lons), list(lats)
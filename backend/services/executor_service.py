@@ -0,0 +1,229 @@
+"""
+解析処理（クロップ・樹木検出・材積計算）をイベントループの外で実行する実行基盤
+プロセスプールの各ワーカーは起動時に検出モデルを1回だけ読み込み、以降の解析で使い回す
+"""
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ExecutorBusyError(RuntimeError):
+    """実行待ちの解析が上限に達している"""
+
+
+# ワーカープロセス内で使い回すサービス（_init_worker で作成）
+_worker = {}
+
+
+def _init_worker(config: dict):
+    """ワーカー起動時にサービスと検出モデルを読み込む"""
+    from services.analysis_service import AnalysisService
+    from services.detection_service import DetectionService
+    from services.image_service import ImageService
+
+    _worker['image_service'] = ImageService(config.get('upload_dir'))
+    _worker['analysis_service'] = AnalysisService(
+        DetectionService.from_name(config.get('detector'), **config.get('detection', {})),
+        mesh_size_m=config.get('mesh_size_m', 5.0)
+    )
+    _worker['job_db'] = config.get('job_db')
+    if config.get('result_dir'):
+        from services.result_store import ResultStore
+        _worker['result_store'] = ResultStore(config['result_dir'], ttl=config.get('result_ttl', 3600))
+
+
+def _services():
+    if not _worker:
+        _init_worker({})
+    return _worker['image_service'], _worker['analysis_service']
+
+
+def warm_up() -> bool:
+    """ワーカーを起動させるための空タスク（初期化は _init_worker で行われる）"""
+    _services()
+    return True
+
+
+def _save_result(result: dict, bbox: tuple) -> dict:
+    """結果ストアが設定されていれば解析結果を保存し、result_id を付けて返す（クラスター・密度表示用）"""
+    store = _worker.get('result_store')
+    if store is not None:
+        result['result_id'] = store.save(result, bbox)
+    return result
+
+
+def analyze_map(area_km2: float, bbox: tuple, polygon_coords: list = None,
+                forest_registry_id: str = None, progress=None) -> dict:
+    """モードA（地図）の解析"""
+    _, analysis_service = _services()
+    volume_progress = None
+    if progress is not None:
+        progress('volume', 0.0)
+        volume_progress = lambda done: progress('volume', done)
+    if forest_registry_id:
+        result = analysis_service.analyze_from_forest_registry(
+            area_km2, bbox, polygon_coords, forest_registry_id, progress=volume_progress
+        )
+    else:
+        result = analysis_service.analyze_from_map(area_km2, bbox, polygon_coords, progress=volume_progress)
+    return _save_result(result, bbox)
+
+
+def analyze_upload(image_path: str, bbox: tuple, polygon_coords: list = None,
+                   progress=None) -> dict:
+    """
+    モードB（画像アップロード）の解析
+    クロップ（メモリ上の画像）はワーカー内で作成・解放する
+    progress(stage, 割合) で段階（crop 0〜10%, detect 10〜90%, volume 90〜100%）を通知
+    """
+    image_service, analysis_service = _services()
+    if progress is not None:
+        progress('crop', 0.0)
+    cropped_path = image_service.crop_to_bbox(image_path, bbox, polygon_coords)
+    try:
+        detect_progress = None
+        if progress is not None:
+            progress('detect', 0.1)
+            detect_progress = lambda done: progress('detect', 0.1 + 0.8 * done)
+        detections = analysis_service.detect_trees(cropped_path, detect_progress)
+        if progress is not None:
+            progress('volume', 0.9)
+        return _save_result(analysis_service.calculate_volume(detections, bbox, polygon_coords), bbox)
+    finally:
+        image_service.release_crop(cropped_path)
+
+
+def run_analysis_job(job_id: str, mode: str, *args):
+    """
+    ジョブとして解析を実行し、進捗・結果をジョブストアに書き込む（戻り値は使わない）
+    キャンセル要求はクロップ・検出バッチ・樹木位置のチャンクの区切りごとに確認する
+    樹木位置は ResultStore に保存済みのため、ジョブストアにはサマリーと result_id だけを書き込む
+    （結果ストアが設定されていない場合のみ樹木位置も書き込む）
+    """
+    from services.analysis_service import tree_points_to_list
+    from services.job_service import JobCancelledError, JobProgress, JobStore
+
+    _services()
+    store = _worker.get('job_store')
+    if store is None:
+        store = _worker['job_store'] = JobStore(_worker['job_db'])
+    progress = JobProgress(store, job_id)
+
+    try:
+        if mode == 'map':
+            result = analyze_map(*args, progress=progress)
+        else:
+            result = analyze_upload(*args, progress=progress)
+        if result.get('result_id'):
+            del result['tree_points']
+        else:
+            result['tree_points'] = tree_points_to_list(result['tree_points'])
+        store.finish(job_id, result)
+    except JobCancelledError:
+        print(f"ジョブをキャンセルしました: {job_id}")
+        store.mark_cancelled(job_id)
+    except Exception as e:
+        print(f"ジョブエラー ({job_id}): {e}")
+        store.fail(job_id, str(e))
+
+
+class AnalysisExecutor:
+    """
+    解析をプロセスプールで実行する（max_workers=0 の場合は同じプロセスのスレッドで実行）
+    実行中・待機中の件数が max_pending に達したら ExecutorBusyError
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, config: dict = None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.config = config or {}
+        self._pool = None
+        self._pending = 0
+        # key を指定して投入した実行中・待機中の Future（cancel で取り消す）
+        self._futures = {}
+        self.completed = 0
+        self.rejected = 0
+
+    def start(self):
+        """プロセスプールを起動し、全ワーカーで検出モデルを読み込んでおく"""
+        if self.max_workers <= 0:
+            _init_worker(self.config)
+            return
+        if self._pool is not None:
+            return
+
+        # fork後のスレッド・SQLiteコネクションの問題を避けるためspawnで起動
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.config,)
+        )
+        for _ in range(self.max_workers):
+            self._pool.submit(warm_up)
+        print(f"解析ワーカーを起動: {self.max_workers} プロセス（待機上限 {self.max_pending}）")
+
+    def is_busy(self) -> bool:
+        """実行待ちが上限に達しているか"""
+        return self._pending >= self.max_pending
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def run(self, fn, *args, key: str = None):
+        """
+        fn(*args) をワーカーで実行して結果を待つ（イベントループはブロックしない）
+        key を指定するとワーカーが取り出す前なら cancel(key) で取り消せる（取り消すと CancelledError）
+        """
+        if self.is_busy():
+            self.rejected += 1
+            raise ExecutorBusyError("解析の実行待ちが上限に達しています。しばらくしてから再実行してください")
+
+        self._pending += 1
+        try:
+            if self._pool is None and self.max_workers > 0:
+                self.start()
+            if self._pool is None:
+                from starlette.concurrency import run_in_threadpool
+                result = await run_in_threadpool(fn, *args)
+            else:
+                pool = self._pool
+                future = pool.submit(fn, *args)
+                if key is not None:
+                    self._futures[key] = future
+                try:
+                    result = await asyncio.wrap_future(future)
+                except BrokenProcessPool:
+                    # ワーカーが異常終了（メモリ不足など）したプールは使えないため、次の解析で作り直す
+                    # （同じプールで失敗した他の解析が作り直し後のプールを止めないよう確認する）
+                    if self._pool is pool:
+                        print("解析ワーカーが異常終了しました。プロセスプールを再起動します")
+                        self.shutdown()
+                    raise
+                finally:
+                    if key is not None:
+                        self._futures.pop(key, None)
+            self.completed += 1
+            return result
+        finally:
+            self._pending -= 1
+
+    def cancel(self, key: str) -> bool:
+        """
+        key で投入した解析をワーカーが取り出す前に取り消す
+        取り消せた場合True（すでに実行中・終了済み・スレッド実行の場合はFalse）
+        """
+        future = self._futures.get(key)
+        return future is not None and future.cancel()
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.max_workers,
+            'pending': self._pending,
+            'max_pending': self.max_pending,
+            'completed': self.completed,
+            'rejected': self.rejected
+        }
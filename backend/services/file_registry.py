@@ -0,0 +1,76 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class FileRegistry:
+    """
+    file_id -> 画像パス・メタデータの登録簿（SQLite、WALモード）
+    複数ワーカー（uvicorn --workers N）や再起動後も同じfile_idで画像を参照できる
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+
+        conn = self._connection()
+        # WALモードにすると読み込みが書き込みにブロックされない（設定はDBファイルに保存される）
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                file_id TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                metadata TEXT,
+                created_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_files_created_at ON files (created_at)")
+        conn.commit()
+
+    def _connection(self):
+        """スレッドごとのコネクション"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def register(self, file_id: str, path: str, metadata: dict = None, kind: str = 'upload'):
+        """ファイルを登録（kind: 'upload' / 'preset'）"""
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO files (file_id, path, kind, metadata, created_at) VALUES (?, ?, ?, ?, ?)",
+            (file_id, str(path), kind,
+             json.dumps(metadata, ensure_ascii=False) if metadata else None, time.time())
+        )
+        conn.commit()
+
+    def get_path(self, file_id: str):
+        """file_idの画像パス（未登録はNone）"""
+        row = self._connection().execute(
+            "SELECT path FROM files WHERE file_id = ?", (file_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_metadata(self, file_id: str) -> dict:
+        """file_idのメタデータ（未登録・メタデータなしは空の辞書）"""
+        row = self._connection().execute(
+            "SELECT metadata FROM files WHERE file_id = ?", (file_id,)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return {}
+        return json.loads(row[0])
+
+    def delete(self, file_id: str) -> bool:
+        conn = self._connection()
+        cursor = conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+        conn.commit()
+        return cursor.rowcount > 0
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM files").fetchone()[0]
@@ -0,0 +1,186 @@
+"""
+大きなGeoJSON / JSONを一定メモリで読み書きするためのストリーミングユーティリティ
+- iter_features: FeatureCollectionのフィーチャーを1件ずつ読み込む
+- iter_object_items: トップレベルのオブジェクト（{key: value}）を1件ずつ読み込む
+- FeatureCollectionWriter / JsonObjectWriter: 1件ずつ追記して書き出す
+"""
+import json
+
+
+class _JsonStream:
+    """ファイルを少しずつ読み込みながらJSON値を1つずつデコードする"""
+
+    def __init__(self, f, chunk_size: int = 1024 * 1024):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size: int = None) -> bool:
+        """バッファに追加で読み込む（読み込めなければFalse）"""
+        if self.eof:
+            return False
+        chunk = self.f.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # 読み終わった部分は捨ててメモリを一定に保つ
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """空白を読み飛ばして次の1文字を返す（終端の場合は空文字）"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"JSONの形式が不正です: '{char}' が必要です（位置 {self.pos}）")
+        self.pos += 1
+
+    def decode_value(self):
+        """次のJSON値を1つデコード（途中で切れている場合は追加で読み込む）"""
+        self.peek()
+        read_size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # 数値は途中で切れていても成功してしまうため、バッファ末尾で終わる場合は読み足す
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self._fill(read_size):
+                continue
+            # 大きな値の場合に再デコードの回数を抑える
+            read_size *= 2
+
+    def iter_object(self):
+        """オブジェクトのメンバーを (key, value) で1件ずつ返す（valueは呼び出し側で読む）"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode_value()
+            self.expect(':')
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f"JSONの形式が不正です（位置 {self.pos}）")
+
+    def iter_array(self):
+        """配列の要素を1つずつデコードして返す"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode_value()
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f"JSONの形式が不正です（位置 {self.pos}）")
+
+
+def iter_features(path, chunk_size: int = 1024 * 1024):
+    """FeatureCollectionのフィーチャーを先頭から1件ずつ返す（ファイル全体は読み込まない）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f, chunk_size)
+        for key in stream.iter_object():
+            if key == 'features':
+                yield from stream.iter_array()
+            else:
+                # type, name, crs などの小さなメンバーは読み飛ばす
+                stream.decode_value()
+
+
+def iter_object_items(path, chunk_size: int = 1024 * 1024):
+    """トップレベルのオブジェクト（例: {keycode14: [層行]}）を (key, value) で1件ずつ返す"""
+    with open(path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f, chunk_size)
+        for key in stream.iter_object():
+            yield key, stream.decode_value()
+
+
+class FeatureCollectionWriter:
+    """フィーチャーを1件ずつ追記してFeatureCollectionを書き出す"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._f = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def open(self):
+        self._f = open(self.path, 'w', encoding='utf-8')
+        self._f.write('{"type": "FeatureCollection", "features": [')
+        return self
+
+    def write(self, feature: dict):
+        if self.count:
+            self._f.write(',\n')
+        json.dump(feature, self._f, ensure_ascii=False)
+        self.count += 1
+
+    def close(self):
+        if self._f is not None:
+            self._f.write(']}\n')
+            self._f.close()
+            self._f = None
+
+
+class JsonObjectWriter:
+    """(key, value) を1件ずつ追記してJSONオブジェクトを書き出す"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._f = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def open(self):
+        self._f = open(self.path, 'w', encoding='utf-8')
+        self._f.write('{')
+        return self
+
+    def write(self, key: str, value):
+        if self.count:
+            self._f.write(', ')
+        self._f.write(json.dumps(key, ensure_ascii=False))
+        self._f.write(': ')
+        json.dump(value, self._f, ensure_ascii=False)
+        self.count += 1
+
+    def close(self):
+        if self._f is not None:
+            self._f.write('}')
+            self._f.close()
+            self._f = None
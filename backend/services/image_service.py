@@ -4,11 +4,103 @@ import tempfile
 from PIL import Image
 
 
+# COG変換の設定（ブロックサイズ・圧縮形式）
+COG_BLOCK_SIZE = 512
+COG_COMPRESS = 'DEFLATE'
+
+# 表示用の値域（最小・最大）を求める際の縮小読み込みサイズ
+DISPLAY_RANGE_SAMPLE_SIZE = 1024
+
+
+def to_rgba8(data, vmin: float, vmax: float, mask=None):
+    """
+    バンド配列 (C, H, W) を表示用のRGBA (H, W, 4) uint8 に変換
+    1バンドの場合はグレースケールとして3チャンネルに複製
+    """
+    import numpy as np
+
+    bands = data.shape[0]
+    if bands >= 3:
+        rgb = np.transpose(data[:3], (1, 2, 0))
+    else:
+        rgb = np.stack([data[0]] * 3, axis=-1)
+
+    # 正規化（0-255）
+    if vmax > vmin:
+        rgb = ((rgb.astype(np.float32) - vmin) / (vmax - vmin) * 255).clip(0, 255).astype(np.uint8)
+    else:
+        rgb = np.zeros(rgb.shape, dtype=np.uint8)
+
+    alpha = mask.astype(np.uint8) if mask is not None else np.full(rgb.shape[:2], 255, dtype=np.uint8)
+    return np.dstack([rgb, alpha])
+
+
+def _window_vrt_xml(src, source_path: str, window, mask_path: str = None) -> str:
+    """
+    元画像のウィンドウだけを参照するVRTのXMLを作る
+    mask_path を指定した場合はそのマスクを、しない場合は元画像のnodata・マスク・アルファをそのまま使う
+    """
+    import xml.etree.ElementTree as ET
+    from rasterio.dtypes import dtype_rev, typename_fwd
+    from rasterio.enums import MaskFlags
+
+    width, height = int(window.width), int(window.height)
+    src_rect = {'xOff': str(int(window.col_off)), 'yOff': str(int(window.row_off)),
+                'xSize': str(width), 'ySize': str(height)}
+    dst_rect = {'xOff': '0', 'yOff': '0', 'xSize': str(width), 'ySize': str(height)}
+
+    def simple_source(parent, path, band, dtype, source_width, source_height):
+        source = ET.SubElement(parent, 'SimpleSource')
+        ET.SubElement(source, 'SourceFilename', relativeToVRT='0').text = path
+        ET.SubElement(source, 'SourceBand').text = str(band)
+        ET.SubElement(source, 'SourceProperties', RasterXSize=str(source_width),
+                      RasterYSize=str(source_height), DataType=dtype)
+        return source
+
+    root = ET.Element('VRTDataset', rasterXSize=str(width), rasterYSize=str(height))
+    ET.SubElement(root, 'SRS').text = src.crs.to_wkt()
+    ET.SubElement(root, 'GeoTransform').text = ', '.join(
+        repr(value) for value in src.window_transform(window).to_gdal()
+    )
+
+    for index, dtype in enumerate(src.dtypes, start=1):
+        gdal_type = typename_fwd[dtype_rev[dtype]]
+        band = ET.SubElement(root, 'VRTRasterBand', dataType=gdal_type, band=str(index))
+        ET.SubElement(band, 'ColorInterp').text = src.colorinterp[index - 1].name.capitalize()
+        if src.nodata is not None and mask_path is None:
+            ET.SubElement(band, 'NoDataValue').text = repr(src.nodata)
+        source = simple_source(band, source_path, index, gdal_type, src.width, src.height)
+        ET.SubElement(source, 'SrcRect', **src_rect)
+        ET.SubElement(source, 'DstRect', **dst_rect)
+
+    if mask_path is not None:
+        mask_band = ET.SubElement(ET.SubElement(root, 'MaskBand'), 'VRTRasterBand', dataType='Byte')
+        source = simple_source(mask_band, mask_path, 1, 'Byte', width, height)
+        ET.SubElement(source, 'SrcRect', **dst_rect)
+        ET.SubElement(source, 'DstRect', **dst_rect)
+    elif MaskFlags.per_dataset in src.mask_flag_enums[0] and MaskFlags.alpha not in src.mask_flag_enums[0]:
+        # 元画像の内部マスク（GDAL_TIFF_INTERNAL_MASK など）を引き継ぐ
+        mask_band = ET.SubElement(ET.SubElement(root, 'MaskBand'), 'VRTRasterBand', dataType='Byte')
+        source = simple_source(mask_band, source_path, 'mask,1', 'Byte', src.width, src.height)
+        ET.SubElement(source, 'SrcRect', **src_rect)
+        ET.SubElement(source, 'DstRect', **dst_rect)
+
+    return ET.tostring(root, encoding='unicode')
+
+
 class ImageService:
-    def __init__(self):
-        self.upload_dir = tempfile.gettempdir()
-        self.files = {}
-        self.file_metadata = {}
+    def __init__(self, upload_dir: str = None):
+        from services.file_registry import FileRegistry
+
+        # 複数ワーカーで共有するアップロード先（登録簿もここに置く）
+        self.upload_dir = upload_dir or tempfile.gettempdir()
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self.registry = FileRegistry(os.path.join(self.upload_dir, 'file_registry.sqlite3'))
+        self._display_ranges = {}
+        # crop_to_bbox で作成したメモリ上の画像（VRTのパス -> [マスク, VRT] の MemoryFile）
+        self._crops = {}
+        # プリセット画像のCOG変換結果の保存先
+        self.cog_cache_dir = os.path.join(self.upload_dir, 'cog_cache')
     
     def validate_geotiff(self, file_path: str) -> dict:
         """画像ファイルの検証とメタデータ抽出"""
@@ -82,41 +174,366 @@ class ImageService:
             }
     
     def register_preset_file(self, file_path: str, metadata: dict = None) -> str:
-        """プリセット画像を登録してIDを返す（コピーせずに元のパスを使用）"""
+        """
+        プリセット画像を登録してIDを返す
+        元ファイルは変更せず、COGに変換したコピー（元ファイルの更新時刻ごとに1回だけ作成）を使用
+        """
+        import hashlib
+
         file_id = str(uuid.uuid4())
-        self.files[file_id] = file_path
+        metadata = dict(metadata or {})
+
+        stat = os.stat(file_path)
+        key = hashlib.sha1(
+            f"{os.path.realpath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8')
+        ).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        cog_path = os.path.join(self.cog_cache_dir, f"{stem}_{key}.tif")
+
+        if os.path.exists(cog_path):
+            path, cog_info = cog_path, self.describe_layout(cog_path)
+        else:
+            os.makedirs(self.cog_cache_dir, exist_ok=True)
+            # 複数ワーカーが同時に変換しても壊れないよう一時ファイルから置き換える
+            tmp_cog_path = os.path.join(self.cog_cache_dir, f"{stem}_{key}.{os.getpid()}.tmp.tif")
+            path, cog_info = self._ingest(file_path, tmp_cog_path, keep_source=True)
+            if path == tmp_cog_path:
+                os.replace(tmp_cog_path, cog_path)
+                path = cog_path
+        if cog_info is not None:
+            metadata['cog'] = cog_info
         
-        # メタデータを保存
-        if metadata:
-            self.file_metadata[file_id] = metadata
+        # パスとメタデータを登録
+        self.registry.register(file_id, path, metadata, kind='preset')
         
         return file_id
     
     def save_uploaded_file(self, tmp_path: str, metadata: dict = None) -> str:
-        """アップロードファイルを保存してIDを返す"""
+        """アップロードファイルをCOGに変換して保存し、IDを返す"""
         file_id = str(uuid.uuid4())
         new_path = os.path.join(self.upload_dir, f"{file_id}.tif")
+        metadata = dict(metadata or {})
         
-        # ファイルを移動
-        os.rename(tmp_path, new_path)
-        self.files[file_id] = new_path
+        path, cog_info = self._ingest(tmp_path, new_path, keep_source=False)
+        if path != new_path:
+            # 変換できない場合はファイルを移動するだけ
+            os.rename(tmp_path, new_path)
+        if cog_info is not None:
+            metadata['cog'] = cog_info
         
-        # メタデータを保存
-        if metadata:
-            self.file_metadata[file_id] = metadata
+        # パスとメタデータを登録
+        self.registry.register(file_id, new_path, metadata, kind='upload')
         
         return file_id
+
+    def _ingest(self, src_path: str, dst_path: str, keep_source: bool) -> tuple:
+        """
+        画像をCOGとして dst_path に書き出し、(使用するパス, COG情報) を返す
+        すでにタイル化・圧縮・オーバービュー済みの場合は変換せずに元のファイルを使う
+        変換に失敗した場合は (src_path, None)
+        """
+        try:
+            layout = self.describe_layout(src_path)
+            if layout['cog']:
+                print(f"COG変換は不要です: {src_path}")
+                if keep_source:
+                    return src_path, layout
+                os.rename(src_path, dst_path)
+                return dst_path, layout
+
+            info = self.convert_to_cog(src_path, dst_path)
+            if not keep_source:
+                os.unlink(src_path)
+            return dst_path, info
+        except Exception as e:
+            print(f"COG変換エラー（元のファイルを使用します）: {e}")
+            if os.path.exists(dst_path):
+                os.unlink(dst_path)
+            return src_path, None
+
+    def describe_layout(self, image_path: str) -> dict:
+        """画像のタイル構成・圧縮・オーバービューを取得（cog: 部分読み込みに適した構成か）"""
+        import rasterio
+
+        with rasterio.open(image_path) as src:
+            block_h, block_w = src.block_shapes[0]
+            overviews = src.overviews(1)
+            compress = src.compression.value if src.compression else None
+            # ブロック1つに収まる小さな画像はタイル化・オーバービュー不要
+            small = max(src.width, src.height) <= COG_BLOCK_SIZE
+            tiled = block_w == block_h and block_w < src.width
+
+        return {
+            'cog': compress is not None and (small or (tiled and bool(overviews))),
+            'block_size': [block_w, block_h],
+            'compress': compress,
+            'overviews': overviews
+        }
+
+    def convert_to_cog(self, src_path: str, dst_path: str) -> dict:
+        """
+        画像をタイル化・圧縮・内部オーバービューつきのCloud-Optimized GeoTIFFに変換
+        GDALにCOGドライバーがない場合はタイル化GeoTIFF + build_overviewsで作成
+        """
+        import rasterio
+        from rasterio.enums import Resampling
+        from rasterio.shutil import copy as rio_copy
+
+        print(f"COGに変換します: {src_path}")
+        with rasterio.open(src_path) as src:
+            predictor = 3 if src.dtypes[0].startswith('float') else 2
+            try:
+                rio_copy(
+                    src, dst_path, driver='COG',
+                    BLOCKSIZE=COG_BLOCK_SIZE,
+                    COMPRESS=COG_COMPRESS,
+                    PREDICTOR='YES',
+                    OVERVIEW_RESAMPLING='AVERAGE',
+                    BIGTIFF='IF_SAFER'
+                )
+            except Exception as e:
+                print(f"COGドライバーで変換できません（GTiffで作成します）: {e}")
+                rio_copy(
+                    src, dst_path, driver='GTiff',
+                    tiled=True,
+                    blockxsize=COG_BLOCK_SIZE,
+                    blockysize=COG_BLOCK_SIZE,
+                    compress=COG_COMPRESS,
+                    predictor=predictor,
+                    BIGTIFF='IF_SAFER'
+                )
+                factors = []
+                factor = 2
+                while max(src.width, src.height) / factor >= COG_BLOCK_SIZE / 2:
+                    factors.append(factor)
+                    factor *= 2
+                if factors:
+                    with rasterio.open(dst_path, 'r+') as dst:
+                        dst.build_overviews(factors, Resampling.average)
+                        dst.update_tags(ns='rio_overview', resampling='average')
+
+        info = self.describe_layout(dst_path)
+        print(f"COG変換完了: {dst_path} (overviews={info['overviews']})")
+        return info
     
     def get_file_metadata(self, file_id: str) -> dict:
         """ファイルのメタデータを取得"""
-        return self.file_metadata.get(file_id, {})
+        return self.registry.get_metadata(file_id)
     
     def get_file_path(self, file_id: str) -> str:
         """ファイルIDからパスを取得"""
-        return self.files.get(file_id)
+        return self.registry.get_path(file_id)
     
-    def crop_to_bbox(self, image_path: str, bbox: tuple) -> str:
-        """指定範囲で画像をクロップ（MVP版：元画像をそのまま使用）"""
-        # MVP版では座標変換を省略し、元画像をそのまま返す
-        # 実際の実装ではrasterioを使用して座標ベースのクロップを行う
-        return image_path
+    def crop_to_bbox(self, image_path: str, bbox: tuple, polygon_coords: list = None) -> str:
+        """
+        指定範囲（緯度経度のbbox、任意でポリゴン）で画像をクロップし、メモリ上のVRTのパスを返す
+        VRTは元画像のウィンドウを参照するだけで、画素は検出時にウィンドウごとに読み込まれる
+        ポリゴン外はマスクバンド（DEFLATE圧縮の1バンド画像、行のまとまりごとに作成）でマスクする
+        使い終わったら release_crop で解放すること
+        座標系のない画像はクロップできないため元のパスを返す
+        """
+        import rasterio
+        from rasterio.io import MemoryFile
+        from rasterio.warp import transform_bounds
+        from rasterio.windows import Window, from_bounds
+
+        with rasterio.open(image_path) as src:
+            if src.crs is None:
+                print(f"座標系がないためクロップしません: {image_path}")
+                return image_path
+
+            # bbox (min_lon, min_lat, max_lon, max_lat) を画像の座標系に変換
+            bounds = transform_bounds('EPSG:4326', src.crs, *bbox)
+            window = from_bounds(*bounds, transform=src.transform)
+            window = window.round_offsets().round_lengths()
+            try:
+                window = window.intersection(Window(0, 0, src.width, src.height))
+            except rasterio.errors.WindowError:
+                raise ValueError("指定範囲が画像と重なっていません")
+            if window.width < 1 or window.height < 1:
+                raise ValueError("指定範囲が画像と重なっていません")
+
+            memfiles = []
+            mask_path = None
+            if polygon_coords:
+                mask_file = self._polygon_mask(src, window, polygon_coords)
+                memfiles.append(mask_file)
+                mask_path = mask_file.name
+            vrt_xml = _window_vrt_xml(src, image_path, window, mask_path)
+
+        vrt_file = MemoryFile(vrt_xml.encode('utf-8'), ext='.vrt')
+        memfiles.append(vrt_file)
+        self._crops[vrt_file.name] = memfiles
+        print(f"クロップ: {image_path} -> {int(window.width)}x{int(window.height)} px")
+        return vrt_file.name
+
+    def _polygon_mask(self, src, window, polygon_coords: list, strip_rows: int = 1024):
+        """
+        ウィンドウ内のマスク（元画像のマスク かつ ポリゴン内）をメモリ上の1バンドGeoTIFFに書き込む
+        一度に持つのは strip_rows 行分だけ
+        """
+        import numpy as np
+        import rasterio
+        from rasterio.features import geometry_mask
+        from rasterio.io import MemoryFile
+        from rasterio.warp import transform
+        from rasterio.windows import Window
+
+        if hasattr(polygon_coords[0], 'lon'):
+            lons = [coord.lon for coord in polygon_coords]
+            lats = [coord.lat for coord in polygon_coords]
+        else:
+            lons = [coord['lon'] for coord in polygon_coords]
+            lats = [coord['lat'] for coord in polygon_coords]
+        xs, ys = transform('EPSG:4326', src.crs, lons, lats)
+        ring = list(zip(xs, ys))
+        if ring[0] != ring[-1]:
+            ring.append(ring[0])
+        polygon = {'type': 'Polygon', 'coordinates': [ring]}
+
+        width, height = int(window.width), int(window.height)
+        profile = {
+            'driver': 'GTiff',
+            'dtype': 'uint8',
+            'count': 1,
+            'width': width,
+            'height': height,
+            'crs': src.crs,
+            'transform': src.window_transform(window),
+            'compress': 'DEFLATE'
+        }
+        if width >= 256 and height >= 256:
+            profile.update(tiled=True, blockxsize=256, blockysize=256)
+
+        memfile = MemoryFile()
+        with memfile.open(**profile) as dst:
+            for row in range(0, height, strip_rows):
+                rows = min(strip_rows, height - row)
+                strip = Window(window.col_off, window.row_off + row, width, rows)
+                inside = geometry_mask(
+                    [polygon],
+                    out_shape=(rows, width),
+                    transform=src.window_transform(strip),
+                    invert=True
+                )
+                mask = np.where(inside, src.dataset_mask(window=strip), 0).astype(np.uint8)
+                dst.write(mask, 1, window=Window(0, row, width, rows))
+        return memfile
+
+    def release_crop(self, crop_path: str):
+        """crop_to_bbox で作成したメモリ上の画像を解放（元画像のパスの場合は何もしない）"""
+        for memfile in self._crops.pop(crop_path, ()):
+            memfile.close()
+
+    def get_display_range(self, image_path: str) -> tuple:
+        """
+        画像全体の表示用値域（最小, 最大）を取得
+        タイルごとに正規化すると境目で色が変わるため、縮小読み込みで1回だけ求めてキャッシュする
+        """
+        import rasterio
+
+        key = (image_path, os.path.getmtime(image_path))
+        if key in self._display_ranges:
+            return self._display_ranges[key]
+
+        with rasterio.open(image_path) as src:
+            bands = min(3, src.count)
+            scale = max(src.width, src.height) / DISPLAY_RANGE_SAMPLE_SIZE
+            out_shape = (bands, max(1, int(src.height / max(scale, 1))), max(1, int(src.width / max(scale, 1))))
+            # out_shapeを指定するとオーバービューがあればそこから読み込まれる
+            data = src.read(list(range(1, bands + 1)), out_shape=out_shape)
+            value_range = (float(data.min()), float(data.max()))
+
+        self._display_ranges[key] = value_range
+        return value_range
+
+    def render_preview(self, image_path: str, max_size: int = 2048) -> bytes:
+        """
+        画像全体のプレビューPNGを作成（長辺をmax_size以下に縮小）
+        out_shapeを指定した間引き読み込みのため、元画像全体は読み込まない
+        """
+        import io
+
+        try:
+            import rasterio
+            from rasterio.enums import Resampling
+
+            with rasterio.open(image_path) as src:
+                bands = min(3, src.count)
+                scale = max(1.0, max(src.width, src.height) / max_size)
+                out_height = max(1, int(round(src.height / scale)))
+                out_width = max(1, int(round(src.width / scale)))
+                data = src.read(
+                    list(range(1, bands + 1)),
+                    out_shape=(bands, out_height, out_width),
+                    resampling=Resampling.average
+                )
+                mask = src.dataset_mask(out_shape=(out_height, out_width))
+
+            vmin, vmax = self.get_display_range(image_path)
+            img = Image.fromarray(to_rgba8(data, vmin, vmax, mask), 'RGBA')
+        except Exception as e:
+            # rasterioで読めない場合はPILで直接読み込み
+            print(f"PILで画像を読み込みます: {e}")
+            img = Image.open(image_path)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.thumbnail((max_size, max_size))
+
+        img_io = io.BytesIO()
+        img.save(img_io, 'PNG')
+        return img_io.getvalue()
+
+    def render_tile(self, image_path: str, z: int, x: int, y: int, tile_size: int = 256):
+        """
+        画像のXYZタイル（Webメルカトル）をPNGで返す
+        タイル範囲だけをワープして読み込むため、コストは画像全体ではなくタイル数に比例する
+        画像と重ならないタイルはNone
+        """
+        import io
+        import rasterio
+        from rasterio.enums import Resampling
+        from rasterio.transform import from_bounds
+        from rasterio.vrt import WarpedVRT
+        from rasterio.warp import transform_bounds
+        from services.tile_service import tile_bounds_mercator
+
+        tile_bounds = tile_bounds_mercator(z, x, y)
+        tile_res = (tile_bounds[2] - tile_bounds[0]) / tile_size
+
+        with rasterio.open(image_path) as src:
+            if src.crs is None:
+                raise ValueError("座標系のない画像はタイル表示できません")
+
+            src_bounds = transform_bounds(src.crs, 'EPSG:3857', *src.bounds)
+            if (src_bounds[0] >= tile_bounds[2] or src_bounds[2] <= tile_bounds[0] or
+                    src_bounds[1] >= tile_bounds[3] or src_bounds[3] <= tile_bounds[1]):
+                return None
+
+            # タイル解像度より細かくならない範囲で最も粗いオーバービューを選ぶ
+            native_res = (src_bounds[2] - src_bounds[0]) / src.width
+            overview_level = None
+            for level, factor in enumerate(src.overviews(1)):
+                if native_res * factor <= tile_res:
+                    overview_level = level
+            bands = min(3, src.count)
+
+        vmin, vmax = self.get_display_range(image_path)
+
+        open_kwargs = {'overview_level': overview_level} if overview_level is not None else {}
+        with rasterio.open(image_path, **open_kwargs) as src:
+            with WarpedVRT(
+                src,
+                crs='EPSG:3857',
+                transform=from_bounds(*tile_bounds, tile_size, tile_size),
+                width=tile_size,
+                height=tile_size,
+                resampling=Resampling.bilinear
+            ) as vrt:
+                data = vrt.read(list(range(1, bands + 1)))
+                mask = vrt.dataset_mask()
+
+        img = Image.fromarray(to_rgba8(data, vmin, vmax, mask), 'RGBA')
+        img_io = io.BytesIO()
+        img.save(img_io, 'PNG')
+        return img_io.getvalue()
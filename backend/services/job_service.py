@@ -0,0 +1,193 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+
+# このプロセスの起動ごとのID（ジョブを登録したAPIプロセスの識別に使う。PIDは再起動後に再利用されるため使わない）
+BOOT_TOKEN = uuid.uuid4().hex
+
+
+class JobCancelledError(Exception):
+    """ジョブがキャンセルされた（ワーカーは次の区切りで処理を中止する）"""
+
+
+class JobStore:
+    """
+    解析ジョブの状態・進捗・結果を保存するストア（SQLite、WALモード）
+    APIプロセスと解析ワーカープロセスの両方から同じDBファイルを読み書きする
+    終了したジョブは ttl 秒後に削除される
+    結果の樹木位置は ResultStore に保存し、ここにはサマリーと result_id だけを入れる
+    """
+
+    # 終了状態
+    FINISHED = ('succeeded', 'failed', 'cancelled')
+
+    def __init__(self, db_path, ttl: int = 3600):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                stage TEXT,
+                progress REAL NOT NULL DEFAULT 0,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                owner_token TEXT
+            ) WITHOUT ROWID
+        """)
+        # 以前のDBにはジョブを登録したAPIプロセスの列がない
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+        if 'owner_token' not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner_token TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON jobs (updated_at)")
+        conn.commit()
+
+    def _connection(self):
+        """スレッドごとのコネクション"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _update(self, job_id: str, **fields):
+        fields['updated_at'] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        conn = self._connection()
+        conn.execute(f"UPDATE jobs SET {columns} WHERE job_id = ?", (*fields.values(), job_id))
+        conn.commit()
+
+    def create(self) -> str:
+        """ジョブを登録してIDを返す（期限切れのジョブもここで削除）"""
+        self.cleanup_expired()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO jobs (job_id, status, stage, created_at, updated_at, owner_token) "
+            "VALUES (?, 'queued', NULL, ?, ?, ?)",
+            (job_id, now, now, BOOT_TOKEN)
+        )
+        conn.commit()
+        return job_id
+
+    def get(self, job_id: str, include_result: bool = True) -> dict:
+        """ジョブの状態を取得（存在しない・期限切れはNone）"""
+        row = self._connection().execute(
+            "SELECT job_id, status, stage, progress, cancel_requested, result, error, created_at, updated_at "
+            "FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        job = {
+            'job_id': row[0],
+            'status': row[1],
+            'stage': row[2],
+            'progress': round(row[3], 3),
+            'cancel_requested': bool(row[4]),
+            'error': row[6],
+            'created_at': row[7],
+            'updated_at': row[8]
+        }
+        if job['status'] in self.FINISHED:
+            if time.time() - job['updated_at'] > self.ttl:
+                return None
+            job['expires_at'] = job['updated_at'] + self.ttl
+        if include_result and row[5] is not None:
+            job['result'] = json.loads(row[5])
+        return job
+
+    def set_progress(self, job_id: str, stage: str, progress: float):
+        self._update(job_id, status='running', stage=stage, progress=progress)
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        row = self._connection().execute(
+            "SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return row is None or bool(row[0])
+
+    def request_cancel(self, job_id: str):
+        """キャンセルを要求（実行中のジョブはワーカーが次の区切りで中止する）"""
+        self._update(job_id, cancel_requested=1)
+
+    def finish(self, job_id: str, result: dict):
+        self._update(job_id, status='succeeded', progress=1.0,
+                     result=json.dumps(result, ensure_ascii=False))
+
+    def fail(self, job_id: str, error: str):
+        self._update(job_id, status='failed', error=error)
+
+    def mark_cancelled(self, job_id: str):
+        self._update(job_id, status='cancelled')
+
+    def delete(self, job_id: str):
+        conn = self._connection()
+        conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        conn.commit()
+
+    def fail_orphaned(self) -> int:
+        """
+        以前に起動したAPIプロセスが登録した待機中・実行中のジョブを失敗にする（起動時に呼ぶ）
+        再起動でプロセスプールごと失われたジョブが queued / running のまま残らないようにする
+        （ジョブDBを使うAPIプロセスは1つである前提。起動ごとの BOOT_TOKEN で判定する）
+        戻り値: 失敗にしたジョブ数
+        """
+        conn = self._connection()
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+            "WHERE status IN ('queued', 'running') AND (owner_token IS NULL OR owner_token != ?)",
+            ("サーバーの再起動により解析が中断されました", time.time(), BOOT_TOKEN)
+        )
+        conn.commit()
+        if cursor.rowcount:
+            print(f"中断されたジョブを失敗にしました: {cursor.rowcount}件")
+        return cursor.rowcount
+
+    def cleanup_expired(self):
+        """終了後 ttl 秒を過ぎたジョブを削除"""
+        conn = self._connection()
+        placeholders = ",".join("?" * len(self.FINISHED))
+        conn.execute(
+            f"DELETE FROM jobs WHERE status IN ({placeholders}) AND updated_at < ?",
+            (*self.FINISHED, time.time() - self.ttl)
+        )
+        conn.commit()
+
+
+class JobProgress:
+    """
+    ワーカー側で段階（crop / detect / volume）ごとの進捗を書き込む
+    書き込みのたびにキャンセル要求を確認し、要求があれば JobCancelledError を送出する
+    """
+
+    def __init__(self, store: JobStore, job_id: str, min_interval: float = 0.5):
+        self.store = store
+        self.job_id = job_id
+        self.min_interval = min_interval
+        self._stage = None
+        self._last_write = 0.0
+
+    def __call__(self, stage: str, progress: float):
+        if self.store.is_cancel_requested(self.job_id):
+            raise JobCancelledError(f"ジョブがキャンセルされました: {self.job_id}")
+
+        # 段階が変わったとき以外は一定間隔でのみ書き込む
+        now = time.time()
+        if stage != self._stage or now - self._last_write >= self.min_interval:
+            self.store.set_progress(self.job_id, stage, progress)
+            self._stage = stage
+            self._last_write = now
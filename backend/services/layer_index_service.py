@@ -0,0 +1,100 @@
+from pathlib import Path
+
+
+class LayerIndex:
+    """1レイヤー分のジオメトリとSTRtree空間インデックス"""
+
+    def __init__(self, name: str, path: Path, geometries: list, properties: list):
+        from shapely.strtree import STRtree
+
+        self.name = name
+        self.path = path
+        self.geometries = geometries
+        self.properties = properties
+        self.tree = STRtree(geometries)
+
+    def query(self, bbox: tuple, limit: int = 1000, clip: bool = False) -> dict:
+        """bbox (min_lon, min_lat, max_lon, max_lat) と交差するフィーチャーを取得"""
+        import shapely
+        from shapely.geometry import box, mapping
+
+        indices = self.tree.query(box(*bbox), predicate='intersects')
+        indices.sort()
+        total = len(indices)
+
+        features = []
+        for i in indices[:limit]:
+            geom = self.geometries[i]
+            if clip:
+                geom = shapely.clip_by_rect(geom, *bbox)
+                if geom.is_empty:
+                    continue
+            features.append({
+                'type': 'Feature',
+                'properties': self.properties[i],
+                'geometry': mapping(geom)
+            })
+
+        return {
+            'type': 'FeatureCollection',
+            'features': features,
+            'total': int(total),
+            'truncated': total > limit
+        }
+
+
+class LayerIndexService:
+    """参照レイヤー（行政区域・河川・小班など）をメモリ上の空間インデックスで検索するサービス"""
+
+    def __init__(self, sources: dict):
+        # sources: {レイヤー名: [候補パス（優先順）]}
+        self.sources = sources
+        self.layers = {}
+
+    def load(self, names: list = None):
+        """GeoJSONを読み込んでSTRtreeを構築（起動時に1回だけ実行）"""
+        for name in names or self.sources.keys():
+            if name not in self.sources:
+                print(f"未登録のレイヤーです: {name}")
+                continue
+
+            path = next((Path(p) for p in self.sources[name] if Path(p).exists()), None)
+            if path is None:
+                print(f"レイヤーデータが見つかりません: {name}")
+                continue
+
+            try:
+                self.layers[name] = self._load_layer(name, path)
+                print(f"空間インデックス構築: {name} ({len(self.layers[name].geometries)} features)")
+            except Exception as e:
+                print(f"空間インデックス構築エラー ({name}): {e}")
+
+    def _load_layer(self, name: str, path: Path) -> LayerIndex:
+        from shapely.geometry import shape
+
+        from services.geojson_stream import iter_features
+
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.read(64).startswith('version https://git-lfs'):
+                raise ValueError(f"Git LFSのポインタファイルです: {path}")
+
+        geometries = []
+        properties = []
+        for feature in iter_features(path):
+            if not feature.get('geometry'):
+                continue
+            geometries.append(shape(feature['geometry']))
+            properties.append(feature.get('properties') or {})
+
+        return LayerIndex(name, path, geometries, properties)
+
+    def get_layer(self, name: str):
+        """読み込み済みのレイヤーを取得（未登録・未読み込みはNone）"""
+        return self.layers.get(name)
+
+    def available_layers(self) -> list:
+        """検索可能なレイヤー一覧"""
+        return [
+            {'name': name, 'feature_count': len(layer.geometries)}
+            for name, layer in self.layers.items()
+        ]
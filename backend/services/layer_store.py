@@ -0,0 +1,250 @@
+import itertools
+import json
+import sqlite3
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+
+def _deep_sizeof(value) -> int:
+    """
+    JSONから読み込んだ値（dict・list・スカラー）のメモリ使用量
+    json.load は同じキー文字列を共有するため、dictのキーは数えない
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_sizeof(v) for v in value.values())
+    elif isinstance(value, list):
+        size += sum(_deep_sizeof(v) for v in value)
+    return size
+
+
+def estimate_size(layers_index: dict, sample_size: int = 256) -> int:
+    """
+    パース後の層索引（KEYCODE -> 層行）のメモリ使用量の見積もり
+    全件をたどると遅いため、等間隔に選んだ sample_size 件の平均に件数を掛ける
+    （共有される小さな整数なども数えるため、やや多めになる）
+    """
+    count = len(layers_index)
+    if count == 0:
+        return sys.getsizeof(layers_index)
+    step = max(1, count // sample_size)
+    sampled = list(itertools.islice(layers_index.items(), 0, None, step))
+    per_key = sum(_deep_sizeof(k) + _deep_sizeof(v) for k, v in sampled) / len(sampled)
+    return sys.getsizeof(layers_index) + int(per_key * count)
+
+
+class LayerStore:
+    """
+    森林簿の層データ（KEYCODE -> 層行配列）を取得するサービス
+    SQLiteストア（build_layers_db.pyで生成）があればKEYCODEで1件ずつ読み込む
+    ない場合は市町村単位の分割ファイルを読み込み、合計サイズ上限つきのLRUで保持する
+    （サイズはファイルサイズではなく、パース後のメモリ使用量の見積もり）
+    """
+
+    def __init__(self, split_dir, fallback_path=None, max_bytes: int = 256 * 1024 * 1024,
+                 db_path=None):
+        self.split_dir = Path(split_dir)
+        self.fallback_path = Path(fallback_path) if fallback_path else None
+        self.max_bytes = max_bytes
+        self.db_path = Path(db_path) if db_path else None
+        self._local = threading.local()
+        self.db_lookups = 0
+        self._cache = OrderedDict()  # "split:{muni}" / "fallback:{muni}" -> (layers_index, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def muni_code(keycode14: str) -> str:
+        """KEYCODEの先頭5桁（都道府県+市町村コード）"""
+        return keycode14[:5] if len(keycode14) >= 5 else keycode14
+
+    def get(self, keycode14: str):
+        """KEYCODEの層データを取得（見つからない場合はNone）"""
+        if self._use_db():
+            return self._get_from_db(keycode14)
+
+        muni_code = self.muni_code(keycode14)
+
+        layers_index = self._get_municipality(muni_code)
+        if layers_index is not None and keycode14 in layers_index:
+            return layers_index[keycode14]
+
+        # 分割ファイルにない場合は元の層索引から探す
+        layers_index = self._get_municipality_from_fallback(muni_code)
+        if layers_index is not None and keycode14 in layers_index:
+            return layers_index[keycode14]
+
+        return None
+
+    def get_many(self, keycodes: list) -> dict:
+        """
+        複数KEYCODEの層データをまとめて取得
+        市町村ごとにまとめて解決するため、各ファイル（DBの場合はクエリ）は1回だけ読む
+        戻り値: {keycode14: layers}（見つからないKEYCODEは含まない）
+        """
+        keycodes = list(dict.fromkeys(keycodes))
+        if self._use_db():
+            return self._get_many_from_db(keycodes)
+
+        by_municipality = {}
+        for keycode14 in keycodes:
+            by_municipality.setdefault(self.muni_code(keycode14), []).append(keycode14)
+
+        results = {}
+        for muni_code, muni_keycodes in by_municipality.items():
+            layers_index = self._get_municipality(muni_code) or {}
+            pending = [k for k in muni_keycodes if k not in layers_index]
+            results.update({k: layers_index[k] for k in muni_keycodes if k in layers_index})
+
+            if pending:
+                fallback_index = self._get_municipality_from_fallback(muni_code) or {}
+                results.update({k: fallback_index[k] for k in pending if k in fallback_index})
+
+        return results
+
+    def warm_up(self, muni_codes: list = None):
+        """指定した市町村（Noneの場合は全分割ファイル）を事前に読み込む"""
+        if self._use_db():
+            print("層データDBを使用するためプリロードは不要です")
+            return
+
+        if muni_codes is None:
+            muni_codes = [p.stem[len("layers_"):] for p in sorted(self.split_dir.glob("layers_*.json"))]
+
+        for muni_code in muni_codes:
+            if self._get_municipality(muni_code) is not None:
+                print(f"層データをプリロード: {muni_code}")
+
+    def stats(self) -> dict:
+        """キャッシュのヒット率・使用量"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'backend': 'sqlite' if self._use_db() else 'json',
+                'db_lookups': self.db_lookups,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'municipalities': list(self._cache.keys()),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def _use_db(self) -> bool:
+        return self.db_path is not None and self.db_path.exists()
+
+    def _db_connection(self):
+        """スレッドごとの読み取り専用コネクション"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def _get_from_db(self, keycode14: str):
+        row = self._db_connection().execute(
+            "SELECT data FROM layers WHERE keycode14 = ?", (keycode14,)
+        ).fetchone()
+        self.db_lookups += 1
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def _get_many_from_db(self, keycodes: list) -> dict:
+        conn = self._db_connection()
+        results = {}
+        # SQLiteのパラメータ数上限に収まるよう分けて問い合わせる
+        for start in range(0, len(keycodes), 500):
+            chunk = keycodes[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT keycode14, data FROM layers WHERE keycode14 IN ({placeholders})", chunk
+            ).fetchall()
+            self.db_lookups += 1
+            for keycode14, data in rows:
+                results[keycode14] = json.loads(zlib.decompress(data).decode('utf-8'))
+        return results
+
+    def _get_municipality(self, muni_code: str):
+        cache_key = f"split:{muni_code}"
+        cached = self._lookup(cache_key)
+        if cached is not None:
+            return cached
+
+        part_file = self.split_dir / f"layers_{muni_code}.json"
+        if not part_file.exists():
+            return None
+
+        print(f"分割ファイルから層データを読み込み: {part_file}")
+        self.misses += 1
+        try:
+            with open(part_file, 'r', encoding='utf-8') as f:
+                layers_index = json.load(f)
+        except Exception as e:
+            print(f"分割ファイル読み込みエラー: {e}")
+            return None
+
+        self._insert(cache_key, layers_index, estimate_size(layers_index))
+        return layers_index
+
+    def _get_municipality_from_fallback(self, muni_code: str):
+        cache_key = f"fallback:{muni_code}"
+        cached = self._lookup(cache_key)
+        if cached is not None:
+            return cached
+
+        if not self.fallback_path or not self.fallback_path.exists():
+            return None
+
+        print(f"元のファイルから層データを読み込み: {self.fallback_path}")
+        self.misses += 1
+        try:
+            with open(self.fallback_path, 'r', encoding='utf-8') as f:
+                full_index = json.load(f)
+        except Exception as e:
+            print(f"元のファイル読み込みエラー: {e}")
+            return None
+
+        # 市町村ごとに分けてキャッシュ
+        by_municipality = {}
+        for key, value in full_index.items():
+            by_municipality.setdefault(self.muni_code(key), {})[key] = value
+        del full_index
+
+        for code, entries in by_municipality.items():
+            if code != muni_code:
+                self._insert(f"fallback:{code}", entries, estimate_size(entries))
+        # 要求された市町村は最後に入れて最新扱いにする
+        requested = by_municipality.get(muni_code, {})
+        self._insert(cache_key, requested, estimate_size(requested))
+        return requested
+
+    def _lookup(self, cache_key: str):
+        with self._lock:
+            entry = self._cache.get(cache_key)
+            if entry is None:
+                return None
+            self._cache.move_to_end(cache_key)
+            self.hits += 1
+            return entry[0]
+
+    def _insert(self, cache_key: str, layers_index: dict, size: int):
+        with self._lock:
+            if size > self.max_bytes:
+                # 上限を超えるものはキャッシュしない
+                return
+            if cache_key in self._cache:
+                self._bytes -= self._cache.pop(cache_key)[1]
+            self._cache[cache_key] = (layers_index, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._cache:
+                _, (_, evicted_size) = self._cache.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
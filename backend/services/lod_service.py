@@ -0,0 +1,106 @@
+import math
+from pathlib import Path
+
+
+# ズーム帯ごとの簡略化レベル
+# tolerance: 簡略化の許容誤差（度、各帯の最大ズームで約1ピクセル）
+# precision: 座標の量子化グリッド（度）
+LOD_LEVELS = [
+    {'level': 0, 'max_zoom': 7, 'tolerance': 0.01, 'precision': 0.001},
+    {'level': 1, 'max_zoom': 9, 'tolerance': 0.0025, 'precision': 0.0001},
+    {'level': 2, 'max_zoom': 11, 'tolerance': 0.0006, 'precision': 0.00005},
+    {'level': 3, 'max_zoom': 13, 'tolerance': 0.00015, 'precision': 0.00001},
+]
+# これより大きいズームでは簡略化しない元データを返す
+FULL_DETAIL_ZOOM = LOD_LEVELS[-1]['max_zoom'] + 1
+
+
+def level_for_zoom(zoom: int):
+    """ズームに対応するLODレベル（元データを使う場合はNone）"""
+    for lod in LOD_LEVELS:
+        if zoom <= lod['max_zoom']:
+            return lod['level']
+    return None
+
+
+def lod_path(output_dir, base_name: str, level: int) -> Path:
+    """LODファイルのパス（{base_name}_lod{level}.geojson）"""
+    return Path(output_dir) / f"{base_name}_lod{level}.geojson"
+
+
+def finest_lod_path(output_dir, base_name: str, suffix: str = '.geojson') -> Path:
+    """生成済みのLODファイルのうち最も詳細なもの（なければNone）"""
+    for lod in reversed(LOD_LEVELS):
+        path = lod_path(output_dir, base_name, lod['level']).with_suffix(suffix)
+        if path.exists():
+            return path
+    return None
+
+
+def select_lod_path(zoom, output_dir, base_name: str, default_path, full_path=None) -> Path:
+    """
+    ズームに応じて配信するファイルを選ぶ
+    - zoom未指定: default_path（従来どおり）
+    - FULL_DETAIL_ZOOM以上: full_path（なければdefault_path）
+    - それ以外: 該当LODファイル（未生成ならdefault_path）
+    """
+    if zoom is None:
+        return Path(default_path)
+
+    level = level_for_zoom(zoom)
+    if level is None:
+        if full_path is not None and Path(full_path).exists():
+            return Path(full_path)
+        return Path(default_path)
+
+    path = lod_path(output_dir, base_name, level)
+    return path if path.exists() else Path(default_path)
+
+
+def simplify_geometries(geometries, tolerance: float, precision: float):
+    """
+    ジオメトリ配列をトポロジーを保って簡略化し、座標を量子化する
+    ポリゴンのみのレイヤーは隣接境界を共有したまま簡略化する（coverage_simplify）
+    """
+    import numpy as np
+    import shapely
+
+    geometries = np.asarray(geometries, dtype=object)
+    geom_types = set(shapely.get_type_id(geometries[~shapely.is_missing(geometries)]).tolist())
+    # 3: Polygon, 6: MultiPolygon
+    is_polygon_coverage = bool(geom_types) and geom_types <= {3, 6}
+
+    simplified = None
+    if is_polygon_coverage and hasattr(shapely, 'coverage_simplify'):
+        try:
+            simplified = shapely.coverage_simplify(geometries, tolerance)
+        except Exception as e:
+            # 重なりのあるポリゴンなどカバレッジにならない場合
+            print(f"  カバレッジ簡略化に失敗したため個別に簡略化します: {e}")
+    if simplified is None:
+        simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+    return shapely.set_precision(simplified, precision)
+
+
+def write_lod_pyramid(gdf, output_dir, base_name: str) -> list:
+    """
+    GeoDataFrame（EPSG:4326）からズーム帯ごとのLODファイルを書き出す
+    戻り値: 書き出したファイルのパス
+    """
+    import os
+
+    paths = []
+    for lod in LOD_LEVELS:
+        path = lod_path(output_dir, base_name, lod['level'])
+        gdf_lod = gdf.copy()
+        gdf_lod['geometry'] = simplify_geometries(gdf.geometry.values, lod['tolerance'], lod['precision'])
+        gdf_lod = gdf_lod[~gdf_lod.geometry.is_empty]
+
+        digits = max(0, math.ceil(-math.log10(lod['precision'])))
+        gdf_lod.to_file(path, driver='GeoJSON', COORDINATE_PRECISION=digits)
+
+        print(f"  LOD{lod['level']}（〜z{lod['max_zoom']}）保存完了: {path} "
+              f"({len(gdf_lod)} features, {os.path.getsize(path) / 1024 / 1024:.2f} MB)")
+        paths.append(path)
+    return paths
@@ -0,0 +1,142 @@
+"""
+多数の点をまとめてポリゴン内判定するユーティリティ
+- Shapely 2 があれば prepared geometry の contains_xy で判定
+- ない場合はNumPyの偶奇規則（even-odd）カーネルで判定
+穴あきポリゴン・マルチポリゴンに対応
+"""
+import numbers
+
+import numpy as np
+
+
+def _coord_xy(coord) -> tuple:
+    """{lat, lon} / PolygonCoord / (lon, lat) を (lon, lat) に変換"""
+    if hasattr(coord, 'lon'):
+        return coord.lon, coord.lat
+    if isinstance(coord, dict):
+        return coord['lon'], coord['lat']
+    return coord[0], coord[1]
+
+
+def _is_ring(value) -> bool:
+    """座標点の配列（リング）かどうか"""
+    first = value[0]
+    return hasattr(first, 'lon') or isinstance(first, dict) or isinstance(first[0], numbers.Real)
+
+
+def polygon_rings(polygon) -> list:
+    """
+    ポリゴン指定をポリゴンごとのリング配列 [[外周, 穴, ...], ...] に変換
+    受け付ける形式:
+      - 座標点の配列（フロントエンドの polygon_coords、外周のみ）
+      - リングの配列（先頭が外周、以降が穴）
+      - GeoJSONの Polygon / MultiPolygon
+    """
+    if isinstance(polygon, dict) and 'type' in polygon:
+        if polygon['type'] == 'Polygon':
+            parts = [polygon['coordinates']]
+        elif polygon['type'] == 'MultiPolygon':
+            parts = polygon['coordinates']
+        else:
+            raise ValueError(f"未対応のジオメトリです: {polygon['type']}")
+    elif _is_ring(polygon):
+        parts = [[polygon]]
+    else:
+        parts = [polygon]
+
+    return [[[_coord_xy(c) for c in ring] for ring in part if len(ring) >= 3] for part in parts]
+
+
+def to_geometry(polygon):
+    """ポリゴン指定をShapelyのジオメトリに変換（prepare済み）"""
+    import shapely
+    from shapely.geometry import MultiPolygon, Polygon
+
+    if isinstance(polygon, shapely.Geometry):
+        geom = polygon
+    else:
+        polygons = [Polygon(rings[0], rings[1:]) for rings in polygon_rings(polygon) if rings]
+        geom = polygons[0] if len(polygons) == 1 else MultiPolygon(polygons)
+    shapely.prepare(geom)
+    return geom
+
+
+def prepare_polygon(polygon):
+    """
+    同じポリゴンで何度も判定する場合に1回だけ変換しておく
+    Shapelyがあればprepare済みジオメトリ、なければそのまま返す（points_in_polygon に渡す）
+    """
+    return to_geometry(polygon) if _has_shapely() else polygon
+
+
+def even_odd_contains(xs, ys, rings: list):
+    """
+    偶奇規則による点のポリゴン内判定（NumPy、全点を辺ごとにまとめて判定）
+    rings: すべてのリング（外周・穴・マルチポリゴンの各部分）。穴は偶奇規則で自然に除外される
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    inside = np.zeros(xs.shape, dtype=bool)
+
+    for ring in rings:
+        ring = np.asarray(ring, dtype=np.float64)
+        x1, y1 = ring[:, 0], ring[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+        for ax, ay, bx, by in zip(x1, y1, x2, y2):
+            if ay == by:
+                continue
+            # 点から右向きの半直線が辺と交差するか
+            crosses = (ay > ys) != (by > ys)
+            x_cross = ax + (ys - ay) * (bx - ax) / (by - ay)
+            inside ^= crosses & (xs < x_cross)
+
+    return inside
+
+
+def points_in_polygon(xs, ys, polygon):
+    """点群 (xs, ys) のうちポリゴン内にあるもののブール配列を返す"""
+    try:
+        import shapely
+        return shapely.contains_xy(to_geometry(polygon), np.asarray(xs), np.asarray(ys))
+    except ImportError:
+        rings = [ring for part in polygon_rings(polygon) for ring in part]
+        return even_odd_contains(xs, ys, rings)
+
+
+def random_points_in_polygon(n: int, bbox: tuple, polygon=None, max_rounds: int = 100, rng=None):
+    """
+    bbox内のランダムな点をn個生成（polygon指定時はポリゴン内の点のみ）
+    候補をまとめて生成して一括判定し、足りない分だけ再生成する
+    max_rounds回で埋まらない場合は最後の候補（ポリゴン外）をそのまま使う
+    """
+    rng = rng or np.random.default_rng()
+    min_lon, min_lat, max_lon, max_lat = bbox
+    lons = np.empty(n)
+    lats = np.empty(n)
+    if n == 0:
+        return lons, lats
+    if polygon is None:
+        return rng.uniform(min_lon, max_lon, n), rng.uniform(min_lat, max_lat, n)
+
+    geom = prepare_polygon(polygon)
+    filled = 0
+    for _ in range(max_rounds):
+        need = n - filled
+        # 判定の呼び出し回数を減らすため必要数より多めに生成
+        cand_lon = rng.uniform(min_lon, max_lon, need * 2 + 16)
+        cand_lat = rng.uniform(min_lat, max_lat, need * 2 + 16)
+        ok = np.flatnonzero(points_in_polygon(cand_lon, cand_lat, geom))[:need]
+        lons[filled:filled + len(ok)] = cand_lon[ok]
+        lats[filled:filled + len(ok)] = cand_lat[ok]
+        filled += len(ok)
+        if filled == n:
+            return lons, lats
+
+    lons[filled:] = cand_lon[:n - filled]
+    lats[filled:] = cand_lat[:n - filled]
+    return lons, lats
+
+
+def _has_shapely() -> bool:
+    import importlib.util
+    return importlib.util.find_spec('shapely') is not None
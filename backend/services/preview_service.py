@@ -0,0 +1,94 @@
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class PreviewService:
+    """
+    画像プレビュー（縮小PNG）のディスクキャッシュ
+    キーは元画像の内容（パス・サイズ・更新時刻）とmax_sizeから作り、合計サイズ上限を超えたら古いものから削除する
+    """
+
+    # 生成方法を変えたときに古いキャッシュを使わないためのバージョン
+    CACHE_VERSION = "1"
+
+    def __init__(self, cache_dir, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def cache_key(self, image_path: str, max_size: int) -> str:
+        stat = os.stat(image_path)
+        source = f"{os.path.realpath(image_path)}|{stat.st_size}|{stat.st_mtime_ns}|{max_size}|{self.CACHE_VERSION}"
+        return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    def get_or_create(self, image_path: str, max_size: int, render) -> Path:
+        """
+        キャッシュ済みプレビューのパスを返す（なければ render(image_path, max_size) でPNGを作成）
+        """
+        path = self.cache_dir / f"{self.cache_key(image_path, max_size)}.png"
+
+        if path.exists():
+            self.hits += 1
+            # LRU判定用にアクセス時刻だけ更新（更新時刻はETagに使うため変えない）
+            try:
+                os.utime(path, ns=(time.time_ns(), path.stat().st_mtime_ns))
+            except OSError:
+                pass
+            return path
+
+        self.misses += 1
+        png = render(image_path, max_size)
+
+        # 同時に同じプレビューを作っても壊れないよう一時ファイルから置き換える
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(png)
+        os.replace(tmp_path, path)
+
+        self._evict(keep=path)
+        return path
+
+    def stats(self) -> dict:
+        files = list(self.cache_dir.glob("*.png"))
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(files),
+            'bytes': sum(f.stat().st_size for f in files),
+            'max_bytes': self.max_bytes
+        }
+
+    def _evict(self, keep: Path = None):
+        """合計サイズが上限を超えたら最終利用が古いものから削除（作成直後のkeepは残す）"""
+        with self._lock:
+            entries = []
+            total = 0
+            for f in self.cache_dir.glob("*.png"):
+                try:
+                    stat = f.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, f))
+                total += stat.st_size
+
+            if total <= self.max_bytes:
+                return
+
+            entries.sort()
+            for _, size, f in entries:
+                if total <= self.max_bytes:
+                    break
+                if f == keep:
+                    continue
+                try:
+                    f.unlink()
+                    total -= size
+                    print(f"プレビューキャッシュを削除: {f.name}")
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,103 @@
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+
+# 事前圧縮ファイルの拡張子（優先順）
+PRECOMPRESSED_ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    """Accept-Encodingヘッダーから受け入れ可能なエンコーディングを取得（q=0は除外）"""
+    encodings = set()
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if not name:
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def file_etag(path: Path, encoding: str = None) -> str:
+    """ファイルサイズと更新時刻からETagを生成（圧縮形式ごとに区別）"""
+    stat = os.stat(path)
+    tag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    if encoding:
+        tag += f"-{encoding}"
+    return f'"{tag}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # 弱い比較（W/プレフィックスは無視）
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _not_modified_since(if_modified_since: str, mtime: float) -> bool:
+    if not if_modified_since:
+        return False
+    try:
+        return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def static_file_response(request, path, media_type: str = "application/json",
+                         max_age: int = 86400):
+    """
+    静的ファイルをETag/Last-Modifiedつきで返す
+    - If-None-Match / If-Modified-Since が一致すれば304
+    - ビルド時に作成した .br / .gz があればAccept-Encodingに応じて配信
+    """
+    from fastapi.responses import FileResponse, Response
+
+    path = Path(path)
+    accepted = _accepted_encodings(request.headers.get('accept-encoding', ''))
+
+    served_path = path
+    content_encoding = None
+    for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+        candidate = path.with_name(path.name + suffix)
+        # 元ファイルより古い圧縮ファイルは使わない
+        if encoding in accepted and candidate.exists() \
+                and candidate.stat().st_mtime >= path.stat().st_mtime:
+            served_path = candidate
+            content_encoding = encoding
+            break
+
+    # ETagは元ファイル基準で、圧縮形式ごとに区別する
+    etag = file_etag(path, content_encoding)
+    mtime = path.stat().st_mtime
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Cache-Control": f"public, max-age={max_age}",
+        "ETag": etag,
+        "Last-Modified": formatdate(mtime, usegmt=True),
+        "Vary": "Accept-Encoding"
+    }
+
+    if_none_match = request.headers.get('if-none-match')
+    if _etag_matches(if_none_match, etag) or \
+            (if_none_match is None and _not_modified_since(request.headers.get('if-modified-since'), mtime)):
+        return Response(status_code=304, headers=headers)
+
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+
+    return FileResponse(str(served_path), media_type=media_type, headers=headers)
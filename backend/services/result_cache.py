@@ -0,0 +1,215 @@
+"""
+/analyze の解析結果キャッシュ
+入力（モード・画像・範囲・ポリゴン・森林簿ID・解析バージョン）から安定したキーを作り、
+メモリ（合計サイズ上限つきのLRU）と、任意でディスク（ResultStore に保存済みの結果への索引）に保持する
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+# キーに含める座標の桁数（1e-7度 ≈ 1cm）
+COORD_DIGITS = 7
+
+# 期限切れのディスク索引を削除する間隔（秒）
+CLEANUP_INTERVAL = 60
+
+
+def normalize_polygon(polygon_coords: list) -> list:
+    """
+    ポリゴンを比較用の [[lon, lat], ...] にそろえる
+    座標を丸め、閉じた終点・連続する重複点を除き、反時計回り・最小の頂点から始まる順にする
+    """
+    if not polygon_coords:
+        return None
+    ring = []
+    for coord in polygon_coords:
+        point = [round(coord['lon'], COORD_DIGITS), round(coord['lat'], COORD_DIGITS)]
+        if not ring or ring[-1] != point:
+            ring.append(point)
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring.pop()
+
+    # 向き（符号付き面積が負なら時計回り）をそろえる
+    area = sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]))
+    if area < 0:
+        ring.reverse()
+    start = ring.index(min(ring))
+    return ring[start:] + ring[:start]
+
+
+def analysis_cache_key(mode: str, bbox: tuple, polygon_coords: list = None,
+                       forest_registry_id: str = None, file_fingerprint: str = None,
+                       version: str = '') -> str:
+    """解析入力から安定したキー（sha256）を作る"""
+    payload = {
+        'mode': mode,
+        'bbox': [round(v, COORD_DIGITS) for v in bbox],
+        'polygon': normalize_polygon(polygon_coords),
+        'forest_registry_id': forest_registry_id or None,
+        'file': file_fingerprint,
+        'version': version
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def _result_size(result: dict) -> int:
+    """結果の概算サイズ（列の配列 + サマリー分）"""
+    tree_points = result.get('tree_points')
+    if isinstance(tree_points, dict):
+        return sum(values.nbytes for values in tree_points.values()) + 1024
+    return 1024 + 100 * len(tree_points or [])
+
+
+class ResultCache:
+    """
+    解析結果のキャッシュ
+    - メモリ: 合計サイズ max_bytes までのLRU（max_bytes=0 で無効）
+    - ディスク: index_dir に キー -> result_id の索引を置き、結果本体は ResultStore から読み込む
+      （APIのプロセス間・再起動後も共有される。result_store を指定しない場合は無効）
+    いずれも保存から ttl 秒で期限切れ
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, ttl: int = 3600,
+                 result_store=None, index_dir=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.result_store = result_store
+        self.index_dir = Path(index_dir) if index_dir and result_store is not None else None
+        if self.index_dir is not None:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+        self._cache = OrderedDict()  # key -> (result, size, created_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self._last_cleanup = 0.0
+
+    def get(self, key: str) -> tuple:
+        """(結果, 'memory' / 'disk') を返す（ない・期限切れの場合は (None, None)）"""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                result, size, created_at = entry
+                if time.time() - created_at <= self.ttl:
+                    self._cache.move_to_end(key)
+                    self.memory_hits += 1
+                    return dict(result), 'memory'
+                del self._cache[key]
+                self._bytes -= size
+                self.expired += 1
+
+        result, created_at = self._get_from_disk(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None, None
+            self.disk_hits += 1
+        # メモリに載せても期限はディスク索引の保存時刻から数える
+        self._insert(key, result, created_at)
+        return dict(result), 'disk'
+
+    def put(self, key: str, result: dict):
+        """
+        解析結果を保存（ディスクには ResultStore に保存済み = result_id がある結果だけ索引する）
+        期限は結果の保存時刻から数え、参照先の結果より長く残らないようにする
+        """
+        created_at = time.time()
+        if result.get('result_id') and self.result_store is not None:
+            created_at = self.result_store.saved_at(result['result_id']) or created_at
+        self._insert(key, dict(result), created_at)
+        if self.index_dir is not None and result.get('result_id'):
+            self._write_index(key, result['result_id'])
+
+    def _insert(self, key: str, result: dict, created_at: float):
+        if self.max_bytes <= 0:
+            return
+        size = _result_size(result)
+        with self._lock:
+            if size > self.max_bytes:
+                # 上限を超えるものはキャッシュしない
+                return
+            if key in self._cache:
+                self._bytes -= self._cache.pop(key)[1]
+            self._cache[key] = (result, size, created_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._cache:
+                _, (_, evicted_size, _) = self._cache.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def _index_path(self, key: str) -> Path:
+        return self.index_dir / f"{key}.json"
+
+    def _get_from_disk(self, key: str) -> tuple:
+        """ディスク索引から (結果, 索引の保存時刻) を返す（ない・期限切れは (None, None)）"""
+        if self.index_dir is None:
+            return None, None
+        path = self._index_path(key)
+        try:
+            created_at = path.stat().st_mtime
+            if time.time() - created_at > self.ttl:
+                return None, None
+            result_id = json.loads(path.read_text())['result_id']
+        except (FileNotFoundError, ValueError, KeyError):
+            return None, None
+
+        stored = self.result_store.load(result_id)
+        if stored is None:
+            return None, None
+        result = dict(stored['summary'])
+        result['tree_points'] = stored['tree_points']
+        result['result_id'] = result_id
+        # 索引は結果の保存後に書くため、結果の保存時刻の方が古ければそちらに合わせる
+        saved_at = self.result_store.saved_at(result_id)
+        return result, min(created_at, saved_at) if saved_at else created_at
+
+    def _write_index(self, key: str, result_id: str):
+        # ディレクトリ全体を見るため、期限切れの削除は CLEANUP_INTERVAL ごとに1回だけ行う
+        now = time.time()
+        if now - self._last_cleanup >= CLEANUP_INTERVAL:
+            self._last_cleanup = now
+            self.cleanup_expired()
+        path = self._index_path(key)
+        tmp_path = path.with_name(f"{key}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps({'result_id': result_id}))
+        os.replace(tmp_path, path)
+
+    def cleanup_expired(self):
+        """期限切れのディスク索引を削除"""
+        if self.index_dir is None:
+            return
+        now = time.time()
+        for path in self.index_dir.glob("*.json"):
+            try:
+                if now - path.stat().st_mtime > self.ttl:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        """ヒット率・使用量"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'entries': len(self._cache),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'disk': self.index_dir is not None
+            }
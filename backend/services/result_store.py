@@ -0,0 +1,99 @@
+import json
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from services.analysis_service import TREE_COLUMNS, empty_tree_columns
+
+
+_RESULT_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ResultStore:
+    """
+    解析結果（サマリーと樹木位置の列）を result_id で保存するストア
+    APIプロセスと解析ワーカープロセスで共有するディレクトリに {result_id}.npz として保存する
+    保存から ttl 秒を過ぎた結果は削除される
+    """
+
+    def __init__(self, result_dir, ttl: int = 3600):
+        self.result_dir = Path(result_dir)
+        self.result_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+
+    def _path(self, result_id: str) -> Path:
+        if not _RESULT_ID.match(result_id or ''):
+            raise ValueError(f"不正な結果IDです: {result_id}")
+        return self.result_dir / f"{result_id}.npz"
+
+    def save(self, result: dict, bbox: tuple = None) -> str:
+        """
+        解析結果を保存して result_id を返す（期限切れの結果もここで削除）
+        bbox（min_lon, min_lat, max_lon, max_lat）は密度ラスターの範囲に使う
+        """
+        self.cleanup_expired()
+        result_id = uuid.uuid4().hex
+        path = self._path(result_id)
+        columns = result.get('tree_points')
+        if columns is None or isinstance(columns, list):
+            columns = empty_tree_columns()
+        summary = {key: value for key, value in result.items() if key not in ('tree_points', 'result_id')}
+
+        # 書き込み途中のファイルを読まれないよう一時ファイルから置き換える
+        tmp_path = path.with_name(f"{result_id}.tmp.npz")
+        np.savez(
+            tmp_path,
+            summary=np.frombuffer(json.dumps(summary, ensure_ascii=False).encode('utf-8'), dtype=np.uint8),
+            bbox=np.array(bbox if bbox else [], dtype=np.float64),
+            **{key: columns[key] for key in TREE_COLUMNS}
+        )
+        os.replace(tmp_path, path)
+        return result_id
+
+    def load(self, result_id: str) -> dict:
+        """
+        保存した結果を {'summary': {...}, 'bbox': (...) または None, 'tree_points': 列} で返す
+        存在しない・期限切れはNone
+        """
+        try:
+            path = self._path(result_id)
+        except ValueError:
+            return None
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                return None
+            with np.load(path) as data:
+                return {
+                    'summary': json.loads(data['summary'].tobytes().decode('utf-8')),
+                    'bbox': tuple(data['bbox'].tolist()) or None,
+                    'tree_points': {key: data[key] for key in TREE_COLUMNS}
+                }
+        except FileNotFoundError:
+            return None
+
+    def saved_at(self, result_id: str) -> float:
+        """結果の保存時刻（存在しない場合はNone）。期限は saved_at + ttl"""
+        try:
+            return self._path(result_id).stat().st_mtime
+        except (ValueError, FileNotFoundError):
+            return None
+
+    def delete(self, result_id: str):
+        try:
+            self._path(result_id).unlink()
+        except (ValueError, FileNotFoundError):
+            pass
+
+    def cleanup_expired(self):
+        """保存から ttl 秒を過ぎた結果を削除"""
+        now = time.time()
+        for path in self.result_dir.glob("*.npz"):
+            try:
+                if now - path.stat().st_mtime > self.ttl:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
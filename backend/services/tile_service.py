@@ -0,0 +1,159 @@
+import math
+from pathlib import Path
+
+
+# Webメルカトル（EPSG:3857）の定数
+EARTH_RADIUS = 6378137.0
+ORIGIN_SHIFT = math.pi * EARTH_RADIUS
+MAX_LATITUDE = 85.0511287798066
+
+# ベクトルタイルの内部座標系（MVT標準の4096）
+TILE_EXTENT = 4096
+# タイル境界での描画切れを防ぐバッファ（タイル座標単位）
+TILE_BUFFER = 64
+# 簡略化の許容誤差（画面ピクセル単位、256pxタイル換算）
+SIMPLIFY_TOLERANCE_PX = 0.5
+# これより小さいポリゴンは描画されないため除外（画面ピクセル²単位）
+MIN_POLYGON_AREA_PX = 1.0
+
+
+def lonlat_to_mercator(lon: float, lat: float) -> tuple:
+    """緯度経度をWebメルカトル（m）に変換"""
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    x = lon * ORIGIN_SHIFT / 180.0
+    y = math.log(math.tan((90.0 + lat) * math.pi / 360.0)) * EARTH_RADIUS
+    return x, y
+
+
+def tile_bounds_mercator(z: int, x: int, y: int) -> tuple:
+    """XYZタイルの範囲をWebメルカトル（m）で返す (min_x, min_y, max_x, max_y)"""
+    tile_size = 2 * ORIGIN_SHIFT / (2 ** z)
+    min_x = -ORIGIN_SHIFT + x * tile_size
+    max_y = ORIGIN_SHIFT - y * tile_size
+    return min_x, max_y - tile_size, min_x + tile_size, max_y
+
+
+def tile_bounds_lonlat(z: int, x: int, y: int) -> tuple:
+    """XYZタイルの範囲を緯度経度で返す (min_lon, min_lat, max_lon, max_lat)"""
+    n = 2 ** z
+
+    def _lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return x / n * 360.0 - 180.0, _lat(y + 1), (x + 1) / n * 360.0 - 180.0, _lat(y)
+
+
+def lonlat_to_tile(lon: float, lat: float, z: int) -> tuple:
+    """緯度経度を含むタイル番号 (x, y) を返す"""
+    n = 2 ** z
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_for_bounds(bounds: tuple, z: int):
+    """範囲 (min_lon, min_lat, max_lon, max_lat) を覆うタイル番号を列挙"""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    min_x, min_y = lonlat_to_tile(min_lon, max_lat, z)
+    max_x, max_y = lonlat_to_tile(max_lon, min_lat, z)
+    for tile_x in range(min_x, max_x + 1):
+        for tile_y in range(min_y, max_y + 1):
+            yield tile_x, tile_y
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    """タイル番号が範囲内かチェック"""
+    return 0 <= z <= 24 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+class TileService:
+    """事前生成したベクトルタイル（MVT）のキャッシュを扱うサービス"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+
+    def tile_path(self, z: int, x: int, y: int) -> Path:
+        """タイルファイルのパス（{z}/{x}/{y}.pbf）"""
+        return self.cache_dir / str(z) / str(x) / f"{y}.pbf"
+
+    def get_tile(self, z: int, x: int, y: int):
+        """キャッシュ済みタイルのパスを返す（存在しない場合はNone）"""
+        path = self.tile_path(z, x, y)
+        return path if path.exists() else None
+
+    def get_metadata(self) -> dict:
+        """タイルセットのメタデータ（minzoom, maxzoom, bounds）を取得"""
+        import json
+
+        metadata_path = self.cache_dir / "metadata.json"
+        if not metadata_path.exists():
+            return {}
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def render_tile(self, features: list, z: int, x: int, y: int, layer_name: str):
+        """
+        フィーチャーをタイル範囲でクリップ・簡略化してMVTにエンコード
+        features: [(shapelyジオメトリ（緯度経度）, プロパティ辞書), ...]
+        フィーチャーがない場合はNoneを返す
+        """
+        import mapbox_vector_tile
+        import shapely
+        from shapely.geometry import box
+
+        min_x, min_y, max_x, max_y = tile_bounds_mercator(z, x, y)
+        scale = TILE_EXTENT / (max_x - min_x)
+        buffer_m = TILE_BUFFER / scale
+        clip_box = box(min_x - buffer_m, min_y - buffer_m, max_x + buffer_m, max_y + buffer_m)
+        px = TILE_EXTENT / 256
+        tolerance = SIMPLIFY_TOLERANCE_PX * px
+        min_area = MIN_POLYGON_AREA_PX * px * px
+
+        tile_features = []
+        for geom, properties in features:
+            if geom is None or geom.is_empty:
+                continue
+            merc_geom = shapely.transform(geom, _to_mercator)
+            clipped = merc_geom.intersection(clip_box)
+            if clipped.is_empty:
+                continue
+            tile_geom = shapely.transform(
+                clipped, lambda c: _mercator_to_tile(c, min_x, min_y, scale)
+            )
+            tile_geom = tile_geom.simplify(tolerance, preserve_topology=True)
+            if tile_geom.is_empty:
+                continue
+            if tile_geom.geom_type in ('Polygon', 'MultiPolygon') and tile_geom.area < min_area:
+                continue
+            tile_features.append({
+                "geometry": tile_geom,
+                "properties": {
+                    k: v for k, v in (properties or {}).items()
+                    if isinstance(v, (str, int, float, bool))
+                }
+            })
+
+        if not tile_features:
+            return None
+
+        return mapbox_vector_tile.encode([{"name": layer_name, "features": tile_features}])
+
+
+def _to_mercator(coords):
+    """座標配列（緯度経度）をWebメルカトルに変換（shapely.transform用）"""
+    import numpy as np
+
+    out = np.empty_like(coords)
+    lat = np.clip(coords[:, 1], -MAX_LATITUDE, MAX_LATITUDE)
+    out[:, 0] = coords[:, 0] * ORIGIN_SHIFT / 180.0
+    out[:, 1] = np.log(np.tan((90.0 + lat) * np.pi / 360.0)) * EARTH_RADIUS
+    return out
+
+
+def _mercator_to_tile(coords, min_x: float, min_y: float, scale: float):
+    """Webメルカトル座標をタイル内座標に変換"""
+    out = coords.copy()
+    out[:, 0] = (coords[:, 0] - min_x) * scale
+    out[:, 1] = (coords[:, 1] - min_y) * scale
+    return out
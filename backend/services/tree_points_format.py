@@ -0,0 +1,251 @@
+"""
+解析結果（樹木位置）のレスポンス形式
+- json: 従来どおり tree_points を {lat, lon, tree_type, dbh, volume} のリストで返す（モデル検証は省略）
+- columnar: tree_points を列ごとの配列で返すJSON
+- binary: bbox原点からのfloat32オフセットなどを詰めたバイナリ
+- arrow: Apache Arrow IPCストリーム（pyarrowがインストールされている場合）
+- summary: tree_points を含めずサマリー（result_id など）だけ返すJSON（樹木は /results/{id}/clusters で取得）
+- geotiff: セルごとの本数・材積に集計した密度ラスター（services.density_service）
+- ndjson: 1行目にサマリー、以降に樹木位置を1行1本で順に送るストリーム（iter_ndjson）
+"""
+import json
+import struct
+
+import numpy as np
+
+from services.analysis_service import TREE_TYPES, tree_points_to_list
+
+
+FORMATS = ('json', 'columnar', 'binary', 'arrow', 'ndjson', 'summary', 'geotiff')
+
+BINARY_MEDIA_TYPE = 'application/vnd.tree-points'
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+BINARY_MAGIC = b'TRP1'
+
+# Acceptヘッダーのメディアタイプ -> 形式
+_ACCEPT_FORMATS = {
+    BINARY_MEDIA_TYPE: 'binary',
+    'application/octet-stream': 'binary',
+    ARROW_MEDIA_TYPE: 'arrow',
+    NDJSON_MEDIA_TYPE: 'ndjson',
+    'application/ndjson': 'ndjson',
+    'image/tiff': 'geotiff',
+}
+
+# ndjson で1回に送る樹木位置の本数
+NDJSON_CHUNK_SIZE = 5000
+
+
+def negotiate_format(format_param: str = None, accept: str = None) -> str:
+    """?format= を優先し、なければAcceptヘッダーから形式を決める（既定はjson）"""
+    if format_param:
+        if format_param not in FORMATS:
+            raise ValueError(f"formatは {', '.join(FORMATS)} のいずれかを指定してください")
+        return format_param
+    for part in (accept or '').split(','):
+        media_type = part.split(';')[0].strip().lower()
+        if media_type in _ACCEPT_FORMATS:
+            return _ACCEPT_FORMATS[media_type]
+    return 'json'
+
+
+def _summary(result: dict) -> dict:
+    return {key: value for key, value in result.items() if key != 'tree_points'}
+
+
+def _columns(tree_points) -> dict:
+    """リスト形式の tree_points も列形式にそろえる"""
+    if not isinstance(tree_points, list):
+        return tree_points
+    return {
+        'lat': np.array([p['lat'] for p in tree_points], dtype=np.float64),
+        'lon': np.array([p['lon'] for p in tree_points], dtype=np.float64),
+        'tree_type': np.array([TREE_TYPES.index(p['tree_type']) for p in tree_points], dtype=np.uint8),
+        'dbh': np.array([p['dbh'] for p in tree_points], dtype=np.float32),
+        'volume': np.array([p['volume'] for p in tree_points], dtype=np.float32)
+    }
+
+
+def encode_json(result: dict) -> bytes:
+    """従来形式のJSON（tree_points は辞書のリスト）"""
+    body = _summary(result)
+    body['tree_points'] = tree_points_to_list(result['tree_points'])
+    return json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def encode_columnar(result: dict) -> bytes:
+    """
+    tree_points を列ごとの配列にしたJSON
+    {"tree_points": {"count": n, "tree_types": [...], "lat": [...], "lon": [...],
+                     "tree_type": [0, 1, ...], "dbh": [...], "volume": [...]}}
+    """
+    columns = _columns(result['tree_points'])
+    body = _summary(result)
+    body['tree_points'] = {
+        'count': int(len(columns['lat'])),
+        'tree_types': list(TREE_TYPES),
+        'lat': columns['lat'].tolist(),
+        'lon': columns['lon'].tolist(),
+        'tree_type': columns['tree_type'].tolist(),
+        'dbh': np.round(columns['dbh'].astype(np.float64), 1).tolist(),
+        'volume': np.round(columns['volume'].astype(np.float64), 3).tolist()
+    }
+    return json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def encode_binary(result: dict, origin: tuple) -> bytes:
+    """
+    バイナリ形式（リトルエンディアン）
+      magic 'TRP1' | uint32 ヘッダー長 | ヘッダーJSON（8バイト境界まで空白で埋める）
+      | float32 lon - origin_lon [n] | float32 lat - origin_lat [n]
+      | float32 dbh [n] | float32 volume [n] | uint8 tree_type [n]
+    原点（bboxの南西端）からのオフセットをfloat32で持つため、1km程度の範囲なら誤差は数mm
+    ヘッダーJSONには解析結果のサマリー・原点・件数・列の並びを含める
+    """
+    columns = _columns(result['tree_points'])
+    count = int(len(columns['lat']))
+    origin_lon, origin_lat = origin
+
+    header = _summary(result)
+    header.update({
+        'count': count,
+        'origin': [origin_lon, origin_lat],
+        'tree_types': list(TREE_TYPES),
+        'columns': [
+            ['lon', 'float32'], ['lat', 'float32'], ['dbh', 'float32'],
+            ['volume', 'float32'], ['tree_type', 'uint8']
+        ]
+    })
+    header_bytes = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    # 列の先頭を8バイト境界にそろえる（Float32Arrayでそのまま読めるように）
+    header_bytes += b' ' * (-(len(BINARY_MAGIC) + 4 + len(header_bytes)) % 8)
+
+    return b''.join([
+        BINARY_MAGIC,
+        struct.pack('<I', len(header_bytes)),
+        header_bytes,
+        (columns['lon'] - origin_lon).astype('<f4').tobytes(),
+        (columns['lat'] - origin_lat).astype('<f4').tobytes(),
+        columns['dbh'].astype('<f4').tobytes(),
+        columns['volume'].astype('<f4').tobytes(),
+        columns['tree_type'].astype(np.uint8).tobytes()
+    ])
+
+
+def decode_binary(data: bytes) -> dict:
+    """encode_binary の逆変換（動作確認・Pythonクライアント用）"""
+    if data[:4] != BINARY_MAGIC:
+        raise ValueError("樹木位置バイナリではありません")
+    header_len = struct.unpack('<I', data[4:8])[0]
+    header = json.loads(data[8:8 + header_len])
+    count = header['count']
+    offset = 8 + header_len
+
+    def _take(dtype):
+        nonlocal offset
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += array.nbytes
+        return array
+
+    origin_lon, origin_lat = header['origin']
+    lon = _take('<f4').astype(np.float64) + origin_lon
+    lat = _take('<f4').astype(np.float64) + origin_lat
+    dbh = _take('<f4')
+    volume = _take('<f4')
+    tree_type = _take(np.uint8)
+    return {
+        'header': header,
+        'tree_points': {'lat': lat, 'lon': lon, 'tree_type': tree_type, 'dbh': dbh, 'volume': volume}
+    }
+
+
+def encode_arrow(result: dict) -> bytes:
+    """Apache Arrow IPCストリーム（サマリーはスキーマのメタデータ 'summary' にJSONで格納）"""
+    import pyarrow as pa
+
+    columns = _columns(result['tree_points'])
+    table = pa.table({
+        'lat': pa.array(columns['lat'], type=pa.float64()),
+        'lon': pa.array(columns['lon'], type=pa.float64()),
+        'tree_type': pa.DictionaryArray.from_arrays(
+            pa.array(columns['tree_type'], type=pa.uint8()), pa.array(TREE_TYPES)
+        ),
+        'dbh': pa.array(columns['dbh'], type=pa.float32()),
+        'volume': pa.array(columns['volume'], type=pa.float32())
+    })
+    table = table.replace_schema_metadata({
+        'summary': json.dumps(_summary(result), ensure_ascii=False)
+    })
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_result(result: dict, output_format: str, origin: tuple) -> tuple:
+    """指定形式でエンコードして (本文, メディアタイプ) を返す"""
+    if output_format == 'columnar':
+        return encode_columnar(result), 'application/json'
+    if output_format == 'summary':
+        return json.dumps(_summary(result), ensure_ascii=False).encode('utf-8'), 'application/json'
+    if output_format == 'binary':
+        return encode_binary(result, origin), BINARY_MEDIA_TYPE
+    if output_format == 'arrow':
+        return encode_arrow(result), ARROW_MEDIA_TYPE
+    return encode_json(result), 'application/json'
+
+
+def iter_column_chunks(tree_points, chunk_size: int = NDJSON_CHUNK_SIZE):
+    """列形式の tree_points を chunk_size 本ずつのスライス（コピーしないビュー）に分けて返す"""
+    columns = _columns(tree_points)
+    count = len(columns['lat'])
+    for start in range(0, count, chunk_size):
+        yield {key: values[start:start + chunk_size] for key, values in columns.items()}
+
+
+def iter_ndjson(summary: dict, chunks, chunk_size: int = NDJSON_CHUNK_SIZE):
+    """
+    NDJSONストリーム（StreamingResponse 用のジェネレーター）
+      {"type": "summary", "tree_count": ..., "volume_m3": ..., ...}
+      {"type": "tree_point", "lat": ..., "lon": ..., "tree_type": ..., "dbh": ..., "volume": ...}  ×本数
+      {"type": "end", "point_count": n}
+    chunks は列形式の tree_points を順に返すイテラブル（遅延生成でよい）
+    chunk_size 本ごとに1回送るため、保持するのは列のチャンクと送信中の1チャンク分だけ
+    途中で失敗した場合は {"type": "error", "message": ...} を送って終える（end行がなければ不完全）
+    """
+    head = {'type': 'summary'}
+    head.update({key: value for key, value in summary.items() if key != 'tree_points'})
+    yield _ndjson_line(head)
+
+    count = 0
+    try:
+        for chunk in chunks:
+            for part in iter_column_chunks(chunk, chunk_size):
+                if len(part['lat']) == 0:
+                    continue
+                yield _tree_point_lines(part)
+                count += len(part['lat'])
+    except Exception as e:
+        print(f"ストリーミング出力エラー: {e}")
+        yield _ndjson_line({'type': 'error', 'message': str(e), 'point_count': count})
+        return
+
+    yield _ndjson_line({'type': 'end', 'point_count': count})
+
+
+def _tree_point_lines(columns: dict) -> bytes:
+    """列のチャンクを tree_point 行にまとめて変換（1本ずつ json.dumps するより速い）"""
+    types = [TREE_TYPES[t] for t in columns['tree_type'].tolist()]
+    dbhs = np.round(columns['dbh'].astype(np.float64), 1).tolist()
+    volumes = np.round(columns['volume'].astype(np.float64), 3).tolist()
+    lines = [
+        f'{{"type":"tree_point","lat":{lat!r},"lon":{lon!r},"tree_type":"{t}","dbh":{dbh!r},"volume":{volume!r}}}\n'
+        for lat, lon, t, dbh, volume in zip(columns['lat'].tolist(), columns['lon'].tolist(), types, dbhs, volumes)
+    ]
+    return ''.join(lines).encode('utf-8')
+
+
+def _ndjson_line(obj: dict) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
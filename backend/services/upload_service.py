@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+
+class UploadTooLargeError(ValueError):
+    """アップロードサイズが上限を超えた"""
+
+
+class UploadOffsetError(ValueError):
+    """分割アップロードのオフセットが現在の受信済みサイズと一致しない"""
+
+    def __init__(self, message: str, offset: int):
+        super().__init__(message)
+        self.offset = offset
+
+
+class UploadService:
+    """
+    アップロードファイルを一定サイズのチャンクでディスクに書き込むサービス
+    - save_stream: UploadFile を一定メモリで一時ファイルに保存（任意でsha256を計算）
+    - create_session / append_chunk / complete: 大きなファイル向けの再開可能な分割アップロード
+    """
+
+    def __init__(self, upload_dir: str, max_bytes: int, chunk_size: int = 8 * 1024 * 1024,
+                 session_ttl: int = 24 * 3600, lock_timeout: int = 600):
+        self.upload_dir = upload_dir
+        self.session_dir = os.path.join(upload_dir, 'upload_sessions')
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.session_ttl = session_ttl
+        # これより古いロックファイルは異常終了したプロセスのものとみなして取り直す
+        self.lock_timeout = lock_timeout
+        os.makedirs(self.session_dir, exist_ok=True)
+
+    async def save_stream(self, file, suffix: str = '', compute_hash: bool = False) -> dict:
+        """
+        UploadFile をチャンクごとに一時ファイルへ書き込む
+        上限を超えた時点で書き込みを中止して UploadTooLargeError
+        戻り値: {'path', 'size', 'sha256'}
+        """
+        from starlette.concurrency import run_in_threadpool
+
+        digest = hashlib.sha256() if compute_hash else None
+        fd, tmp_path = tempfile.mkstemp(suffix=suffix, dir=self.upload_dir)
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = await file.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLargeError(
+                            f"ファイルサイズが上限（{self.max_bytes // (1024 * 1024)} MB）を超えています"
+                        )
+                    # ハッシュ計算・書き込みはイベントループを止めないようスレッドで実行
+                    if digest is not None:
+                        await run_in_threadpool(digest.update, chunk)
+                    await run_in_threadpool(tmp.write, chunk)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        return {
+            'path': tmp_path,
+            'size': size,
+            'sha256': digest.hexdigest() if digest is not None else None
+        }
+
+    # --- 再開可能な分割アップロード ---
+
+    def _session_path(self, upload_id: str) -> str:
+        return os.path.join(self.session_dir, f"{upload_id}.json")
+
+    def _data_path(self, upload_id: str) -> str:
+        return os.path.join(self.session_dir, f"{upload_id}.part")
+
+    def _lock_path(self, upload_id: str) -> str:
+        return os.path.join(self.session_dir, f"{upload_id}.lock")
+
+    @contextmanager
+    def _session_lock(self, upload_id: str):
+        """
+        セッションの排他ロック（O_EXCLで作るロックファイル、APIの複数プロセス間でも有効）
+        同じセッションへの同時の追記・完了は UploadOffsetError（クライアントは offset を確認して再送する）
+        """
+        lock_path = self._lock_path(upload_id)
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                stale = time.time() - os.path.getmtime(lock_path) > self.lock_timeout
+            except FileNotFoundError:
+                stale = True
+            if not stale:
+                session = self.get_session(upload_id)
+                raise UploadOffsetError(
+                    "このアップロードは別のリクエストで処理中です",
+                    session['offset'] if session else 0
+                )
+            print(f"古いアップロードロックを削除: {lock_path}")
+            os.replace(lock_path, lock_path + '.stale')
+            os.unlink(lock_path + '.stale')
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        os.close(fd)
+        try:
+            yield
+        finally:
+            try:
+                os.unlink(lock_path)
+            except FileNotFoundError:
+                pass
+
+    def _save_session(self, session: dict):
+        path = self._session_path(session['upload_id'])
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(session, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def create_session(self, filename: str, total_size: int, sha256: str = None) -> dict:
+        """分割アップロードを開始（状態はファイルに保存するため再起動後も再開できる）"""
+        if total_size <= 0:
+            raise ValueError("ファイルサイズが不正です")
+        if total_size > self.max_bytes:
+            raise UploadTooLargeError(
+                f"ファイルサイズが上限（{self.max_bytes // (1024 * 1024)} MB）を超えています"
+            )
+
+        self.cleanup_expired()
+
+        upload_id = uuid.uuid4().hex
+        open(self._data_path(upload_id), 'wb').close()
+        session = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'total_size': total_size,
+            'sha256': sha256.lower() if sha256 else None,
+            'created_at': time.time()
+        }
+        self._save_session(session)
+        return self.get_session(upload_id)
+
+    def get_session(self, upload_id: str) -> dict:
+        """セッション情報と受信済みサイズ（offset）を取得（存在しなければNone）"""
+        if not upload_id.isalnum():
+            return None
+        try:
+            with open(self._session_path(upload_id), 'r', encoding='utf-8') as f:
+                session = json.load(f)
+        except FileNotFoundError:
+            return None
+        session['offset'] = os.path.getsize(self._data_path(upload_id))
+        session['chunk_size'] = self.chunk_size
+        return session
+
+    async def append_chunk(self, upload_id: str, offset: int, stream) -> dict:
+        """
+        offsetの位置からチャンクを追記（streamは bytes の非同期イテレータ）
+        offsetが受信済みサイズと異なる場合・同じセッションに別のチャンクを受信中の場合は
+        UploadOffsetError（クライアントは offset から再送する）
+        """
+        from starlette.concurrency import run_in_threadpool
+
+        if self.get_session(upload_id) is None:
+            return None
+
+        with self._session_lock(upload_id):
+            # ロックを取ってから受信済みサイズを確認する（同じoffsetへの同時追記を防ぐ）
+            session = self.get_session(upload_id)
+            if session is None:
+                return None
+            if offset != session['offset']:
+                raise UploadOffsetError("オフセットが受信済みサイズと一致しません", session['offset'])
+
+            size = session['offset']
+            with open(self._data_path(upload_id), 'ab') as f:
+                try:
+                    async for chunk in stream:
+                        if size + len(chunk) > session['total_size']:
+                            raise UploadTooLargeError("宣言されたファイルサイズを超えています")
+                        await run_in_threadpool(f.write, chunk)
+                        size += len(chunk)
+                except BaseException:
+                    # 途中まで書いた分を取り消して受信済みサイズを元に戻す（切断時も同様）
+                    f.truncate(session['offset'])
+                    raise
+
+        session['offset'] = size
+        return session
+
+    def complete(self, upload_id: str) -> dict:
+        """
+        分割アップロードを完了して一時ファイルのパスを返す
+        サイズとsha256（指定されていれば）を確認し、セッションは削除する
+        ファイル全体を読むため、APIからはスレッドプールで呼び出す
+        """
+        if self.get_session(upload_id) is None:
+            return None
+
+        with self._session_lock(upload_id):
+            session = self.get_session(upload_id)
+            if session is None:
+                return None
+            if session['offset'] != session['total_size']:
+                raise UploadOffsetError("まだすべてのチャンクを受信していません", session['offset'])
+
+            data_path = self._data_path(upload_id)
+            digest = None
+            if session['sha256']:
+                h = hashlib.sha256()
+                with open(data_path, 'rb') as f:
+                    while True:
+                        chunk = f.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        h.update(chunk)
+                digest = h.hexdigest()
+                if digest != session['sha256']:
+                    self._remove_session(upload_id)
+                    raise ValueError("sha256が一致しません")
+
+            suffix = os.path.splitext(session['filename'])[1]
+            fd, tmp_path = tempfile.mkstemp(suffix=suffix, dir=self.upload_dir)
+            os.close(fd)
+            os.replace(data_path, tmp_path)
+            os.unlink(self._session_path(upload_id))
+
+        return {'path': tmp_path, 'size': session['total_size'], 'sha256': digest,
+                'filename': session['filename']}
+
+    def abort(self, upload_id: str) -> bool:
+        """分割アップロードを中止して受信済みデータを削除（チャンクの受信中は UploadOffsetError）"""
+        if self.get_session(upload_id) is None:
+            return False
+        with self._session_lock(upload_id):
+            self._remove_session(upload_id)
+        return True
+
+    def _remove_session(self, upload_id: str):
+        for path in (self._data_path(upload_id), self._session_path(upload_id)):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def cleanup_expired(self):
+        """期限切れ（session_ttl経過）のセッションを削除"""
+        now = time.time()
+        for name in os.listdir(self.session_dir):
+            if not name.endswith('.json'):
+                continue
+            upload_id = name[:-len('.json')]
+            try:
+                # 最後にチャンクを受信した時刻から判定
+                if now - os.path.getmtime(self._data_path(upload_id)) > self.session_ttl:
+                    print(f"期限切れのアップロードを削除: {name}")
+                    self.abort(upload_id)
+            except (FileNotFoundError, UploadOffsetError):
+                # 受信中のセッションは次回に回す
+                pass
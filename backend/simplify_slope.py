@@ -1,41 +1,110 @@
 """
 傾斜データを簡略化するスクリプト
+フィーチャーは間引かず、ジオメトリを隣接境界を保ったまま簡略化する
+出力:
+  - slope_simple.geojson: 既定の許容誤差で簡略化・量子化したGeoJSON
+  - slope_simple.topojson: 同じデータの共有アークTopoJSON
+  - slope_lod{n}.geojson / slope_lod{n}.topojson: ズーム帯ごとの簡略化版
 """
 import json
+import math
+import os
 
-def simplify_slope_geojson(input_file, output_file, simplify_factor=10):
+from shapely.geometry import shape, mapping
+
+from services.geojson_stream import iter_features
+from services.lod_service import LOD_LEVELS, lod_path, simplify_geometries
+from topojson_writer import write_topojson
+
+# slope_simple に使う簡略化レベル（〜z11相当）
+DEFAULT_LOD_LEVEL = 2
+
+
+def _write_geojson(output_file, geometries, properties, precision):
+    """簡略化済みジオメトリをGeoJSONとして保存（座標は量子化グリッドの桁数で丸める）"""
+    digits = max(0, math.ceil(-math.log10(precision)))
+
+    def _round(coords):
+        if isinstance(coords, (list, tuple)) and coords and isinstance(coords[0], (int, float)):
+            return [round(c, digits) for c in coords]
+        return [_round(c) for c in coords]
+
+    features = []
+    for geom, props in zip(geometries, properties):
+        geometry = None
+        if geom is not None and not geom.is_empty:
+            geometry = mapping(geom)
+            geometry = {'type': geometry['type'], 'coordinates': _round(geometry['coordinates'])}
+        features.append({'type': 'Feature', 'geometry': geometry, 'properties': props})
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features},
+                  f, ensure_ascii=False, separators=(',', ':'))
+
+
+def _report(path, original_size):
+    size = os.path.getsize(path)
+    print(f"  {path}: {size / (1024 * 1024):.2f} MB（元の {size / original_size * 100:.1f}%）")
+
+
+def simplify_slope_geojson(input_file, output_file):
     """傾斜データを簡略化"""
-    
+
     print(f"傾斜データを簡略化します: {input_file}")
-    
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    print(f"元のフィーチャー数: {len(data['features'])}")
-    
-    # 一定間隔でフィーチャーを間引く
-    simplified_features = data['features'][::simplify_factor]
-    
-    simplified_data = {
-        "type": "FeatureCollection",
-        "features": simplified_features
-    }
-    
-    print(f"簡略化後のフィーチャー数: {len(simplified_features)}")
-    
-    # 保存
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(simplified_data, f, ensure_ascii=False)
-    
-    import os
-    file_size = os.path.getsize(output_file) / (1024 * 1024)
-    print(f"ファイルサイズ: {file_size:.2f} MB")
-    
+
+    # 元のJSON全体を読み込まず、フィーチャーを1件ずつジオメトリに変換する
+    geometries = []
+    properties = []
+    for feature in iter_features(input_file):
+        geometries.append(shape(feature['geometry']) if feature.get('geometry') else None)
+        properties.append(feature.get('properties') or {})
+
+    print(f"フィーチャー数: {len(geometries)}")
+
+    original_size = os.path.getsize(input_file)
+    output_dir = os.path.dirname(output_file)
+    topojson_file = os.path.splitext(output_file)[0] + '.topojson'
+
+    # ズーム帯ごとの簡略化版
+    for lod in LOD_LEVELS:
+        print(f"LOD{lod['level']}（〜z{lod['max_zoom']}, 許容誤差 {lod['tolerance']}°）")
+        simplified = list(simplify_geometries(geometries, lod['tolerance'], lod['precision']))
+
+        geojson_path = lod_path(output_dir, 'slope', lod['level'])
+        _write_geojson(geojson_path, simplified, properties, lod['precision'])
+        _report(geojson_path, original_size)
+
+        topojson_path = geojson_path.with_suffix('.topojson')
+        # 量子化の細かさは帯の量子化グリッドに合わせる
+        write_topojson(topojson_path, simplified, properties, 'slope',
+                       quantization=_quantization_for(geometries, lod['precision']))
+        _report(topojson_path, original_size)
+
+        if lod['level'] == DEFAULT_LOD_LEVEL:
+            _write_geojson(output_file, simplified, properties, lod['precision'])
+            write_topojson(topojson_file, simplified, properties, 'slope',
+                           quantization=_quantization_for(geometries, lod['precision']))
+
+    print(f"簡略化後のフィーチャー数: {len(geometries)}（全フィーチャーを保持）")
+    _report(output_file, original_size)
+    _report(topojson_file, original_size)
+
     return output_file
 
+
+def _quantization_for(geometries, precision):
+    """データ範囲を量子化グリッド（度）で割った分割数"""
+    valid = [g for g in geometries if g is not None and not g.is_empty]
+    if not valid:
+        return 10000
+    width = max(g.bounds[2] for g in valid) - min(g.bounds[0] for g in valid)
+    height = max(g.bounds[3] for g in valid) - min(g.bounds[1] for g in valid)
+    return max(10000, int(math.ceil(max(width, height) / precision)) + 1)
+
+
 if __name__ == "__main__":
     input_file = "data/administrative/keisya/slope.geojson"
     output_file = "data/administrative/keisya/slope_simple.geojson"
-    
-    simplify_slope_geojson(input_file, output_file, simplify_factor=5)
+
+    simplify_slope_geojson(input_file, output_file)
     print("✅ 簡略化完了")
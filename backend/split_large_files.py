@@ -1,43 +1,39 @@
 import json
 import os
+from contextlib import ExitStack
 from pathlib import Path
 
+from services.geojson_stream import iter_features, iter_object_items, FeatureCollectionWriter, JsonObjectWriter
+
 def split_forest_registry():
     """Split forest_registry.geojson by municipality code"""
     input_file = 'frontend/public/data/administrative/kitamirinsyou/forest_registry.geojson'
     output_dir = 'frontend/public/data/administrative/kitamirinsyou/split'
     
-    print(f"Loading {input_file}...")
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    print(f"Total features: {len(data['features'])}")
+    # Create output directory
+    os.makedirs(output_dir, exist_ok=True)
     
-    # Group by municipality code
+    # Stream features and append each one to its municipality file
+    print(f"Streaming {input_file}...")
+    total_features = 0
     by_municipality = {}
-    for feature in data['features']:
-        muni_code = feature['properties'].get('市町村コード', 'unknown')
-        if muni_code not in by_municipality:
-            by_municipality[muni_code] = []
-        by_municipality[muni_code].append(feature)
-    
+    with ExitStack() as stack:
+        for feature in iter_features(input_file):
+            muni_code = feature['properties'].get('市町村コード', 'unknown')
+            writer = by_municipality.get(muni_code)
+            if writer is None:
+                output_file = os.path.join(output_dir, f'forest_{muni_code}.geojson')
+                writer = stack.enter_context(FeatureCollectionWriter(output_file))
+                by_municipality[muni_code] = writer
+            writer.write(feature)
+            total_features += 1
+    
+    print(f"Total features: {total_features}")
     print(f"Found {len(by_municipality)} municipalities")
     
-    # Create output directory
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Save each municipality separately
-    for muni_code, features in by_municipality.items():
-        output_file = os.path.join(output_dir, f'forest_{muni_code}.geojson')
-        geojson = {
-            'type': 'FeatureCollection',
-            'features': features
-        }
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(geojson, f, ensure_ascii=False)
-        
-        file_size = os.path.getsize(output_file) / (1024 * 1024)
-        print(f"  {muni_code}: {len(features)} features, {file_size:.2f} MB")
+    for muni_code, writer in by_municipality.items():
+        file_size = os.path.getsize(writer.path) / (1024 * 1024)
+        print(f"  {muni_code}: {writer.count} features, {file_size:.2f} MB")
     
     # Create index file
     index = {
@@ -55,33 +51,31 @@ def split_layers_index():
     input_file = 'backend/data/administrative/rinsyousigen/layers_index.json'
     output_dir = 'backend/data/administrative/rinsyousigen/split'
     
-    print(f"\nLoading {input_file}...")
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    print(f"Total entries: {len(data)}")
+    # Create output directory
+    os.makedirs(output_dir, exist_ok=True)
     
-    # Group by municipality code (first 5 digits of KEY_CODE)
+    # Stream entries and append each one to its municipality file
+    # (group by first 5 digits of KEY_CODE)
+    print(f"\nStreaming {input_file}...")
+    total_entries = 0
     by_municipality = {}
-    for key, value in data.items():
-        muni_code = key[:5] if len(key) >= 5 else 'unknown'
-        if muni_code not in by_municipality:
-            by_municipality[muni_code] = {}
-        by_municipality[muni_code][key] = value
-    
+    with ExitStack() as stack:
+        for key, value in iter_object_items(input_file):
+            muni_code = key[:5] if len(key) >= 5 else 'unknown'
+            writer = by_municipality.get(muni_code)
+            if writer is None:
+                output_file = os.path.join(output_dir, f'layers_{muni_code}.json')
+                writer = stack.enter_context(JsonObjectWriter(output_file))
+                by_municipality[muni_code] = writer
+            writer.write(key, value)
+            total_entries += 1
+    
+    print(f"Total entries: {total_entries}")
     print(f"Found {len(by_municipality)} municipalities")
     
-    # Create output directory
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Save each municipality separately
-    for muni_code, entries in by_municipality.items():
-        output_file = os.path.join(output_dir, f'layers_{muni_code}.json')
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(entries, f, ensure_ascii=False)
-        
-        file_size = os.path.getsize(output_file) / (1024 * 1024)
-        print(f"  {muni_code}: {len(entries)} entries, {file_size:.2f} MB")
+    for muni_code, writer in by_municipality.items():
+        file_size = os.path.getsize(writer.path) / (1024 * 1024)
+        print(f"  {muni_code}: {writer.count} entries, {file_size:.2f} MB")
     
     # Create index file
     index = {
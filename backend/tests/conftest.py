@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# backend/ を import パスに入れる（アプリと同じく services.* で読み込む）
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
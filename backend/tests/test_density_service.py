@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from services.density_service import band_metadata, colorize, density_grid, encode_geotiff
+
+
+BBOX = (139.0, 35.0, 139.01, 35.01)
+
+
+def _points(lons, lats, volumes=None):
+    n = len(lons)
+    return {
+        'lon': np.asarray(lons, dtype=np.float64),
+        'lat': np.asarray(lats, dtype=np.float64),
+        'tree_type': np.zeros(n, dtype=np.uint8),
+        'dbh': np.full(n, 20.0, dtype=np.float32),
+        'volume': np.asarray(volumes if volumes is not None else np.ones(n), dtype=np.float32),
+    }
+
+
+def test_totals_are_preserved():
+    rng = np.random.default_rng(1)
+    n = 5000
+    points = _points(rng.uniform(BBOX[0], BBOX[2], n), rng.uniform(BBOX[1], BBOX[3], n),
+                     rng.uniform(0.2, 1.2, n))
+    grid = density_grid(points, BBOX, 25.0)
+
+    assert grid['tree_count'].shape == (grid['height'], grid['width'])
+    assert grid['tree_count'].sum() == n
+    assert grid['volume_m3'].sum(dtype=np.float64) == pytest.approx(points['volume'].sum(dtype=np.float64), rel=1e-5)
+
+
+def test_points_land_in_expected_cells():
+    """北が上（行0が北端）、列0が西端。セルは transform で位置と対応する"""
+    lons = [139.0001, 139.0099, 139.0001]
+    lats = [35.0099, 35.0001, 35.0001]
+    grid = density_grid(_points(lons, lats, [1.0, 2.0, 4.0]), BBOX, 100.0)
+
+    inverse = ~grid['transform']
+    cells = [tuple(int(v) for v in inverse * (lon, lat)) for lon, lat in zip(lons, lats)]
+    (nw_col, nw_row), (se_col, se_row), (sw_col, sw_row) = cells
+    assert (nw_col, nw_row) == (0, 0)
+    assert se_col == grid['width'] - 1 and se_row > nw_row
+    assert sw_col == 0 and sw_row == se_row
+    assert grid['tree_count'][nw_row, nw_col] == 1
+    assert grid['volume_m3'][se_row, se_col] == 2.0
+    assert grid['volume_m3'][sw_row, sw_col] == 4.0
+
+    # transform はセル (0, 0) の左上が bbox の北西端
+    assert grid['transform'].c == BBOX[0]
+    assert grid['transform'].f == BBOX[3]
+
+
+def test_edge_points_outside_bbox_are_counted():
+    """メッシュ中心がbboxから半セルはみ出した樹木も数えるよう範囲を広げる"""
+    points = _points([BBOX[2] + 0.00002, BBOX[0] - 0.00002], [BBOX[3] + 0.00002, BBOX[1]])
+    grid = density_grid(points, BBOX, 10.0)
+
+    assert grid['tree_count'].sum() == 2
+    min_lon, min_lat, max_lon, max_lat = grid['bounds']
+    assert min_lon <= BBOX[0] - 0.00002 and max_lon >= BBOX[2] + 0.00002
+    assert max_lat >= BBOX[3] + 0.00002
+
+
+def test_empty_result_uses_bbox():
+    grid = density_grid(_points([], []), BBOX, 50.0)
+    assert grid['tree_count'].sum() == 0
+    assert grid['width'] > 1 and grid['height'] > 1
+
+    with pytest.raises(ValueError):
+        density_grid(_points([], []), None, 50.0)
+
+
+@pytest.mark.parametrize('cell_size', [0.5, 20000.0])
+def test_cell_size_limits(cell_size):
+    with pytest.raises(ValueError):
+        density_grid(_points([139.005], [35.005]), BBOX, cell_size)
+
+
+def test_too_many_cells():
+    with pytest.raises(ValueError):
+        density_grid(_points([], []), (130.0, 30.0, 145.0, 45.0), 1.0)
+
+
+def test_band_metadata_and_geotiff():
+    from rasterio.io import MemoryFile
+
+    points = _points([139.001, 139.001, 139.009], [35.001, 35.001, 35.009], [0.5, 0.25, 1.0])
+    grid = density_grid(points, BBOX, 100.0)
+    metadata = {band['name']: band for band in band_metadata(grid)}
+    assert metadata['tree_count']['max'] == 2 and metadata['tree_count']['total'] == 3
+    assert metadata['volume_m3']['total'] == 1.75
+
+    with MemoryFile(encode_geotiff(grid, {'tree_count': 3, 'result_id': 'abc'})) as memfile:
+        with memfile.open() as src:
+            assert src.count == 2 and src.crs.to_epsg() == 4326
+            assert src.descriptions == ('tree_count', 'volume_m3')
+            np.testing.assert_array_equal(src.read(1), grid['tree_count'])
+            assert src.tags()['analysis_result_id'] == 'abc'
+
+
+def test_colorize_transparent_for_empty_cells():
+    rgba = colorize(np.array([[0.0, np.nan], [1.0, 4.0]], dtype=np.float32), 4.0)
+    assert rgba.shape == (2, 2, 4)
+    assert rgba[0, 0, 3] == 0 and rgba[0, 1, 3] == 0
+    assert rgba[1, 0, 3] > 0 and rgba[1, 1, 3] == 255
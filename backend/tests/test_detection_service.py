@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from services.detection_service import DetectionService, value_range
+
+
+class GridDetector:
+    """パッチ内の一定間隔の位置にボックスを返す（マスクを見ない検出器の代わり）"""
+
+    def __init__(self, step: int = 40, size: int = 10):
+        self.step = step
+        self.size = size
+        self.patches = []
+
+    def predict_batch(self, patches: list) -> list:
+        self.patches.extend(patches)
+        results = []
+        for patch in patches:
+            height, width = patch['mask'].shape
+            ys, xs = np.mgrid[self.step // 2:height:self.step, self.step // 2:width:self.step]
+            xs, ys = xs.ravel().astype(np.float64), ys.ravel().astype(np.float64)
+            half = self.size / 2
+            boxes = np.stack([xs - half, ys - half, xs + half, ys + half], axis=1)
+            results.append((boxes, np.full(len(boxes), 0.9)))
+        return results
+
+
+def _write_image(path, dtype='uint8', masked_left=False):
+    height, width = 300, 400
+    data = (np.random.default_rng(0).uniform(0, 1, (3, height, width)) *
+            (np.iinfo(dtype).max if np.dtype(dtype).kind == 'u' else 5000.0)).astype(dtype)
+    profile = dict(driver='GTiff', width=width, height=height, count=3, dtype=dtype,
+                   crs='EPSG:4326', transform=from_origin(139.0, 35.003, 0.00001, 0.00001))
+    with rasterio.Env(GDAL_TIFF_INTERNAL_MASK=True):
+        with rasterio.open(path, 'w', **profile) as dst:
+            dst.write(data)
+            if masked_left:
+                mask = np.full((height, width), 255, dtype=np.uint8)
+                mask[:, :width // 2] = 0
+                dst.write_mask(mask)
+    return path
+
+
+def _centers(result):
+    return np.array([((d['xmin'] + d['xmax']) / 2, (d['ymin'] + d['ymax']) / 2) for d in result['detections']])
+
+
+def test_boxes_outside_mask_are_dropped_for_any_detector(tmp_path):
+    path = _write_image(tmp_path / 'masked.tif', masked_left=True)
+    service = DetectionService(GridDetector(), patch_size=128, overlap=32)
+    result = service.detect(str(path))
+
+    centers = _centers(result)
+    assert result['count'] > 0
+    assert (centers[:, 0] >= 200).all()
+
+
+def test_polygon_crop_limits_detections(tmp_path):
+    from services.image_service import ImageService
+
+    path = _write_image(tmp_path / 'image.tif')
+    image_service = ImageService(str(tmp_path))
+    polygon = [{'lon': 139.0005, 'lat': 35.0005}, {'lon': 139.0035, 'lat': 35.0005},
+               {'lon': 139.0035, 'lat': 35.0025}, {'lon': 139.0005, 'lat': 35.0025}]
+    crop = image_service.crop_to_bbox(str(path), (139.0, 35.0, 139.004, 35.003), polygon)
+    try:
+        result = DetectionService(GridDetector(), patch_size=128, overlap=32).detect(crop)
+    finally:
+        image_service.release_crop(crop)
+
+    lons = np.array([d['lon'] for d in result['detections']])
+    lats = np.array([d['lat'] for d in result['detections']])
+    assert result['count'] > 0
+    assert ((lons >= 139.0005 - 1e-5) & (lons <= 139.0035 + 1e-5)).all()
+    assert ((lats >= 35.0005 - 1e-5) & (lats <= 35.0025 + 1e-5)).all()
+
+
+@pytest.mark.parametrize('dtype, expected_max', [('uint8', 255.0), ('uint16', None), ('float32', None)])
+def test_value_range_follows_source_dtype(tmp_path, dtype, expected_max):
+    path = _write_image(tmp_path / f'{dtype}.tif', dtype=dtype)
+    with rasterio.open(path) as src:
+        vmin, vmax = value_range(src)
+        data = src.read()
+    if expected_max is not None:
+        assert (vmin, vmax) == (0.0, expected_max)
+    else:
+        assert vmin >= float(data.min()) and vmax <= float(data.max())
+        assert vmax > 255
+
+    detector = GridDetector()
+    DetectionService(detector, patch_size=256, overlap=0).detect(str(path))
+    assert all(patch['value_range'] == (vmin, vmax) for patch in detector.patches)
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from services.geojson_stream import FeatureCollectionWriter, JsonObjectWriter, iter_features, iter_object_items
+
+
+FEATURES = [
+    {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [139.123456789, 35.5]},
+     'properties': {'name': '森林', 'area': 12345, 'tags': ['a', 'b'], 'note': None}},
+    {'type': 'Feature', 'geometry': None, 'properties': {'escaped': 'a"b\\c}]', 'value': -1.5e-7}},
+    {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 0]]]},
+     'properties': {}},
+]
+
+
+def _write(path, obj, **kwargs):
+    path.write_text(json.dumps(obj, ensure_ascii=False, **kwargs), encoding='utf-8')
+    return path
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 64, 1024 * 1024])
+def test_iter_features_across_chunk_boundaries(tmp_path, chunk_size):
+    """値がバッファの境目で切れても（数値の途中を含む）同じ結果になる"""
+    path = _write(tmp_path / 'fc.geojson', {
+        'type': 'FeatureCollection',
+        'name': 'slope',
+        'crs': {'type': 'name', 'properties': {'name': 'EPSG:4326'}},
+        'features': FEATURES,
+        'bbox': [0, 0, 140, 36],
+    })
+    assert list(iter_features(path, chunk_size=chunk_size)) == FEATURES
+
+
+def test_iter_features_pretty_printed_and_empty(tmp_path):
+    pretty = _write(tmp_path / 'pretty.geojson', {'type': 'FeatureCollection', 'features': FEATURES}, indent=2)
+    assert list(iter_features(pretty, chunk_size=5)) == FEATURES
+
+    empty = _write(tmp_path / 'empty.geojson', {'type': 'FeatureCollection', 'features': []})
+    assert list(iter_features(empty)) == []
+
+
+def test_iter_object_items(tmp_path):
+    data = {'01010000100001': [{'layer': 1, 'species': 'スギ'}], '01010000100002': [], 'x': 1.25}
+    path = _write(tmp_path / 'layers.json', data)
+    assert list(iter_object_items(path, chunk_size=4)) == list(data.items())
+
+
+def test_malformed_json_raises(tmp_path):
+    path = tmp_path / 'broken.geojson'
+    path.write_text('{"type": "FeatureCollection", "features": [{"type": "Feature"} {"type": "Feature"}]}',
+                    encoding='utf-8')
+    with pytest.raises(ValueError):
+        list(iter_features(path))
+
+
+def test_writers_round_trip(tmp_path):
+    fc_path = tmp_path / 'out.geojson'
+    with FeatureCollectionWriter(fc_path) as writer:
+        for feature in FEATURES:
+            writer.write(feature)
+    assert writer.count == len(FEATURES)
+    assert json.loads(fc_path.read_text(encoding='utf-8')) == {'type': 'FeatureCollection', 'features': FEATURES}
+    assert list(iter_features(fc_path, chunk_size=16)) == FEATURES
+
+    obj_path = tmp_path / 'out.json'
+    items = [('a', [1, 2]), ('森', {'b': None})]
+    with JsonObjectWriter(obj_path) as writer:
+        for key, value in items:
+            writer.write(key, value)
+    assert list(iter_object_items(obj_path)) == items
@@ -0,0 +1,24 @@
+import services.job_service as job_service
+from services.job_service import JobStore
+
+
+def test_fail_orphaned_after_restart(tmp_path, monkeypatch):
+    """前回の起動で登録された待機中・実行中のジョブは、PIDが同じでも失敗にする"""
+    db_path = tmp_path / 'jobs.sqlite3'
+    store = JobStore(db_path)
+    queued = store.create()
+    running = store.create()
+    store.set_progress(running, 'volume', 0.5)
+    finished = store.create()
+    store.finish(finished, {'tree_count': 0})
+
+    monkeypatch.setattr(job_service, 'BOOT_TOKEN', 'next-boot')
+    restarted = JobStore(db_path)
+    current = restarted.create()
+
+    assert restarted.fail_orphaned() == 2
+    assert restarted.get(queued)['status'] == 'failed'
+    assert restarted.get(running)['status'] == 'failed'
+    assert restarted.get(finished)['status'] == 'succeeded'
+    assert restarted.get(current)['status'] == 'queued'
+    assert restarted.fail_orphaned() == 0
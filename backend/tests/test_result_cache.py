@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+from services.result_cache import ResultCache, analysis_cache_key, normalize_polygon
+
+
+SQUARE = [
+    {'lon': 139.0, 'lat': 35.0},
+    {'lon': 139.01, 'lat': 35.0},
+    {'lon': 139.01, 'lat': 35.01},
+    {'lon': 139.0, 'lat': 35.01},
+]
+
+
+def _closed(ring):
+    return ring + [ring[0]]
+
+
+def test_normalize_polygon_is_order_and_orientation_independent():
+    expected = normalize_polygon(SQUARE)
+
+    rotated = SQUARE[2:] + SQUARE[:2]
+    reversed_ring = SQUARE[::-1]
+    assert normalize_polygon(rotated) == expected
+    assert normalize_polygon(reversed_ring) == expected
+    assert normalize_polygon(_closed(reversed_ring[1:] + reversed_ring[:1])) == expected
+
+
+def test_normalize_polygon_shape():
+    ring = normalize_polygon(SQUARE)
+    # 反時計回り・最小の頂点から始まり、閉じた終点は含めない
+    assert ring[0] == min(ring)
+    assert len(ring) == 4
+    area = sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]))
+    assert area > 0
+
+
+def test_normalize_polygon_drops_duplicates_and_rounds():
+    noisy = [dict(SQUARE[0]), dict(SQUARE[0])] + SQUARE[1:] + [dict(SQUARE[0])]
+    noisy[1]['lon'] += 1e-9  # 1cm未満の違いは丸めで同じ点になる
+    assert normalize_polygon(noisy) == normalize_polygon(SQUARE)
+
+
+def test_normalize_polygon_empty():
+    assert normalize_polygon(None) is None
+    assert normalize_polygon([]) is None
+
+
+def test_cache_key():
+    bbox = (139.0, 35.0, 139.01, 35.01)
+    key = analysis_cache_key('map', bbox, SQUARE, version='1')
+    assert key == analysis_cache_key('map', bbox, SQUARE[::-1], version='1')
+    assert key == analysis_cache_key('map', tuple(v + 1e-9 for v in bbox), SQUARE, version='1')
+    assert len(key) == 64
+
+    assert key != analysis_cache_key('upload', bbox, SQUARE, version='1')
+    assert key != analysis_cache_key('map', bbox, SQUARE, version='2')
+    assert key != analysis_cache_key('map', bbox, SQUARE, forest_registry_id='12-3', version='1')
+    assert key != analysis_cache_key('map', bbox, None, version='1')
+    assert (analysis_cache_key('upload', bbox, file_fingerprint='a' * 64) !=
+            analysis_cache_key('upload', bbox, file_fingerprint='b' * 64))
+
+
+def _result(n):
+    return {
+        'tree_count': n,
+        'tree_points': {key: np.zeros(n, dtype=np.float64) for key in ('lat', 'lon', 'dbh', 'volume')},
+    }
+
+
+def test_memory_lru_bounded_by_bytes():
+    cache = ResultCache(max_bytes=3 * (8 * 4 * 100 + 1024), ttl=60)
+    for i in range(4):
+        cache.put(f'k{i}', _result(100))
+
+    assert cache.get('k0') == (None, None)
+    result, source = cache.get('k3')
+    assert source == 'memory' and result['tree_count'] == 100
+    stats = cache.stats()
+    assert stats['evictions'] == 1 and stats['entries'] == 3
+    assert stats['bytes'] <= stats['max_bytes']
+
+
+def test_memory_entries_expire(monkeypatch):
+    import services.result_cache as result_cache
+
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, 'time', lambda: now[0])
+    cache = ResultCache(max_bytes=1 << 20, ttl=60)
+    cache.put('k', _result(1))
+    assert cache.get('k')[1] == 'memory'
+
+    now[0] += 61
+    assert cache.get('k') == (None, None)
+    assert cache.stats()['expired'] == 1
+
+
+@pytest.mark.parametrize('max_bytes', [0, 10])
+def test_disabled_or_too_small(max_bytes):
+    cache = ResultCache(max_bytes=max_bytes, ttl=60)
+    cache.put('k', _result(10))
+    assert cache.get('k') == (None, None)
+
+
+def test_disk_index_shared_between_instances(tmp_path):
+    """別プロセスのキャッシュ（ディスク索引）から読み込み、期限は結果の保存時刻から数える"""
+    import os
+    import time
+
+    from services.result_store import ResultStore
+
+    store = ResultStore(tmp_path / 'results', ttl=60)
+    result = {'tree_count': 2, 'tree_points': {
+        'lat': np.array([35.0, 35.1]), 'lon': np.array([139.0, 139.1]),
+        'tree_type': np.array([0, 1], dtype=np.uint8),
+        'dbh': np.array([20.0, 30.0], dtype=np.float32),
+        'volume': np.array([0.5, 0.7], dtype=np.float32),
+    }}
+    result['result_id'] = store.save(result)
+    ResultCache(ttl=60, result_store=store, index_dir=tmp_path / 'index').put('k', result)
+
+    other = ResultCache(ttl=60, result_store=store, index_dir=tmp_path / 'index')
+    loaded, source = other.get('k')
+    assert source == 'disk'
+    assert loaded['result_id'] == result['result_id'] and loaded['tree_count'] == 2
+    np.testing.assert_array_equal(loaded['tree_points']['lat'], result['tree_points']['lat'])
+
+    # 索引が新しくても、結果の保存から ttl 秒を過ぎていれば期限切れ
+    old = time.time() - 120
+    os.utime(store._path(result['result_id']), (old, old))
+    fresh = ResultCache(ttl=60, result_store=store, index_dir=tmp_path / 'index')
+    assert fresh.get('k') == (None, None)
@@ -0,0 +1,89 @@
+import json
+
+from shapely.geometry import Polygon, box
+
+from topojson_writer import build_topology, write_topojson
+
+
+def _decode_arc(arc, transform):
+    """差分符号化されたアークを緯度経度に戻す"""
+    (kx, ky), (x0, y0) = transform['scale'], transform['translate']
+    x = y = 0
+    points = []
+    for dx, dy in arc:
+        x += dx
+        y += dy
+        points.append((x0 + x * kx, y0 + y * ky))
+    return points
+
+
+def _ring_points(arc_ids, arcs, transform):
+    """アーク番号の列（負数は ~index の逆向き）をリングの座標に戻す"""
+    points = []
+    for arc_id in arc_ids:
+        arc = _decode_arc(arcs[arc_id if arc_id >= 0 else ~arc_id], transform)
+        if arc_id < 0:
+            arc = arc[::-1]
+        points.extend(arc if not points else arc[1:])
+    return points
+
+
+def test_adjacent_polygons_share_one_arc():
+    left = box(0, 0, 1, 1)
+    right = box(1, 0, 2, 1)
+    topology = build_topology([left, right], [{'id': 1}, {'id': 2}], 'slope', quantization=1001)
+
+    geometries = topology['objects']['slope']['geometries']
+    left_arcs = set(geometries[0]['arcs'][0])
+    right_arcs = set(geometries[1]['arcs'][0])
+    # 共有境界は片方が正、もう片方が逆向き（~index）で同じアークを参照する
+    shared = {a if a >= 0 else ~a for a in left_arcs} & {a if a >= 0 else ~a for a in right_arcs}
+    assert len(shared) == 1
+    # 外周3本（左・右それぞれの共有境界以外）+ 共有1本
+    assert len(topology['arcs']) == 3
+
+
+def test_rings_round_trip_within_quantization():
+    polygon = Polygon([(139.0, 35.0), (139.3, 35.05), (139.2, 35.4), (139.05, 35.3)])
+    topology = build_topology([polygon], [{}], 'slope', quantization=10001)
+
+    geometry = topology['objects']['slope']['geometries'][0]
+    assert geometry['type'] == 'Polygon'
+    points = _ring_points(geometry['arcs'][0], topology['arcs'], topology['transform'])
+    decoded = Polygon(points)
+
+    kx, ky = topology['transform']['scale']
+    assert decoded.symmetric_difference(polygon).area < (kx + ky) * polygon.length
+    assert points[0] == points[-1]
+
+
+def test_holes_and_multipolygons():
+    outer = box(0, 0, 4, 4)
+    with_hole = Polygon(outer.exterior.coords, [box(1, 1, 2, 2).exterior.coords])
+    multi = box(10, 10, 11, 11).union(box(12, 12, 13, 13))
+    topology = build_topology([with_hole, multi], [{}, {}], 'slope', quantization=1001)
+
+    first, second = topology['objects']['slope']['geometries']
+    assert first['type'] == 'Polygon' and len(first['arcs']) == 2
+    assert second['type'] == 'MultiPolygon' and len(second['arcs']) == 2
+
+
+def test_keeps_features_without_geometry():
+    """空・量子化で潰れたジオメトリもフィーチャーとして残し、GeoJSONと並びをそろえる"""
+    tiny = box(0, 0, 1e-9, 1e-9)
+    geometries = [box(0, 0, 1, 1), None, tiny]
+    properties = [{'id': 1}, {'id': 2}, {'id': 3}]
+    topology = build_topology(geometries, properties, 'slope', quantization=1001)
+
+    features = topology['objects']['slope']['geometries']
+    assert [f['properties']['id'] for f in features] == [1, 2, 3]
+    assert [f['type'] for f in features] == ['Polygon', None, None]
+
+
+def test_write_topojson(tmp_path):
+    path = tmp_path / 'slope.topojson'
+    topology = write_topojson(path, [box(0, 0, 1, 1)], [{'name': '傾斜'}], 'slope', quantization=1001)
+
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) == topology
+    assert '傾斜' in path.read_text(encoding='utf-8')
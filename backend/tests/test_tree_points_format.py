@@ -0,0 +1,155 @@
+import json
+
+import numpy as np
+import pytest
+
+from services.analysis_service import TREE_TYPES, tree_points_to_list
+from services.tree_points_format import (
+    BINARY_MAGIC, decode_binary, encode_arrow, encode_binary, encode_columnar, encode_result, negotiate_format
+)
+
+
+ORIGIN = (139.0, 35.0)
+
+
+def _result(n=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        'tree_count': n,
+        'volume_m3': 123.45,
+        'confidence': 'medium',
+        'warnings': ['※MVP版'],
+        'tree_points': {
+            'lat': 35.0 + rng.uniform(0, 0.01, n),
+            'lon': 139.0 + rng.uniform(0, 0.01, n),
+            'tree_type': rng.integers(0, 2, n).astype(np.uint8),
+            'dbh': rng.uniform(15, 45, n).astype(np.float32),
+            'volume': rng.uniform(0.2, 1.2, n).astype(np.float32),
+        },
+    }
+
+
+def test_negotiate_format():
+    assert negotiate_format() == 'json'
+    assert negotiate_format('columnar', 'application/vnd.tree-points') == 'columnar'
+    assert negotiate_format(None, 'text/html, application/vnd.tree-points;q=0.9') == 'binary'
+    assert negotiate_format(None, 'application/vnd.apache.arrow.stream') == 'arrow'
+    with pytest.raises(ValueError):
+        negotiate_format('xml')
+
+
+@pytest.mark.parametrize('n', [0, 1, 1000])
+def test_binary_round_trip(n):
+    result = _result(n)
+    data = encode_binary(result, ORIGIN)
+
+    assert data[:4] == BINARY_MAGIC
+    # 列の先頭は8バイト境界（Float32Array でそのまま読める）
+    header_len = int.from_bytes(data[4:8], 'little')
+    assert (8 + header_len) % 8 == 0
+    assert len(data) == 8 + header_len + n * (4 * 4 + 1)
+
+    decoded = decode_binary(data)
+    header = decoded['header']
+    assert header['count'] == n
+    assert header['origin'] == list(ORIGIN)
+    assert header['tree_count'] == n and header['volume_m3'] == 123.45
+    assert 'tree_points' not in header
+
+    points = decoded['tree_points']
+    original = result['tree_points']
+    # 原点からのfloat32オフセット（1km程度の範囲で誤差は数mm = 1e-7度以下）
+    np.testing.assert_allclose(points['lat'], original['lat'], atol=1e-7)
+    np.testing.assert_allclose(points['lon'], original['lon'], atol=1e-7)
+    np.testing.assert_array_equal(points['tree_type'], original['tree_type'])
+    np.testing.assert_array_equal(points['dbh'], original['dbh'])
+    np.testing.assert_array_equal(points['volume'], original['volume'])
+
+
+def test_binary_rejects_other_data():
+    with pytest.raises(ValueError):
+        decode_binary(b'NOPE' + bytes(8))
+
+
+def test_binary_accepts_list_tree_points():
+    result = _result(10)
+    as_list = dict(result, tree_points=tree_points_to_list(result['tree_points']))
+    decoded = decode_binary(encode_binary(as_list, ORIGIN))['tree_points']
+    np.testing.assert_array_equal(decoded['tree_type'], result['tree_points']['tree_type'])
+
+
+def test_columnar_matches_json_rounding():
+    result = _result(50)
+    body = json.loads(encode_columnar(result))
+    columns = body['tree_points']
+    points = tree_points_to_list(result['tree_points'])
+
+    assert columns['count'] == 50
+    assert columns['tree_types'] == list(TREE_TYPES)
+    assert columns['dbh'] == [p['dbh'] for p in points]
+    assert columns['volume'] == [p['volume'] for p in points]
+    assert [TREE_TYPES[t] for t in columns['tree_type']] == [p['tree_type'] for p in points]
+
+
+def test_arrow_round_trip():
+    pa = pytest.importorskip('pyarrow')
+    result = _result(200)
+
+    table = pa.ipc.open_stream(encode_arrow(result)).read_all()
+    summary = json.loads(table.schema.metadata[b'summary'])
+    assert summary == {key: value for key, value in result.items() if key != 'tree_points'}
+
+    original = result['tree_points']
+    np.testing.assert_array_equal(table['lat'].to_numpy(), original['lat'])
+    np.testing.assert_array_equal(table['lon'].to_numpy(), original['lon'])
+    np.testing.assert_array_equal(table['dbh'].to_numpy(), original['dbh'])
+    np.testing.assert_array_equal(table['volume'].to_numpy(), original['volume'])
+    assert table['tree_type'].to_pylist() == [TREE_TYPES[t] for t in original['tree_type']]
+
+
+def test_encode_result_media_types():
+    result = _result(5)
+    assert encode_result(result, 'binary', ORIGIN)[1] == 'application/vnd.tree-points'
+    assert encode_result(result, 'columnar', ORIGIN)[1] == 'application/json'
+    summary, _ = encode_result(result, 'summary', ORIGIN)
+    assert 'tree_points' not in json.loads(summary)
+    body, _ = encode_result(result, 'json', ORIGIN)
+    assert json.loads(body)['tree_points'] == tree_points_to_list(result['tree_points'])
+
+
+def _ndjson_lines(stream):
+    return [json.loads(line) for line in b''.join(stream).decode('utf-8').splitlines()]
+
+
+def test_ndjson_stream():
+    from services.tree_points_format import iter_column_chunks, iter_ndjson
+
+    result = _result(12)
+    summary = {key: value for key, value in result.items() if key != 'tree_points'}
+    # 空のチャンクは読み飛ばし、チャンクの区切りに関係なく全本数を順に送る
+    chunks = [result['tree_points'], {key: values[:0] for key, values in result['tree_points'].items()}]
+    lines = _ndjson_lines(iter_ndjson(summary, chunks, chunk_size=5))
+
+    assert lines[0] == dict(summary, type='summary')
+    assert lines[-1] == {'type': 'end', 'point_count': 12}
+    points = lines[1:-1]
+    expected = tree_points_to_list(result['tree_points'])
+    assert [dict(p, type='tree_point') for p in expected] == points
+
+    parts = list(iter_column_chunks(result['tree_points'], 5))
+    assert [len(part['lat']) for part in parts] == [5, 5, 2]
+
+
+def test_ndjson_reports_errors_midway():
+    from services.tree_points_format import iter_ndjson
+
+    result = _result(3)
+
+    def failing_chunks():
+        yield result['tree_points']
+        raise RuntimeError('worker failed')
+
+    lines = _ndjson_lines(iter_ndjson({'tree_count': 3}, failing_chunks()))
+    assert lines[0]['type'] == 'summary'
+    assert lines[-1] == {'type': 'error', 'message': 'worker failed', 'point_count': 3}
+    assert all(line['type'] != 'end' for line in lines)
@@ -0,0 +1,162 @@
+"""
+shapelyのポリゴン群をTopoJSON（共有アーク・量子化・差分符号化）に変換するモジュール
+隣接ポリゴンの共有境界は1本のアークとして1回だけ保存される
+"""
+import json
+
+
+def _quantize_ring(coords, x0: float, y0: float, kx: float, ky: float) -> list:
+    """リングの座標を整数グリッドに量子化（連続する重複点は除去、閉じた形で返す）"""
+    ring = []
+    for x, y in coords:
+        point = (int(round((x - x0) / kx)), int(round((y - y0) / ky)))
+        if not ring or ring[-1] != point:
+            ring.append(point)
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring.pop()
+    if len(ring) < 3:
+        return None
+    ring.append(ring[0])
+    return ring
+
+
+def _polygon_rings(geom) -> list:
+    """Polygon/MultiPolygonを [[外周, 穴...], ...] の座標配列に分解"""
+    if geom is None or geom.is_empty:
+        return []
+    if geom.geom_type == 'Polygon':
+        polygons = [geom]
+    elif geom.geom_type == 'MultiPolygon':
+        polygons = list(geom.geoms)
+    else:
+        return []
+    return [[list(p.exterior.coords)] + [list(r.coords) for r in p.interiors] for p in polygons]
+
+
+def _find_junctions(rings: list) -> set:
+    """複数回通過され、かつ前後の点が異なる点（アークの分割点）を求める"""
+    neighbors = {}
+    junctions = set()
+    for ring in rings:
+        n = len(ring) - 1  # 閉じた点を除く
+        for i in range(n):
+            point = ring[i]
+            pair = frozenset((ring[i - 1], ring[(i + 1) % n]))
+            seen = neighbors.get(point)
+            if seen is None:
+                neighbors[point] = pair
+            elif seen != pair:
+                junctions.add(point)
+    return junctions
+
+
+def _cut_ring(ring: list, junctions: set) -> list:
+    """リングを分割点で区切ってアーク（点列）のリストにする"""
+    points = ring[:-1]
+    cut_indices = [i for i, p in enumerate(points) if p in junctions]
+    if not cut_indices:
+        # 分割点のないリングは最小の点から始めて、同じリングが同じアークになるようにする
+        start = points.index(min(points))
+        return [points[start:] + points[:start] + [points[start]]]
+
+    # 最初の分割点から始まるように回転
+    start = cut_indices[0]
+    rotated = points[start:] + points[:start] + [points[start]]
+    arcs = []
+    current = [rotated[0]]
+    for point in rotated[1:]:
+        current.append(point)
+        if point in junctions:
+            arcs.append(current)
+            current = [point]
+    return arcs
+
+
+def _delta_encode(arc: list) -> list:
+    encoded = [list(arc[0])]
+    for (px, py), (x, y) in zip(arc, arc[1:]):
+        encoded.append([x - px, y - py])
+    return encoded
+
+
+def build_topology(geometries: list, properties: list, object_name: str,
+                   quantization: int = 100000) -> dict:
+    """
+    ポリゴン群（緯度経度）からTopoJSONのTopologyオブジェクトを作成
+    フィーチャーはすべて保持する（量子化で潰れたものはジオメトリnull）
+    """
+    valid = [g for g in geometries if g is not None and not g.is_empty]
+    if valid:
+        x0 = min(g.bounds[0] for g in valid)
+        y0 = min(g.bounds[1] for g in valid)
+        x1 = max(g.bounds[2] for g in valid)
+        y1 = max(g.bounds[3] for g in valid)
+    else:
+        x0 = y0 = 0.0
+        x1 = y1 = 1.0
+    kx = (x1 - x0) / (quantization - 1) or 1.0
+    ky = (y1 - y0) / (quantization - 1) or 1.0
+
+    # 量子化後の座標で共有点を判定する
+    quantized = []
+    all_rings = []
+    for geom in geometries:
+        polygons = []
+        for polygon in _polygon_rings(geom):
+            rings = [_quantize_ring(r, x0, y0, kx, ky) for r in polygon]
+            if rings[0] is None:
+                continue
+            rings = [r for r in rings if r is not None]
+            polygons.append(rings)
+            all_rings.extend(rings)
+        quantized.append(polygons)
+
+    junctions = _find_junctions(all_rings)
+
+    arcs = []
+    arc_index = {}
+
+    def _arc_id(arc):
+        key = tuple(arc)
+        if key in arc_index:
+            return arc_index[key]
+        reversed_key = tuple(reversed(arc))
+        if reversed_key in arc_index:
+            return ~arc_index[reversed_key]
+        arc_index[key] = len(arcs)
+        arcs.append(arc)
+        return arc_index[key]
+
+    topo_geometries = []
+    for polygons, props in zip(quantized, properties):
+        topo_polygons = [
+            [[_arc_id(arc) for arc in _cut_ring(ring, junctions)] for ring in rings]
+            for rings in polygons
+        ]
+        if not topo_polygons:
+            geometry = {'type': None}
+        elif len(topo_polygons) == 1:
+            geometry = {'type': 'Polygon', 'arcs': topo_polygons[0]}
+        else:
+            geometry = {'type': 'MultiPolygon', 'arcs': topo_polygons}
+        geometry['properties'] = props
+        topo_geometries.append(geometry)
+
+    return {
+        'type': 'Topology',
+        'transform': {'scale': [kx, ky], 'translate': [x0, y0]},
+        'bbox': [x0, y0, x1, y1],
+        'objects': {
+            object_name: {'type': 'GeometryCollection', 'geometries': topo_geometries}
+        },
+        'arcs': [_delta_encode(arc) for arc in arcs]
+    }
+
+
+def write_topojson(output_file, geometries: list, properties: list, object_name: str,
+                   quantization: int = 100000) -> dict:
+    """TopoJSONファイルを書き出す"""
+    topology = build_topology(geometries, properties, object_name, quantization)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(topology, f, ensure_ascii=False, separators=(',', ':'))
+    return topology